@@ -1,20 +1,56 @@
 """
 # 处理 input_data 的函数,调用各个分析模块并汇总
 """
-from analysis_module.indicators_anlaysis import IndicatorsAnalysis
-from analysis_module.ai_agent import get_completion
+from analysis_module.ai_agent import get_completion, get_completion_parallel, SECTION_MODE
+from analysis_module.summary_classifier import should_use_local_summary, render_local_summary
+from analysis_module.model_router import model_router
+from analysis_module.request_recorder import record_call
+from analysis_module.abnormality_counters import score_and_record
+from analysis_module.summary_index import summary_index, SUMMARY_NN_MODE
+from analysis_module.summary_guard import summary_guard, summary_key, SUMMARY_READY
+import time
 
 
-def ai_analysis(input_data, mode: str):
+def generate_llm_summary(indicators_analysis, to_ai_json_input):
+    """调用大模型生成综合分析，返回 (综合分析, 模型)"""
+    # 按病例复杂度、队列深度及模型近期延迟选择模型
+    route = model_router.choose(indicators_analysis)
+    # few_shot 模式下以相似既往病例替代提示词中的固定示例
+    examples = summary_index.examples(indicators_analysis) if SUMMARY_NN_MODE == "few_shot" else None
+    start = time.perf_counter()
+    try:
+        if SECTION_MODE == "parallel":
+            # 五个字段并发生成，失败的字段用本地模板补齐
+            output, usage = get_completion_parallel(
+                to_ai_json_input, model=route.model, return_usage=True,
+                fallback=render_local_summary(indicators_analysis.overall), examples=examples)
+        else:
+            output, usage = get_completion(to_ai_json_input, model=route.model, return_usage=True,
+                                           examples=examples)
+    except Exception:
+        model_router.record(route, time.perf_counter() - start, ok=False)
+        raise
+    elapsed = time.perf_counter() - start
+    model_router.record(route, elapsed, usage)
+    if SUMMARY_NN_MODE != "off" and not usage.get("failed_sections"):
+        # 完整生成的综合分析保存到近邻索引（部分字段由本地模板补齐的不保存）
+        summary_index.add(indicators_analysis, output, route.model, elapsed)
+    return output, route.model
+
+
+def ai_analysis(input_data, mode: str, deadline_seconds: float = None):
     """
     Processes the input data and validates it.
 
     Args:
         input_data (dict): Input data collected from the Streamlit interface.
+        deadline_seconds (float): 全面分析等待综合分析的最长秒数，默认 SLOW_MODE_DEADLINE_SECONDS，0 为不限
 
     Returns:
         dict: A dictionary containing the status ("success" or "error") and a message.
     """
+    # 配置了 ANALYSIS_RECORD_FILE 时记录脱敏后的输入，用于回放压测
+    record_call(input_data, mode)
     try:
         # 校验必填字段
         required_biochemical_indicators = ["β-CTX", "P1NP", "25-Hydroxy Vitamin D", "N-MID Osteocalcin", "Parathyroid Hormone", "Calcitonin"]
@@ -24,21 +60,9 @@ def ai_analysis(input_data, mode: str):
             if not input_data["biochemical_indicators"].get(field):
                 return {"status": "error", "message": f"Missing required biochemical indicator: {field}"}
 
-        indicators_analysis = IndicatorsAnalysis(age=input_data["patient_info"]["age"])
-        indicators_analysis.judge_is_male(input_data["patient_info"]["gender"])
-        indicators_analysis.β_CTX.value = input_data["biochemical_indicators"]["β-CTX"]
-        indicators_analysis.P1NP.value = input_data["biochemical_indicators"]["P1NP"]
-        indicators_analysis.VD.value = input_data["biochemical_indicators"]["25-Hydroxy Vitamin D"]
-        indicators_analysis.N_MID.value = input_data["biochemical_indicators"]["N-MID Osteocalcin"]
-        indicators_analysis.PTH.value = input_data["biochemical_indicators"]["Parathyroid Hormone"]
-        indicators_analysis.CT.value = input_data["biochemical_indicators"]["Calcitonin"]
-        if input_data["imaging_data"]["Bone Density"] != "未输入":
-            indicators_analysis.has_bone_density = True
-            indicators_analysis.bone_density.value = input_data["imaging_data"]["Bone Density"]
-
-        indicators_analysis.init()
+        # 规则计算，并按日期、科室累加异常计数供检验质控看板实时查看（同一份检测重复分析时只计一次）
+        indicators_analysis = score_and_record(input_data)
         indicators_analysis.patient_indicators_log()
-        indicators_analysis.analysis()
 
         # TODO： 接入大模型
         if mode == "slow":
@@ -50,14 +74,39 @@ def ai_analysis(input_data, mode: str):
                 patient_basic_info["患者身高"] = input_data["patient_info"]["height"]
             if input_data["patient_info"]["weight"] > 20:
                 patient_basic_info["患者体重"] = input_data["patient_info"]["weight"]
-            to_ai_json_input = {"患者基本信息": patient_basic_info,
-                                "骨代谢检验数据": indicators_analysis.to_dict(containing_is_abnormal=False)}
-            output = get_completion(to_ai_json_input, model="gpt-4o")
+            summary_status = SUMMARY_READY
+            use_local_summary = should_use_local_summary(indicators_analysis.overall)
+            # 近邻模式下查找指标高度相似、结果类型一致的既往病例
+            nearest = summary_index.approximate(indicators_analysis) \
+                if SUMMARY_NN_MODE == "approximate" and not use_local_summary else None
+            if use_local_summary:
+                # 分型明确或全部正常的病例直接使用本地模板，不调用大模型
+                output = render_local_summary(indicators_analysis.overall)
+                summary_source = "local"
+                summary_model = ""
+            elif nearest is not None:
+                # 直接复用既往病例的综合分析，不调用大模型
+                output = nearest["summary"]
+                summary_source = "nearest"
+                summary_model = nearest["model"]
+            else:
+                to_ai_json_input = {"患者基本信息": patient_basic_info,
+                                    "骨代谢检验数据": indicators_analysis.to_dict(containing_is_abnormal=False)}
+                # 在时限内等待大模型；超时或熔断时先返回指标逐一分析，超时的调用完成后缓存，供下一次相同请求使用
+                summary_status, generated = summary_guard.run(
+                    summary_key(to_ai_json_input),
+                    lambda: generate_llm_summary(indicators_analysis, to_ai_json_input), deadline_seconds)
+                output, summary_model = generated if generated else (None, "")
+                summary_source = "llm"
             print(output)
 
             result = {
                 "指标逐一分析": indicators_analysis.to_dict(containing_is_abnormal=True),
                 "综合分析及建议": output,
+                "综合分析来源": summary_source,
+                "综合分析模型": summary_model,
+                # ready：已生成；pending：仍在生成，稍后重新请求即可获得；unavailable：大模型暂不可用
+                "综合分析状态": summary_status,
             }
 
             # TODO： 画图
@@ -0,0 +1,237 @@
+"""
+实时异常率计数（检验科管理看板）
+每次规则计算完成后按 (日期, 科室) 累加：检测例数、各指标的结果类型与异常数、总体分型（骨转换类型、维生素D状态、PTH状态、骨密度分级），
+每次只做常数次字典自增；与 llm_metrics 相同，每个线程写入自己的分片、不加锁，合并时才汇总
+
+各入口（界面、HTTP 接口与任务队列、HL7 接收、批量工作列表）通过 score_and_record() 或 score_batch() 计入；
+同一份检测重复计算（重复点击、先快速后全面分析、综合分析生成中重试等）时按 case_key() 只计一次
+
+每个进程定期把计数写入快照目录（ABNORMALITY_SNAPSHOT_DIR）下以进程名命名的文件，互不覆盖；
+进程启动时读入自己的快照继续累加，管理页面（pages/ 下的检验质控看板）读取目录下全部快照并求和，不扫描历史记录
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List
+
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+
+# 为空时不写快照
+SNAPSHOT_DIR = os.getenv("ABNORMALITY_SNAPSHOT_DIR", "abnormality_counters")
+SNAPSHOT_INTERVAL_SECONDS = 30
+# 快照中只保留最近的天数
+RETENTION_DAYS = 400
+# 注册新分片时，分片数超过该值即合并已结束线程的分片
+COMPACT_SHARDS_ABOVE = 64
+# 记住最近计入的检测数，用于跳过重复计算；按 case_key 的哈希分成 RECENT_SHARDS 组，每组各自加锁
+RECENT_CASES = 4096
+RECENT_SHARDS = 16
+DEFAULT_DEPARTMENT = "未填写"
+
+# 指标属性名 -> 看板中显示的名称
+INDICATORS = {"β_CTX": "β-CTX", "P1NP": "P1NP", "VD": "25-羟基维生素D", "N_MID": "N-MID骨钙素",
+              "PTH": "PTH", "CT": "降钙素", "bone_density": "骨密度T值"}
+# overall 中参与计数的分型字段 -> 显示名称
+OVERALL_FIELDS = {"turnover": "骨转换类型", "vitamin_d": "维生素D状态", "pth": "PTH状态", "t_score": "骨密度分级"}
+
+# 计数键为 (日期, 科室, 类别, 名称, 取值)，类别如下
+KIND_CASES = "cases"  # 检测例数，名称与取值为空
+KIND_TESTED = "tested"  # 某指标的检测次数，取值为空
+KIND_ABNORMAL = "abnormal"  # 某指标的异常次数，取值为空
+KIND_RESULT = "result"  # 某指标各结果类型的次数
+KIND_OVERALL = "overall"  # 各总体分型的次数
+
+
+def _merge_into(target: Dict[tuple, int], source: Dict[tuple, int]):
+    for key, count in list(source.items()):
+        target[key] = target.get(key, 0) + count
+
+
+class AbnormalityCounters:
+    def __init__(self, snapshot_path: str = ""):
+        self.snapshot_path = ""
+        self._local = threading.local()
+        # (所属线程, 分片)
+        self._shards: List[tuple] = []
+        # 已结束线程的分片及读入的快照
+        self._retired: Dict[tuple, int] = {}
+        self._register_lock = threading.Lock()
+        # 最近计入的 case_key，按哈希分组，同一 key 总落在同一组，不同组之间互不阻塞
+        self._recent_shards = [(threading.Lock(), OrderedDict()) for _ in range(RECENT_SHARDS)]
+        if snapshot_path:
+            self.use_snapshot(snapshot_path)
+
+    def use_snapshot(self, snapshot_path: str):
+        """设置本进程的快照文件，已有快照时读入继续累加"""
+        with self._register_lock:
+            self.snapshot_path = snapshot_path
+            if os.path.exists(snapshot_path):
+                _merge_into(self._retired, {tuple(row[:5]): row[5] for row in load_snapshot(snapshot_path)["rows"]})
+
+    def _shard(self) -> Dict[tuple, int]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._register_lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > COMPACT_SHARDS_ABOVE:
+                    self._compact()
+        return shard
+
+    def _compact(self):
+        """需持有 _register_lock；已结束的线程不会再写入其分片，可安全合并"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge_into(self._retired, shard)
+        self._shards = alive
+
+    def record(self, indicators_analysis, department: str = "", day: date = None):
+        """计入一次已完成 analysis() 的结果"""
+        shard = self._shard()
+        prefix = ((day or date.today()).isoformat(), department or DEFAULT_DEPARTMENT)
+        keys = [(*prefix, KIND_CASES, "", "")]
+        for attribute in INDICATORS:
+            if attribute == "bone_density" and not indicators_analysis.has_bone_density:
+                continue
+            indicator = getattr(indicators_analysis, attribute)
+            keys.append((*prefix, KIND_TESTED, attribute, ""))
+            keys.append((*prefix, KIND_RESULT, attribute, indicator.result))
+            if indicator.is_abnormal:
+                keys.append((*prefix, KIND_ABNORMAL, attribute, ""))
+        for overall_field in OVERALL_FIELDS:
+            keys.append((*prefix, KIND_OVERALL, overall_field, str(indicators_analysis.overall.get(overall_field, ""))))
+        for key in keys:
+            shard[key] = shard.get(key, 0) + 1
+
+    def record_case(self, key: str, indicators_analysis, department: str = "") -> bool:
+        """
+        计入一份检测的结果；所在分组最近 RECENT_CASES // RECENT_SHARDS 份内已计入过相同 key 的不再计入
+
+        Returns:
+            bool: 是否计入
+        """
+        lock, recent_cases = self._recent_shards[hash(key) % RECENT_SHARDS]
+        with lock:
+            if key in recent_cases:
+                recent_cases.move_to_end(key)
+                return False
+            recent_cases[key] = None
+            while len(recent_cases) > RECENT_CASES // RECENT_SHARDS:
+                recent_cases.popitem(last=False)
+        self.record(indicators_analysis, department)
+        return True
+
+    def snapshot(self) -> Dict[tuple, int]:
+        """合并各线程分片；读取时其他线程可能正在写入，个别计数可能滞后一次"""
+        with self._register_lock:
+            self._compact()
+            merged = dict(self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            _merge_into(merged, shard)
+        return merged
+
+    def write_snapshot(self, path: str = None):
+        """先写临时文件再替换，页面不会读到写了一半的文件"""
+        path = path or self.snapshot_path
+        oldest_day = date.fromordinal(date.today().toordinal() - RETENTION_DAYS).isoformat()
+        rows = [[*key, count] for key, count in sorted(self.snapshot().items()) if key[0] >= oldest_day]
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"generated_at": time.time(), "rows": rows}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+
+def load_snapshot(path: str) -> dict:
+    """读取快照：{"generated_at": 时间戳, "rows": [[日期, 科室, 类别, 名称, 取值, 次数], ...]}"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def snapshot_paths(directory: str = SNAPSHOT_DIR) -> List[str]:
+    """快照目录下各进程的快照文件"""
+    return sorted(glob.glob(os.path.join(glob.escape(directory), "*.json"))) if directory else []
+
+
+def case_key(input_data: dict) -> str:
+    """一份检测的标识：日期与影响计数的输入字段（病史等不参与）"""
+    patient_info = input_data["patient_info"]
+    fields = [date.today().isoformat(), patient_info.get("department", ""), patient_info["gender"], patient_info["age"],
+              input_data["biochemical_indicators"], input_data["imaging_data"], input_data.get("range_profile")]
+    return hashlib.sha1(json.dumps(fields, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def score_and_record(input_data: dict) -> IndicatorsAnalysis:
+    """执行规则计算并计入异常计数（同一份检测只计一次），各单人分析入口共用"""
+    indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+    indicators_analysis.analysis()
+    abnormality_counters.record_case(case_key(input_data), indicators_analysis,
+                                     input_data["patient_info"].get("department", ""))
+    return indicators_analysis
+
+
+abnormality_counters = AbnormalityCounters()
+_snapshot_writer_started = False
+
+
+def start_snapshot_writer(process_name: str, interval: float = SNAPSHOT_INTERVAL_SECONDS) -> bool:
+    """
+    定期把计数写入 SNAPSHOT_DIR/{process_name}.json；未配置目录时不启动，每个进程只启动一次
+    process_name 在同时运行的进程间应互不相同，重启后保持不变（以便读入上次的快照）
+    """
+    global _snapshot_writer_started
+    if not SNAPSHOT_DIR or _snapshot_writer_started:
+        return False
+    _snapshot_writer_started = True
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    abnormality_counters.use_snapshot(os.path.join(SNAPSHOT_DIR, f"{process_name}.json"))
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                abnormality_counters.write_snapshot()
+            except OSError as e:
+                print(f"Failed to write abnormality counters snapshot: {str(e)}")
+
+    threading.Thread(target=loop, name="abnormality-snapshot-writer", daemon=True).start()
+    return True
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    from analysis_module.rule_harness import random_points
+
+    analyses = []
+    for input_data in random_points(2000):
+        indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+        indicators_analysis.analysis()
+        analyses.append(indicators_analysis)
+    counters = AbnormalityCounters()
+    departments = ("骨科", "内分泌科", "老年科", "体检中心")
+    rounds = 50
+
+    def work(thread_index):
+        for _ in range(rounds):
+            for index, indicators_analysis in enumerate(analyses):
+                counters.record(indicators_analysis, departments[(index + thread_index) % len(departments)])
+
+    threads = 8
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, range(threads)))
+    elapsed = time.perf_counter() - start
+    total = threads * rounds * len(analyses)
+    print(f"{threads} 个线程计入 {total} 次结果耗时 {elapsed:.2f}s（{elapsed / total * 1e6:.1f} μs/次）")
+    snapshot = counters.snapshot()
+    cases = sum(count for key, count in snapshot.items() if key[2] == KIND_CASES)
+    print(f"合并后检测例数: {cases}（应为 {total}）")
@@ -3,6 +3,11 @@ from openai import OpenAI
 from dotenv import load_dotenv
 import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis_module.llm_metrics import llm_metrics, OUTCOME_OK, OUTCOME_PARSE_FAILURE, OUTCOME_ERROR
+from analysis_module.rate_limiter import llm_rate_limiter, estimate_tokens, EXPECTED_COMPLETION_TOKENS
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
@@ -10,25 +15,150 @@ api_key = os.getenv('OPENAI_API_KEY')
 base_url = os.getenv('BASE_URL')
 client = OpenAI(api_key=api_key, base_url=base_url)
 
+SYSTEM_MESSAGE = "你是一个专业的骨代谢医生。"
+SECTION_FIELDS = ("结论解读", "用药建议", "生活方式建议", "参考依据", "复诊建议")
+# 综合分析生成方式："single" 一次生成全部五个字段（默认）；"parallel" 每个字段一个并发请求
+SECTION_MODE = os.getenv("LLM_SECTION_MODE", "single")
+# 并发模式下部分字段失败时的处理："fallback" 用 fallback 中的同名字段补齐（全部失败才抛异常）；"raise" 任一失败即抛异常
+PARTIAL_FAILURE_POLICY = os.getenv("LLM_PARTIAL_FAILURE_POLICY", "fallback")
+SECTION_FAILED_TEXT = "该部分暂时无法生成，请稍后重新分析。"
+# 为 True 时以流式方式调用，可统计首 token 耗时
+STREAM = os.getenv("LLM_STREAM", "0") == "1"
+# 并发生成各字段的共享线程池
+section_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_SECTION_WORKERS", "20")),
+                                      thread_name_prefix="llm-section")
+# 进程内所有会话共用的限流器（LLM_RPM / LLM_TPM），在调用方线程中申请额度，排队位置可反馈给界面
+rate_limiter = llm_rate_limiter
+
+
+def get_completion(input_message, model="gpt-3.5-turbo", return_usage=False, examples=None):
+    """
+    调用大模型生成综合分析；return_usage 为 True 时同时返回 token 用量 {"prompt_tokens", "completion_tokens"}
+    examples 为相似既往病例（summary_index.examples），提供时替代提示词中的固定示例输出
+    """
+    prompt = get_prompt(input_message, examples)
+    estimated_tokens = estimate_tokens(len(SYSTEM_MESSAGE) + len(prompt))
+    rate_limiter.acquire(1, estimated_tokens)
+    result, usage = chat_json([{"role": "system", "content": SYSTEM_MESSAGE},
+                               {"role": "user", "content": prompt}], model,
+                              parse=lambda ai_output: json.loads(clean_markdown_json(ai_output)),
+                              error_message="AI 返回结果无法解析为 JSON")
+    rate_limiter.settle(estimated_tokens, usage["prompt_tokens"] + usage["completion_tokens"])
+    if return_usage:
+        return result, usage
+    return result
+
+
+def chat_json(messages, model, parse, error_message):
+    """
+    调用大模型并解析输出，同时记录 token、耗时、首 token 耗时及结果到 llm_metrics
 
-def get_completion(input_message, model="gpt-3.5-turbo"):
-    prompt = get_prompt(input_message)
-    response = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "system", "content": "你是一个专业的骨代谢医生。"},
-                  {"role": "user", "content": prompt}],
-        temperature=0,  # 确保结果稳定
-    )
-
-    ai_output = response.choices[0].message.content
+    Args:
+        parse: 将模型输出文本转为结果的函数，抛出 ValueError / KeyError / TypeError 视为解析失败
+    """
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if STREAM:
+            stream = client.chat.completions.create(model=model, messages=messages, temperature=0, stream=True,
+                                                    stream_options={"include_usage": True})
+            parts, usage = [], {}
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None):
+                    usage = usage_of(chunk)
+            ai_output = "".join(parts)
+            usage = usage or usage_of(None)
+        else:
+            response = client.chat.completions.create(model=model, messages=messages, temperature=0)
+            ai_output = response.choices[0].message.content
+            usage = usage_of(response)
+    except Exception:
+        llm_metrics.record(model, OUTCOME_ERROR, time.perf_counter() - start)
+        raise
 
     try:
-        # 清理可能的 Markdown 格式符号
-        cleaned_output = clean_markdown_json(ai_output)
-        result = json.loads(cleaned_output)
-        return result
-    except json.JSONDecodeError:
-        raise ValueError(f"AI 返回结果无法解析为 JSON：\n{ai_output}")
+        result = parse(ai_output)
+    except (ValueError, KeyError, TypeError):
+        llm_metrics.record(model, OUTCOME_PARSE_FAILURE, time.perf_counter() - start, usage, ttft)
+        raise ValueError(f"{error_message}：\n{ai_output}")
+    llm_metrics.record(model, OUTCOME_OK, time.perf_counter() - start, usage, ttft)
+    return result, usage
+
+
+def get_section_completion(input_message, section, model="gpt-3.5-turbo", examples=None):
+    """
+    只生成综合分析中的一个字段，返回 (字段内容, token 用量)
+    system 与第一条 user 消息对所有字段完全相同，服务端可复用同一段提示词前缀的缓存
+    """
+    return chat_json([{"role": "system", "content": SYSTEM_MESSAGE},
+                      {"role": "user", "content": get_prompt(input_message, examples)},
+                      {"role": "user", "content": get_section_instruction(section)}], model,
+                     parse=lambda ai_output: json.loads(clean_markdown_json(ai_output))[section],
+                     error_message=f"AI 返回的「{section}」无法解析")
+
+
+def get_completion_parallel(input_message, model="gpt-3.5-turbo", return_usage=False,
+                            failure_policy=None, fallback=None, examples=None):
+    """
+    五个字段并发生成后合并，返回与 get_completion 相同结构的字典
+
+    Args:
+        failure_policy: 部分字段失败时的处理，见 PARTIAL_FAILURE_POLICY
+        fallback: 失败字段的替代内容（例如本地模板生成的综合分析），缺省时填入 SECTION_FAILED_TEXT
+        examples: 相似既往病例，见 get_completion
+    """
+    failure_policy = failure_policy or PARTIAL_FAILURE_POLICY
+    if failure_policy not in ("fallback", "raise"):
+        raise ValueError(f"Unknown partial failure policy: {failure_policy}")
+
+    # 五个请求一次申请额度，避免与其他会话的请求交错排队
+    prompt_chars = len(SYSTEM_MESSAGE) + len(get_prompt(input_message, examples))
+    estimated_tokens = sum(estimate_tokens(prompt_chars + len(get_section_instruction(section)),
+                                           EXPECTED_COMPLETION_TOKENS // len(SECTION_FIELDS))
+                           for section in SECTION_FIELDS)
+    rate_limiter.acquire(len(SECTION_FIELDS), estimated_tokens)
+    futures = {section: section_executor.submit(get_section_completion, input_message, section, model, examples)
+               for section in SECTION_FIELDS}
+
+    result = {}
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "failed_sections": []}
+    errors = []
+    for section, future in futures.items():
+        try:
+            result[section], section_usage = future.result()
+        except Exception as e:
+            errors.append(f"{section}: {str(e)}")
+            usage["failed_sections"].append(section)
+            result[section] = (fallback or {}).get(section, SECTION_FAILED_TEXT)
+            continue
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+            usage[key] += section_usage[key]
+
+    if not errors:
+        # 有字段失败时无法得知服务端实际计入的用量，保留预估值
+        rate_limiter.settle(estimated_tokens, usage["prompt_tokens"] + usage["completion_tokens"])
+    if errors and (failure_policy == "raise" or len(errors) == len(SECTION_FIELDS)):
+        raise ValueError("综合分析生成失败：" + "；".join(errors))
+    if errors:
+        print(f"综合分析部分字段生成失败，已使用替代内容：{errors}")
+    if return_usage:
+        return result, usage
+    return result
+
+
+def usage_of(response):
+    """从响应中取出 token 用量，服务端未返回时记为 0；cached_tokens 为命中提示词缓存的部分"""
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
 
 
 def clean_markdown_json(raw_text):
@@ -40,7 +170,7 @@ def clean_markdown_json(raw_text):
     return cleaned_text
 
 
-def get_prompt(input_message):
+def get_prompt(input_message, examples=None):
     example_output = {
         "结论解读": "根据多项指标结果，患者的骨代谢状态总体表现为高动力性倾向。β-CTX指标显示骨吸收活性显著增强，提示骨量流失风险较高；P1NP指标处于正常范围，说明骨形成能力未见明显异常；维生素D水平不足可能影响钙吸收及骨代谢平衡；N-MID指标偏低，提示轻微骨形成不足。结合骨密度T值为正常，无明显骨质疏松风险。",
         "用药建议": "1. 补充钙剂（如碳酸钙）每日1000mg和维生素D 800-1200 IU；\n2. 若骨吸收过高，建议使用抗骨吸收药物如双膦酸盐或地舒单抗；\n3. 若进一步检查发现骨形成能力下降，可考虑使用特立帕肽以促进成骨。",
@@ -49,6 +179,13 @@ def get_prompt(input_message):
         "复诊建议": "建议3个月后复查骨代谢相关指标（如β-CTX、P1NP、N-MID）以及骨密度T值，评估干预效果。若骨代谢异常持续，应进一步排查继发性骨质疏松的潜在原因（如甲状旁腺功能亢进或维生素D缺乏）并调整治疗方案。"
     }
 
+    if examples:
+        # 相似既往病例比固定示例更贴近当前病例，且不再重复通用示例
+        example_text = "以下为指标相近的既往病例及其综合分析，可参考其判断与写法（须按本次输入数据生成）：" \
+                       f"{json.dumps(examples, ensure_ascii=False, indent=2)}"
+    else:
+        example_text = f"示例输出：{json.dumps(example_output, ensure_ascii=False, indent=2)}"
+
     prompt = f"""
     你是一名专业的骨代谢医生，根据以下输入数据生成综合分析报告：
 
@@ -77,7 +214,7 @@ def get_prompt(input_message):
         4. 参考依据
         5. 复诊建议
     - 输出格式为标准 JSON（Python 字典格式）。
-    - 示例输出：{json.dumps(example_output, ensure_ascii=False, indent=2)}
+    - {example_text}
 
     ### 输入数据
     {json.dumps(input_message, ensure_ascii=False, indent=2)}
@@ -87,6 +224,13 @@ def get_prompt(input_message):
     return prompt
 
 
+def get_section_instruction(section):
+    return f"""
+    本次只需生成上述报告中的「{section}」字段，内容要求与示例输出中的该字段一致。
+    请直接返回 JSON：{{"{section}": "..."}}
+    """
+
+
 if __name__ == "__main__":
     input_data = {
         "患者基本信息": {"性别": "男", "年龄": 50},
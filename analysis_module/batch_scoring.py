@@ -0,0 +1,148 @@
+"""
+批量评分（工作列表）
+一批患者数据先由 batch_validation 按列校验，校验通过的行逐行执行规则计算，结果直接写入按列预分配的 NumPy 数组
+（检测值、当前区间、指标结果、是否异常、总体分型），不为每行保留 IndicatorsAnalysis 或 to_dict()；
+查看某一行的指标卡片与图示时再由 analyze_row() 单独重新计算该行
+使用方式: python -m analysis_module.batch_scoring --rows 10000   （测试评分耗时）
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Sequence
+
+import numpy as np
+
+from analysis_module.abnormality_counters import INDICATORS, OVERALL_FIELDS, abnormality_counters
+from analysis_module.batch_validation import BatchValidationResult, BIOCHEMICAL_FIELD_RANGES, BONE_DENSITY_FIELD, \
+    validate_batch, score_valid_rows, iter_valid_input_data
+from analysis_module.indicators_anlaysis import ALL_RANGES, IndicatorsAnalysis
+
+# 可选的患者编号列，原样带入结果
+ID_FIELD = "patient_id"
+# 上传文件的列顺序（模板）
+INPUT_FIELDS = (ID_FIELD, "gender", "age", *BIOCHEMICAL_FIELD_RANGES, BONE_DENSITY_FIELD)
+# score_batch(texts=True) 时另外保存的展开文本（指标卡片中的参考区间、指标解读、用药建议、参考文件）
+EXPANDED_TEXT_FIELDS = ("reference_value_range", "interpretation", "medication_suggestion", "guideline")
+
+
+@dataclass
+class ScoredBatch:
+    validation: BatchValidationResult
+    rows: np.ndarray  # 校验通过的行号（从 0 开始），以下各列与之一一对应
+    patient_ids: np.ndarray
+    is_male: np.ndarray
+    ages: np.ndarray
+    profile_names: np.ndarray
+    values: Dict[str, np.ndarray]  # 指标属性名 -> 检测值，无骨密度时为 NaN
+    ranges: Dict[str, np.ndarray]  # 指标属性名 -> 当前区间名称
+    results: Dict[str, np.ndarray]  # 指标属性名 -> 指标结果
+    abnormal: Dict[str, np.ndarray]  # 指标属性名 -> 是否异常
+    overall: Dict[str, np.ndarray]  # 总体分型字段 -> 分型结果
+    # 展开文本字段 -> {指标属性名 -> 文本}，未要求展开文本时为空
+    texts: Dict[str, Dict[str, np.ndarray]] = field(default_factory=dict)
+
+    @property
+    def abnormal_count(self) -> np.ndarray:
+        """每行异常指标数"""
+        return np.sum([flags for flags in self.abnormal.values()], axis=0, dtype=np.int64) if len(self.rows) \
+            else np.zeros(0, dtype=np.int64)
+
+
+def _patient_ids(values) -> np.ndarray:
+    """患者编号统一为文本；CSV 中的空单元格（None / NaN）为空字符串"""
+    return np.array(["" if value is None or (isinstance(value, float) and np.isnan(value)) else str(value)
+                     for value in values], dtype=object)
+
+
+def score_batch(columns: Dict[str, Sequence], range_profile: str = None, texts: bool = False,
+                record: bool = True) -> ScoredBatch:
+    """
+    校验并评分一批患者数据
+
+    Args:
+        columns: 列名到一列取值的映射，列名见 INPUT_FIELDS（患者编号与骨密度可缺）
+        range_profile: 参考区间配置名称，默认配置
+        texts: 是否同时保存 EXPANDED_TEXT_FIELDS 中的展开文本
+        record: 是否计入异常计数；同一批数据再次评分（如导出）时应为 False，避免重复计数
+    """
+    validation = validate_batch(columns, range_profile)
+    rows = validation.valid_rows
+    count = len(rows)
+    ids = _patient_ids(np.asarray(columns[ID_FIELD], dtype=object)[rows]) if ID_FIELD in columns \
+        else np.full(count, "", dtype=object)
+    scored = ScoredBatch(
+        validation=validation, rows=rows, patient_ids=ids,
+        is_male=np.zeros(count, dtype=bool), ages=np.zeros(count, dtype=np.int64),
+        profile_names=np.empty(count, dtype=object),
+        values={attribute: np.full(count, np.nan) for attribute in INDICATORS},
+        ranges={attribute: np.full(count, "", dtype=object) for attribute in INDICATORS},
+        results={attribute: np.full(count, "", dtype=object) for attribute in INDICATORS},
+        abnormal={attribute: np.zeros(count, dtype=bool) for attribute in INDICATORS},
+        overall={overall_field: np.full(count, "", dtype=object) for overall_field in OVERALL_FIELDS},
+        texts={text_field: {attribute: np.full(count, "", dtype=object) for attribute in INDICATORS}
+               for text_field in EXPANDED_TEXT_FIELDS} if texts else {},
+    )
+    for index, (_, indicators_analysis) in enumerate(score_valid_rows(columns, validation, range_profile)):
+        scored.is_male[index] = indicators_analysis.is_male
+        scored.ages[index] = indicators_analysis.age
+        scored.profile_names[index] = indicators_analysis.profile_name
+        for attribute in INDICATORS:
+            if attribute == "bone_density" and not indicators_analysis.has_bone_density:
+                continue
+            indicator = getattr(indicators_analysis, attribute)
+            scored.values[attribute][index] = indicator.value
+            scored.ranges[attribute][index] = indicator.range
+            scored.results[attribute][index] = indicator.result
+            scored.abnormal[attribute][index] = indicator.is_abnormal
+            for text_field, text_columns in scored.texts.items():
+                text_columns[attribute][index] = getattr(indicator, text_field)
+        for overall_field in OVERALL_FIELDS:
+            scored.overall[overall_field][index] = str(indicators_analysis.overall.get(overall_field, ""))
+        if record:
+            abnormality_counters.record(indicators_analysis)
+    return scored
+
+
+def analyze_row(columns: Dict[str, Sequence], row: int, range_profile: str = None) -> IndicatorsAnalysis:
+    """重新计算单独一行（需已通过校验），用于展开查看该行的指标卡片与图示"""
+    row_columns = {field: np.asarray(column, dtype=object)[row:row + 1] for field, column in columns.items()}
+    validation = validate_batch(row_columns, range_profile)
+    for _, input_data in iter_valid_input_data(row_columns, validation, range_profile):
+        indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+        indicators_analysis.analysis()
+        return indicators_analysis
+    raise ValueError(f"Row {row} did not pass validation")
+
+
+def random_columns(row_count: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """生成一批随机患者数据（约 1% 的行含错误），用于测试"""
+    rng = np.random.default_rng(seed)
+    columns = {
+        ID_FIELD: np.array([f"P{index:06d}" for index in range(row_count)], dtype=object),
+        "gender": rng.choice(["男", "女"], size=row_count),
+        "age": rng.integers(18, 95, size=row_count),
+        **{field: np.round(rng.uniform(max(ALL_RANGES[key][0], ALL_RANGES[key][1] * 0.005), ALL_RANGES[key][1] * 0.6,
+                                       size=row_count), 2)
+           for field, key in BIOCHEMICAL_FIELD_RANGES.items()},
+        BONE_DENSITY_FIELD: np.round(rng.uniform(-4.5, 2.0, size=row_count), 1),
+    }
+    columns[BONE_DENSITY_FIELD][::5] = np.nan
+    columns["age"][1::101] = 0
+    return columns
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="批量评分耗时测试")
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    columns = random_columns(args.rows)
+    start = time.perf_counter()
+    scored = score_batch(columns, record=False)
+    elapsed = time.perf_counter() - start
+    print(f"{args.rows} 行校验并评分耗时 {elapsed:.2f}s（{elapsed / args.rows * 1e6:.1f} μs/行），"
+          f"有效 {len(scored.rows)} 行，含异常指标 {int((scored.abnormal_count > 0).sum())} 行")
+    start = time.perf_counter()
+    analyze_row(columns, int(scored.rows[0]))
+    print(f"单行重新计算耗时 {(time.perf_counter() - start) * 1000:.2f} ms")
@@ -0,0 +1,264 @@
+"""
+指标分析结果的紧凑编码
+to_dict() 中的区间、结果、解读、用药建议、参考文件等长文本只有有限种取值（由规则分支与参考区间配置决定），
+归档时改存为码表中的 uint16 编码，与数值一起打包为定长记录（NumPy 结构化数组，单条即 bytes，多条即按列存储的数组）；
+需要展示时再按码表还原出与 to_dict() 完全相同的结构
+
+码表保存在 config/result_codebook.json，由 --build-codebook 预先生成，只追加不修改，已归档记录的编码始终有效；
+运行时码表只读，遇到码表中没有的文本（例如新增参考区间配置后未重新生成码表）时 encode 抛出 KeyError。
+解读中的患者自身数值（如“当前骨密度T值为-2.6”）以占位符存入码表，还原时按记录中的数值填入，码表大小与患者数据无关
+使用方式: python -m analysis_module.compact_result --build-codebook   （用边界扫描预先生成码表）
+         python -m analysis_module.compact_result                    （体积与查询速度对比）
+"""
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+
+CODEBOOK_PATH = os.getenv("RESULT_CODEBOOK_PATH",
+                          os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                       "config", "result_codebook.json"))
+FORMAT_VERSION = 1
+
+# to_dict() 的键与 IndicatorsAnalysis 属性的对应关系，顺序即记录中的字段顺序
+INDICATOR_KEYS = {
+    "β_CTX_analysis": "β_CTX",
+    "P1NP_analysis": "P1NP",
+    "VD_analysis": "VD",
+    "N_MID_analysis": "N_MID",
+    "PTH_analysis": "PTH",
+    "CT_analysis": "CT",
+    "Bone_analysis": "bone_density",
+}
+# 编码为码表序号的文本字段
+TEXT_FIELDS = ("range", "reference_value_range", "result", "interpretation", "medication_suggestion", "guideline")
+# 解读中紧跟患者自身数值的文字；该数值在码表中替换为 VALUE_PLACEHOLDER
+VALUE_TEXT_PREFIX = "当前骨密度T值为"
+VALUE_PLACEHOLDER = "{value}"
+
+# 指标 flags 位
+FLAG_ABNORMAL = 1
+FLAG_INT_VALUE = 2  # 输入值为整数，还原时保持 "33 μg/ml" 而不是 "33.0 μg/ml"
+# 记录 flags 位
+FLAG_MALE = 1
+FLAG_HAS_BONE_DENSITY = 2
+
+INDICATOR_DTYPE = np.dtype([
+    ("value", "<f8"),
+    ("reference_min", "<f8"), ("reference_max", "<f8"),
+    ("standard_min", "<f8"), ("standard_max", "<f8"),
+    *[(text_field, "<u2") for text_field in TEXT_FIELDS],
+    ("flags", "u1"),
+])
+RECORD_DTYPE = np.dtype([
+    ("format_version", "u1"),
+    ("flags", "u1"),
+    ("age", "<u2"),
+    ("profile", "<u2"),  # 参考区间配置名称的编码
+    *[(attribute, INDICATOR_DTYPE) for attribute in INDICATOR_KEYS.values()],
+])
+
+# 指标名称与单位只与位置有关，由 init() 确定
+_template = IndicatorsAnalysis()
+_template.init()
+INDICATOR_LABELS = {attribute: (getattr(_template, attribute).name, getattr(_template, attribute).unit)
+                    for attribute in INDICATOR_KEYS.values()}
+
+
+class CodeBook:
+    """只追加的文本码表，编码 0 固定为空字符串；运行时只读，只有 build_codebook() 通过 add() 追加"""
+
+    def __init__(self, path: str = CODEBOOK_PATH):
+        self.path = path
+        self.texts: List[str] = [""]
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.texts = json.load(f)["texts"]
+        self.codes: Dict[str, int] = {text: code for code, text in enumerate(self.texts)}
+
+    def encode(self, text: str) -> int:
+        """
+        Raises:
+            KeyError: 码表中没有该文本（需重新生成码表）
+        """
+        code = self.codes.get(text)
+        if code is None:
+            raise KeyError(f"Text not in result codebook, rebuild it with --build-codebook: {text[:40]!r}")
+        return code
+
+    def add(self, text: str) -> int:
+        """追加文本（生成码表时使用，不写回文件）"""
+        code = self.codes.get(text)
+        if code is None:
+            if len(self.texts) > np.iinfo(np.uint16).max:
+                raise OverflowError("Result codebook is full")
+            code = len(self.texts)
+            self.texts.append(text)
+            self.codes[text] = code
+        return code
+
+    def decode(self, code: int) -> str:
+        return self.texts[code]
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"format_version": FORMAT_VERSION, "texts": self.texts}, f, ensure_ascii=False, indent=0)
+        os.replace(temp_path, self.path)
+
+
+codebook = CodeBook()
+
+
+def text_template(indicator, text_field: str) -> str:
+    """指标某个文本字段存入码表的形式：解读中的患者自身数值替换为占位符"""
+    text = getattr(indicator, text_field)
+    if text_field == "interpretation" and VALUE_TEXT_PREFIX in text:
+        text = text.replace(f"{VALUE_TEXT_PREFIX}{indicator.value}", f"{VALUE_TEXT_PREFIX}{VALUE_PLACEHOLDER}", 1)
+    return text
+
+
+def encode_into(record, indicators_analysis: IndicatorsAnalysis):
+    """将一次分析结果写入一条 RECORD_DTYPE 记录（需在 analysis() 之后调用）"""
+    record["format_version"] = FORMAT_VERSION
+    record["flags"] = (FLAG_MALE if indicators_analysis.is_male else 0) | \
+                      (FLAG_HAS_BONE_DENSITY if indicators_analysis.has_bone_density else 0)
+    record["age"] = indicators_analysis.age
+    record["profile"] = codebook.encode(indicators_analysis.profile_name)
+    for attribute in INDICATOR_KEYS.values():
+        if attribute == "bone_density" and not indicators_analysis.has_bone_density:
+            continue
+        indicator = getattr(indicators_analysis, attribute)
+        slot = record[attribute]
+        slot["value"] = indicator.value
+        slot["reference_min"], slot["reference_max"] = indicator.reference_value_range_min, indicator.reference_value_range_max
+        slot["standard_min"], slot["standard_max"] = indicator.standard_value_range_min, indicator.standard_value_range_max
+        for text_field in TEXT_FIELDS:
+            slot[text_field] = codebook.encode(text_template(indicator, text_field))
+        slot["flags"] = (FLAG_ABNORMAL if indicator.is_abnormal else 0) | \
+                        (FLAG_INT_VALUE if isinstance(indicator.value, int) else 0)
+
+
+def encode(indicators_analysis: IndicatorsAnalysis) -> bytes:
+    """单条结果编码为定长 bytes（RECORD_DTYPE.itemsize 字节）"""
+    record = np.zeros(1, dtype=RECORD_DTYPE)
+    encode_into(record[0], indicators_analysis)
+    return record.tobytes()
+
+
+def encode_batch(indicators_analyses) -> np.ndarray:
+    """多条结果编码为结构化数组，可按列查询，例如 records["β_CTX"]["result"] == codebook.encode("高动力型（继发性）")"""
+    indicators_analyses = list(indicators_analyses)
+    records = np.zeros(len(indicators_analyses), dtype=RECORD_DTYPE)
+    for record, indicators_analysis in zip(records, indicators_analyses):
+        encode_into(record, indicators_analysis)
+    return records
+
+
+def from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=RECORD_DTYPE)
+
+
+def _number(value: float, is_int: bool):
+    return int(value) if is_int else float(value)
+
+
+def decode_to_dict(record, containing_is_abnormal: bool = False) -> dict:
+    """按码表还原出与 IndicatorsAnalysis.to_dict() 相同的结构；record 可为单条记录或 encode() 返回的 bytes"""
+    if isinstance(record, (bytes, bytearray, memoryview)):
+        record = from_bytes(record)[0]
+    if record["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compact result format: {record['format_version']}")
+    has_bone_density = bool(record["flags"] & FLAG_HAS_BONE_DENSITY)
+    texts = codebook.texts
+    result = {}
+    for key, attribute in INDICATOR_KEYS.items():
+        if attribute == "bone_density" and not has_bone_density:
+            continue
+        slot = record[attribute]
+        name, unit = INDICATOR_LABELS[attribute]
+        flags = int(slot["flags"])
+        value = _number(slot["value"], flags & FLAG_INT_VALUE)
+        range_name = texts[slot["range"]]
+        indicator_dict = {
+            "标题": f"{name} 指标解读",
+            "当前值": f"{value} {unit}",
+            "参考区间": f"{range_name}区间 {texts[slot['reference_value_range']]}",
+            "指标结果": texts[slot["result"]],
+            "指标解读": texts[slot["interpretation"]].replace(f"{VALUE_TEXT_PREFIX}{VALUE_PLACEHOLDER}",
+                                                          f"{VALUE_TEXT_PREFIX}{value}", 1),
+            "用药建议": texts[slot["medication_suggestion"]],
+            "参考文件": texts[slot["guideline"]],
+        }
+        if containing_is_abnormal:
+            indicator_dict.update({
+                "是否异常": bool(flags & FLAG_ABNORMAL),
+                "单位": unit,
+                "当前数值": value,
+                "当前区间范围数值": (float(slot["reference_min"]), float(slot["reference_max"])),
+                "正常区间范围数值": (float(slot["standard_min"]), float(slot["standard_max"])),
+                "当前区间名称": range_name,
+            })
+        result[key] = indicator_dict
+    return result
+
+
+def build_codebook(profile_names=None) -> int:
+    """对各参考区间配置做一次边界扫描，把所有规则分支产生的文本追加到码表并写回文件，返回码表大小"""
+    from analysis_module.range_profiles import profile_cache
+    from analysis_module.rule_harness import boundary_points
+
+    for profile_name in profile_names or profile_cache.available_profiles():
+        codebook.add(profile_name)
+        for input_data in boundary_points(profile_name):
+            indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+            indicators_analysis.analysis()
+            for attribute in INDICATOR_KEYS.values():
+                indicator = getattr(indicators_analysis, attribute)
+                for text_field in TEXT_FIELDS:
+                    codebook.add(text_template(indicator, text_field))
+    codebook.save()
+    return len(codebook.texts)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from analysis_module.rule_harness import random_points
+
+    parser = argparse.ArgumentParser(description="指标结果紧凑编码")
+    parser.add_argument("--build-codebook", action="store_true", help="边界扫描生成码表")
+    parser.add_argument("--count", type=int, default=20000, help="对比用的随机样本数")
+    args = parser.parse_args()
+
+    if args.build_codebook:
+        print(f"码表条目数: {build_codebook()}")
+    else:
+        analyses = []
+        for input_data in random_points(args.count):
+            indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+            indicators_analysis.analysis()
+            analyses.append(indicators_analysis)
+        dicts = [indicators_analysis.to_dict(containing_is_abnormal=True) for indicators_analysis in analyses]
+        json_lines = [json.dumps(d, ensure_ascii=False).encode("utf-8") for d in dicts]
+        records = encode_batch(analyses)
+
+        mismatches = sum(decode_to_dict(record, True) != d for record, d in zip(records, dicts))
+        json_bytes = sum(len(line) for line in json_lines)
+        print(f"样本数: {len(dicts)}  还原不一致: {mismatches}")
+        print(f"JSON: {json_bytes / len(dicts):.0f} 字节/条  紧凑编码: {RECORD_DTYPE.itemsize} 字节/条  "
+              f"压缩比: {json_bytes / records.nbytes:.1f}x")
+
+        target = "高动力型（继发性）"
+        start = time.perf_counter()
+        json_hits = sum(json.loads(line)["β_CTX_analysis"]["指标结果"] == target for line in json_lines)
+        json_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        compact_hits = int((records["β_CTX"]["result"] == codebook.encode(target)).sum())
+        compact_seconds = time.perf_counter() - start
+        print(f"查询 β-CTX 结果为「{target}」: JSON {json_seconds * 1000:.1f} ms / 紧凑编码 {compact_seconds * 1000:.3f} ms，"
+              f"命中 {json_hits} / {compact_hits}")
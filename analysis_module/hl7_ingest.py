@@ -0,0 +1,410 @@
+"""
+检验仪器 HL7 v2 ORU^R01 结果消息的流式解析，按患者汇总为 input_data 并即时调用规则引擎计算
+支持读取文件或监听本地 socket（MLLP 封装），逐块增量解析，内存占用与数据总量无关
+socket 上每条消息处理完毕后回复 ACK：MSA-2 回传 MSH-10，收发应用互换；缺少性别（PID-8）、出生日期（PID-7）等
+规则计算必需信息的消息回复 AE，不是 HL7 消息的回复 AR，这些消息都不参与计算
+"""
+import re
+import socket
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from analysis_module.abnormality_counters import score_and_record
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+
+# MLLP 封装字符
+MLLP_START = b"\x0b"
+MLLP_END = b"\x1c"
+# ACK 中本系统的应用名称
+APPLICATION_NAME = "BONE_DEMO"
+# MSA-1 确认码：接受、处理出错、拒绝
+ACK_ACCEPT = "AA"
+ACK_ERROR = "AE"
+ACK_REJECT = "AR"
+# PID-8 到 input_data 性别的映射，其余取值（U、O 等）无法按性别选择参考区间
+PID_SEXES = {"M": "男", "F": "女"}
+# 段结束位置：\r、\n 或 MLLP 结束符
+SEGMENT_END = re.compile(b"[\r\n\x1c]")
+
+# OBX-3 观察项标识（编码或名称，大写）到 input_data 字段的映射，可按实验室仪器配置覆盖
+OBSERVATION_CODES = {
+    "B-CTX": "β-CTX",
+    "Β-CTX": "β-CTX",
+    "BCTX": "β-CTX",
+    "P1NP": "P1NP",
+    "TP1NP": "P1NP",
+    "25-OH VD": "25-Hydroxy Vitamin D",
+    "25OHVD": "25-Hydroxy Vitamin D",
+    "25-OH-VD": "25-Hydroxy Vitamin D",
+    "VD": "25-Hydroxy Vitamin D",
+    "N-MID": "N-MID Osteocalcin",
+    "NMID": "N-MID Osteocalcin",
+    "PTH": "Parathyroid Hormone",
+    "CT": "Calcitonin",
+    "BMD-T": "Bone Density",
+    "T-SCORE": "Bone Density",
+}
+
+REQUIRED_FIELDS = ("β-CTX", "P1NP", "25-Hydroxy Vitamin D", "N-MID Osteocalcin", "Parathyroid Hormone", "Calcitonin")
+
+
+def iter_file_chunks(path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """按固定大小分块读取消息文件"""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class HL7MessageError(ValueError):
+    """消息无法处理；ack_code 为回复的确认码（AE / AR）"""
+
+    def __init__(self, message: str, ack_code: str = ACK_ERROR):
+        super().__init__(message)
+        self.ack_code = ack_code
+
+
+class HL7StreamParser:
+    """
+    增量切分 HL7 消息：只缓存未完整的段和当前消息的段，每收到完整消息就输出一次
+    消息边界为 MLLP 结束符或新的 MSH 段；段之间以 \\r 或 \\n 分隔
+    """
+
+    def __init__(self):
+        self._partial = b""
+        self._segments: List[str] = []
+
+    def feed(self, chunk: bytes) -> Iterator[List[str]]:
+        data = self._partial + chunk
+        start = 0
+        for match in SEGMENT_END.finditer(data):
+            end = match.start()
+            segment = data[start:end].lstrip(MLLP_START).decode("utf-8", errors="replace")
+            start = match.end()
+            if segment:
+                message = self._add_segment(segment)
+                if message:
+                    yield message
+            if match.group() == MLLP_END and self._segments:
+                yield self._segments
+                self._segments = []
+        self._partial = data[start:]
+
+    def close(self) -> Iterator[List[str]]:
+        """数据流结束，输出最后一条消息"""
+        if self._partial.strip(MLLP_START + MLLP_END + b"\r\n"):
+            self._add_segment(self._partial.strip(MLLP_START + MLLP_END + b"\r\n").decode("utf-8", errors="replace"))
+        self._partial = b""
+        if self._segments:
+            yield self._segments
+            self._segments = []
+
+    def _add_segment(self, segment: str) -> Optional[List[str]]:
+        finished = None
+        if segment.startswith("MSH") and self._segments:
+            finished = self._segments
+            self._segments = []
+        self._segments.append(segment)
+        return finished
+
+
+def hl7_date(value: str) -> Optional[datetime]:
+    """解析 HL7 日期时间（YYYYMMDD[HHMM[SS]]）"""
+    value = value.split("+")[0].split("-")[0]
+    for fmt, size in (("%Y%m%d%H%M%S", 14), ("%Y%m%d%H%M", 12), ("%Y%m%d", 8)):
+        if len(value) >= size:
+            try:
+                return datetime.strptime(value[:size], fmt)
+            except ValueError:
+                return None
+    return None
+
+
+class PatientRecordAssembler:
+    """
+    按患者汇总各条消息中的观察结果；一条消息处理完毕后，必填指标齐全的患者即输出为 input_data
+    未齐全的患者最多保留 max_pending 个，超出时丢弃最早的，保证内存有界
+
+    Args:
+        observation_codes: OBX-3 标识到 input_data 字段的映射
+        max_pending: 同时等待补齐指标的患者数上限
+    """
+
+    def __init__(self, observation_codes: Dict[str, str] = None, max_pending: int = 10000):
+        self.observation_codes = observation_codes or OBSERVATION_CODES
+        self.max_pending = max_pending
+        self.pending: "OrderedDict[str, dict]" = OrderedDict()
+        self.dropped = 0
+        # 未通过 check_message 而未处理的消息数
+        self.rejected = 0
+
+    @staticmethod
+    def check_message(segments: List[str]):
+        """
+        处理前检查整条消息，未通过时不修改任何患者记录
+
+        Raises:
+            HL7MessageError: 不以 MSH 段开始（AR），或某个 PID 段缺少患者编号、性别、出生日期（AE）
+        """
+        if not segments or not segments[0].startswith("MSH") or len(segments[0]) < 4:
+            raise HL7MessageError("Message does not start with an MSH segment", ACK_REJECT)
+        field_separator = segments[0][3]
+        for segment in segments:
+            fields = segment.split(field_separator)
+            if fields[0] != "PID":
+                continue
+            if len(fields) <= 3 or not fields[3].split("^")[0]:
+                raise HL7MessageError("PID-3 patient identifier is missing")
+            if len(fields) <= 7 or hl7_date(fields[7]) is None:
+                raise HL7MessageError("PID-7 date of birth is missing or invalid")
+            if len(fields) <= 8 or fields[8] not in PID_SEXES:
+                raise HL7MessageError("PID-8 administrative sex is missing or not M/F")
+
+    def add_message(self, segments: List[str]) -> Iterator[Tuple[str, dict]]:
+        """
+        处理一条消息，返回本条消息后已齐全的 (patient_id, input_data)
+
+        Raises:
+            HL7MessageError: 见 check_message
+        """
+        try:
+            self.check_message(segments)
+        except HL7MessageError:
+            self.rejected += 1
+            raise
+        field_separator = segments[0][3]
+        message_time = None
+        record = None
+        touched = []
+        for segment in segments:
+            fields = segment.split(field_separator)
+            segment_type = fields[0]
+            if segment_type == "MSH":
+                # MSH-7 在 split 后位于下标 6（MSH-1 为分隔符本身）
+                message_time = hl7_date(fields[6]) if len(fields) > 6 else None
+            elif segment_type == "PID":
+                record = self._patient_record(fields, message_time)
+                touched.append(record["patient_id"])
+            elif segment_type == "PV1" and record is not None and len(fields) > 3 and fields[3]:
+                # PV1-3 患者所在位置，第一个组件为科室
+                record["input_data"]["patient_info"]["department"] = fields[3].split("^")[0]
+            elif segment_type == "OBR" and record is not None and len(fields) > 7:
+                observation_time = hl7_date(fields[7])
+                if observation_time:
+                    record["observation_time"] = observation_time
+                    record["input_data"]["patient_info"]["age"] = self._age(record, observation_time)
+            elif segment_type == "OBX" and record is not None and len(fields) > 5:
+                self._add_observation(record, fields)
+
+        for patient_id in dict.fromkeys(touched):
+            record = self.pending.get(patient_id)
+            if record is not None and all(field in record["input_data"]["biochemical_indicators"]
+                                          for field in REQUIRED_FIELDS):
+                del self.pending[patient_id]
+                yield patient_id, record["input_data"]
+
+    def _patient_record(self, fields: List[str], message_time: Optional[datetime]) -> dict:
+        # 已经过 check_message，PID-3、PID-7、PID-8 均有效
+        patient_id = fields[3].split("^")[0]
+        record = self.pending.get(patient_id)
+        if record is None:
+            record = {
+                "patient_id": patient_id,
+                "birth_date": hl7_date(fields[7]),
+                "input_data": {
+                    "patient_info": {"gender": PID_SEXES[fields[8]], "age": 0, "height": 0.0, "weight": 0.0},
+                    "biochemical_indicators": {},
+                    "imaging_data": {"Bone Density": "未输入"},
+                    "medical_history": {"history": "", "medications": "", "testing_time": ""},
+                },
+            }
+            # MSH-7 缺失时按接收时间计算年龄（OBR-7 的检测时间随后覆盖）
+            record["input_data"]["patient_info"]["age"] = self._age(record, message_time or datetime.now())
+            self.pending[patient_id] = record
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+        else:
+            self.pending.move_to_end(patient_id)
+        return record
+
+    @staticmethod
+    def _age(record: dict, at: datetime) -> int:
+        birth_date = record["birth_date"]
+        return at.year - birth_date.year - ((at.month, at.day) < (birth_date.month, birth_date.day))
+
+    def _add_observation(self, record: dict, fields: List[str]):
+        # OBX-3 形如 编码^名称^编码体系，编码或名称任一匹配即可
+        identifiers = fields[3].split("^")
+        field = None
+        for identifier in identifiers[:2]:
+            field = self.observation_codes.get(identifier.strip().upper())
+            if field:
+                break
+        if field is None:
+            return
+        try:
+            value = float(fields[5])
+        except ValueError:
+            return
+        if field == "Bone Density":
+            record["input_data"]["imaging_data"]["Bone Density"] = value
+        else:
+            record["input_data"]["biochemical_indicators"][field] = value
+
+
+def score_input_data(input_data: dict) -> IndicatorsAnalysis:
+    """对单个患者的 input_data 执行规则计算，并计入异常计数（重复发送的同一份结果只计一次）"""
+    return score_and_record(input_data)
+
+
+def process_message(assembler: PatientRecordAssembler, segments: List[str]) -> (list, str, str):
+    """
+    处理一条消息并计算本条消息后指标齐全的患者
+
+    Returns:
+        ([(patient_id, input_data, IndicatorsAnalysis), ...], 确认码, 错误说明)；未通过检查或计算出错时结果为空
+    """
+    try:
+        records = [(patient_id, input_data, score_input_data(input_data))
+                   for patient_id, input_data in assembler.add_message(segments)]
+    except HL7MessageError as e:
+        return [], e.ack_code, str(e)
+    except Exception as e:
+        return [], ACK_ERROR, f"Scoring failed: {str(e)}"
+    return records, ACK_ACCEPT, ""
+
+
+def build_ack(segments: List[str], ack_code: str, text: str = "") -> bytes:
+    """
+    按收到的消息生成 ACK（不含 MLLP 封装）：收发应用与机构互换，MSA-2 回传 MSH-10 消息控制号，
+    处理标识（MSH-11）与版本（MSH-12）沿用原消息
+    """
+    header = segments[0] if segments and segments[0].startswith("MSH") and len(segments[0]) > 3 else "MSH|^~\\&"
+    field_separator = header[3]
+    # split 后下标 n-1 为 MSH-n（MSH-1 为分隔符本身）
+    fields = header.split(field_separator)
+
+    def msh(n: int, default: str = "") -> str:
+        return fields[n - 1] if len(fields) >= n and fields[n - 1] else default
+
+    control_id = msh(10)
+    encoding_characters = msh(2, "^~\\&")
+    # MSH-9 为 ACK^触发事件^ACK，触发事件沿用原消息（如 ORU^R01 的 R01）
+    message_type = msh(9).split(encoding_characters[0])
+    ack_type = encoding_characters[0].join(["ACK", message_type[1], "ACK"]) if len(message_type) > 1 else "ACK"
+    # 说明文字中不能出现分隔符
+    text = re.sub(f"[{re.escape(field_separator + encoding_characters)}]", " ", text)
+    ack_segments = [
+        field_separator.join(["MSH", encoding_characters, msh(5, APPLICATION_NAME), msh(6), msh(3), msh(4),
+                              datetime.now().strftime("%Y%m%d%H%M%S"), "", ack_type, f"ACK{control_id}",
+                              msh(11, "P"), msh(12, "2.5")]),
+        field_separator.join(["MSA", ack_code, control_id, text] if text else ["MSA", ack_code, control_id]),
+    ]
+    return "\r".join(ack_segments).encode("utf-8") + b"\r"
+
+
+def ingest(chunks: Iterable[bytes], assembler: PatientRecordAssembler = None,
+           on_message: Callable[[List[str]], None] = None) -> Iterator[Tuple[str, dict, IndicatorsAnalysis]]:
+    """
+    流式解析数据块，患者指标一旦齐全立即计算，逐个返回 (patient_id, input_data, IndicatorsAnalysis)
+    未通过检查的消息跳过，计入 assembler.rejected
+    """
+    parser = HL7StreamParser()
+    assembler = assembler or PatientRecordAssembler()
+
+    def handle(messages):
+        for message in messages:
+            if on_message:
+                on_message(message)
+            records, _, _ = process_message(assembler, message)
+            yield from records
+
+    for chunk in chunks:
+        yield from handle(parser.feed(chunk))
+    yield from handle(parser.close())
+
+
+def serve_mllp(host: str = "127.0.0.1", port: int = 2575, assembler: PatientRecordAssembler = None,
+               chunk_size: int = 64 * 1024) -> Iterator[Tuple[str, dict, IndicatorsAnalysis]]:
+    """
+    监听本地端口，依次接收仪器/中间件连接发送的 MLLP 消息；每条消息解析、计算后回复 ACK（AA / AE / AR），
+    逐个返回指标齐全并完成计算的 (patient_id, input_data, IndicatorsAnalysis)
+    """
+    assembler = assembler or PatientRecordAssembler()
+    with socket.create_server((host, port)) as server:
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                parser = HL7StreamParser()
+                while True:
+                    chunk = connection.recv(chunk_size)
+                    if not chunk:
+                        break
+                    for message in parser.feed(chunk):
+                        records, ack_code, text = process_message(assembler, message)
+                        if ack_code != ACK_ACCEPT:
+                            print(f"HL7 message {ack_code}: {text}")
+                        connection.sendall(MLLP_START + build_ack(message, ack_code, text) + MLLP_END + b"\r")
+                        yield from records
+                # 连接关闭时未以 MLLP 结束符结尾的消息无法回复 ACK，仍按收到的内容处理
+                for message in parser.close():
+                    yield from process_message(assembler, message)[0]
+
+
+def synthetic_oru_message(index: int) -> bytes:
+    """生成一条示例 ORU^R01 消息（MLLP 封装），用于回放测试"""
+    sex = "F" if index % 2 else "M"
+    segments = [
+        f"MSH|^~\\&|ANALYZER|LAB|BONE_DEMO|HOSP|20241020083000||ORU^R01|MSG{index:08d}|P|2.5",
+        f"PID|1||P{index:08d}^^^HOSP||患者^{index}||{1950 + index % 50}0101|{sex}",
+        "OBR|1|||BONE^骨代谢六项|||20241020080000",
+        f"OBX|1|NM|B-CTX^β-胶原特殊序列||{0.1 + (index % 30) * 0.05:.3f}|ng/ml|||||F",
+        f"OBX|2|NM|P1NP^总I型胶原氨基端延长肽||{10 + index % 80}.0|ug/ml|||||F",
+        f"OBX|3|NM|25OHVD^25-羟基维生素D||{5 + index % 45}.0|ng/ml|||||F",
+        f"OBX|4|NM|N-MID^N端中段骨钙素||{8 + index % 60}.0|ng/ml|||||F",
+        f"OBX|5|NM|PTH^甲状旁腺激素||{10 + index % 70}.0|pg/ml|||||F",
+        f"OBX|6|NM|CT^降钙素||{(index % 15) * 0.8:.2f}|pg/ml|||||F",
+    ]
+    if index % 3 == 0:
+        segments.append(f"OBX|7|NM|BMD-T^骨密度T值||{-3.5 + (index % 50) * 0.1:.1f}||||||F")
+    return MLLP_START + "\r".join(segments).encode("utf-8") + b"\r" + MLLP_END + b"\r"
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+
+    arg_parser = argparse.ArgumentParser(description="HL7 结果消息回放基准测试")
+    arg_parser.add_argument("--file", help="回放的消息文件，不指定时生成示例消息")
+    arg_parser.add_argument("--messages", type=int, default=20000, help="生成的示例消息数")
+    arg_parser.add_argument("--listen", type=int, help="改为监听本地端口接收消息")
+    args = arg_parser.parse_args()
+
+    if args.listen:
+        for patient_id, _, indicators_analysis in serve_mllp(port=args.listen):
+            print(patient_id, {key: value["指标结果"] for key, value in indicators_analysis.to_dict().items()})
+    else:
+        path = args.file
+        if path is None:
+            path = os.path.join(tempfile.mkdtemp(), "oru_replay.hl7")
+            with open(path, "wb") as f:
+                for index in range(args.messages):
+                    f.write(synthetic_oru_message(index))
+
+        message_count = 0
+
+        def count_message(_):
+            global message_count
+            message_count += 1
+
+        start = time.perf_counter()
+        record_count = sum(1 for _ in ingest(iter_file_chunks(path), on_message=count_message))
+        elapsed = time.perf_counter() - start
+        print(f"消息数: {message_count}, 完成计算的患者记录: {record_count}, 耗时: {elapsed:.2f}s, "
+              f"{message_count / elapsed:.0f} messages/s, {record_count / elapsed:.0f} records/s")
@@ -4,6 +4,11 @@
 from dataclasses import field, dataclass
 from typing import List
 from analysis_module.single_indicator import SingleIndicator
+from analysis_module.range_profiles import CompiledRangeProfile, get_profile, DEFAULT_PROFILE_NAME
+from analysis_module.summary_classifier import classify_overall
+
+# 各指标的全区间（图示坐标轴、输入框上下限），取自默认参考区间配置，进程内只构建一次
+ALL_RANGES = get_profile(DEFAULT_PROFILE_NAME).all_ranges
 
 
 @dataclass
@@ -18,6 +23,30 @@ class IndicatorsAnalysis:
     CT: SingleIndicator = field(default_factory=SingleIndicator)
     has_bone_density: bool = field(default=False)
     bone_density: SingleIndicator = field(default_factory=SingleIndicator)
+    # 参考区间配置，init() 时确定，计算过程中不再变化
+    profile: CompiledRangeProfile = field(default=None)
+    profile_name: str = field(default=DEFAULT_PROFILE_NAME)
+    # 所有指标的汇总：骨转换类型、维生素D状态、PTH状态、骨密度分级等，由 analysis() 计算
+    overall: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_input_data(cls, input_data):
+        """根据界面/接口收集的 input_data 构建并初始化各项指标，调用方随后执行 analysis()"""
+        indicators_analysis = cls(age=input_data["patient_info"]["age"],
+                                  profile_name=input_data.get("range_profile") or DEFAULT_PROFILE_NAME)
+        indicators_analysis.judge_is_male(input_data["patient_info"]["gender"])
+        indicators_analysis.β_CTX.value = input_data["biochemical_indicators"]["β-CTX"]
+        indicators_analysis.P1NP.value = input_data["biochemical_indicators"]["P1NP"]
+        indicators_analysis.VD.value = input_data["biochemical_indicators"]["25-Hydroxy Vitamin D"]
+        indicators_analysis.N_MID.value = input_data["biochemical_indicators"]["N-MID Osteocalcin"]
+        indicators_analysis.PTH.value = input_data["biochemical_indicators"]["Parathyroid Hormone"]
+        indicators_analysis.CT.value = input_data["biochemical_indicators"]["Calcitonin"]
+        if input_data["imaging_data"]["Bone Density"] != "未输入":
+            indicators_analysis.has_bone_density = True
+            indicators_analysis.bone_density.value = input_data["imaging_data"]["Bone Density"]
+
+        indicators_analysis.init()
+        return indicators_analysis
 
     def judge_is_male(self, input_gender: str):
         if input_gender == "男":
@@ -26,15 +55,9 @@ class IndicatorsAnalysis:
             self.is_male = False
 
     def init(self):
-        all_ranges = {
-            "β_CTX_analysis": (0.0, 4.0),
-            "P1NP_analysis": (10.0, 90.0),
-            "VD_analysis": (0.0, 100.0),
-            "N_MID_analysis": (0.0, 200.0),
-            "PTH_analysis": (0.0, 100.0),
-            "CT_analysis": (0.0, 40.0),
-            "Bone_analysis": (-5.0, 5.0),
-        }
+        if self.profile is None:
+            self.profile = get_profile(self.profile_name)
+        all_ranges = self.profile.all_ranges
         self.β_CTX.name = "β-胶原特殊序列(β-ctx)"
         self.β_CTX.unit = "ng/ml"
         self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = all_ranges["β_CTX_analysis"]
@@ -90,55 +113,51 @@ class IndicatorsAnalysis:
         if self.has_bone_density:
             self.compute_bone_density()
 
-        # TODO
         # 所有指标数据的汇总
+        self.overall = classify_overall(self)
 
     def compute_β_CTX(self):
         """计算 β-CTX 的区间和解读"""
         # 正常区间
-        self.β_CTX.standard_value_range_min, self.β_CTX.standard_value_range_max = 0.3, 2.0
+        ranges = self.profile.β_CTX
+        low, mid_low, high = ranges["low"], ranges["mid_low"], ranges["high"]
+        self.β_CTX.standard_value_range_min, self.β_CTX.standard_value_range_max = ranges["standard"]
         self.β_CTX.interpretation = "β-CTX指标反映骨吸收活性。"
-        if self.β_CTX.value < 0.2:
+        if self.β_CTX.value < low:
             self.β_CTX.range = "低"
             self.β_CTX.result = "低动力型"
-            self.β_CTX.reference_value_range = f"β < 0.2{self.β_CTX.unit}"
-            self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = 0, 0.2
+            self.β_CTX.reference_value_range = f"β < {low}{self.β_CTX.unit}"
+            self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = 0, low
             self.β_CTX.interpretation += (
                 f"当前指标处于低区间：{self.β_CTX.reference_value_range}。"
                 f"骨吸收显著降低，破骨细胞活性不足，若骨密度 (T值) 低于-2.5，则为低动力型骨质疏松。常见于老年人、长期卧床或服用特定药物（如糖皮质激素）的患者。需要促进骨形成，而非抑制骨吸收。"
             )
             self.β_CTX.is_abnormal = True  # 标记为异常
             self.β_CTX.medication_suggestion = "成骨治疗：使用特立帕肽。"
-        elif 0.2 <= self.β_CTX.value < 0.3:
+        elif low <= self.β_CTX.value < mid_low:
             self.β_CTX.range = "中偏低"
             self.β_CTX.result = "中低型"
-            self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = 0.2, 0.3
-            self.β_CTX.reference_value_range = f"0.2 < β < 0.3{self.β_CTX.unit}"
+            self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = low, mid_low
+            self.β_CTX.reference_value_range = f"{low} < β < {mid_low}{self.β_CTX.unit}"
             self.β_CTX.interpretation += f"当前指标处于{'男性' if self.is_male else '女性'}的中低区间：{self.β_CTX.reference_value_range}。" \
                                          f"骨吸收略有活跃，但仍处于低水平，骨质流失较缓慢。若骨密度 (T值) 低于-2.5，则为早期骨质疏松，需要进行基础干预和补充治疗。"
             self.β_CTX.is_abnormal = True  # 标记为异常
             self.β_CTX.medication_suggestion = "服钙剂、维生素D。"
-        elif 0.3 <= self.β_CTX.value < 2.0:
-            threshold_value = 0.573
+        elif mid_low <= self.β_CTX.value < high:
             if self.is_male:
                 # 年龄判断模式
-                if self.age < 50:
-                    self.β_CTX.reference_age_range = "50岁以下"
-                elif 50 <= self.age <= 70:
-                    threshold_value = 0.695
-                    self.β_CTX.reference_age_range = "50~70岁之间"
-                else:
-                    threshold_value = 0.835
-                    self.β_CTX.reference_age_range = "70岁以上"
+                age_band = self.profile.lookup_band(self.profile.β_CTX_male_age_bands, self.age)
+                threshold_value = age_band.values["threshold"]
+                self.β_CTX.reference_age_range = age_band.label
             else:
                 # 女性
-                threshold_value = 0.563
+                threshold_value = ranges["female_threshold"]
 
-            if 0.3 <= self.β_CTX.value < threshold_value:
+            if mid_low <= self.β_CTX.value < threshold_value:
                 self.β_CTX.range = "中"
                 self.β_CTX.result = "中高动力型"
-                self.β_CTX.reference_value_range = f"0.3 < β < {threshold_value}{self.β_CTX.unit}"
-                self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = 0.3, threshold_value
+                self.β_CTX.reference_value_range = f"{mid_low} < β < {threshold_value}{self.β_CTX.unit}"
+                self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = mid_low, threshold_value
                 if self.is_male:
                     self.β_CTX.interpretation += f"当前指标处于{self.β_CTX.reference_age_range}男性的中区间：{self.β_CTX.reference_value_range}。" \
                                                  f"骨吸收活性增强，若骨密度 (T值) 低于-2.5，则为中高动力型骨质疏松；" \
@@ -149,11 +168,11 @@ class IndicatorsAnalysis:
                                                  f"多见于围绝经期女性或老年人。需要积极控制骨吸收，防止骨量进一步流失。"
 
                 self.β_CTX.medication_suggestion = "抗骨治疗：双膦酸盐、地舒单抗"
-            elif threshold_value <= self.β_CTX.value < 2.0:
+            elif threshold_value <= self.β_CTX.value < high:
                 self.β_CTX.range = "中偏高"
                 self.β_CTX.result = "高动力型（原发性）"
-                self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = threshold_value, 2.0
-                self.β_CTX.reference_value_range = f"{threshold_value} < β < 2.0{self.β_CTX.unit}"
+                self.β_CTX.reference_value_range_min, self.β_CTX.reference_value_range_max = threshold_value, high
+                self.β_CTX.reference_value_range = f"{threshold_value} < β < {high}{self.β_CTX.unit}"
                 if self.is_male:
                     self.β_CTX.interpretation += f"当前指标处于{self.β_CTX.reference_age_range}男性的中高区间：{self.β_CTX.reference_value_range}。" \
                                                  f"骨吸收显著活跃，骨代谢处于高动力状态，若骨密度 (T值) 低于-2.5，则为高动力型（原发性）骨质疏松。" \
@@ -166,8 +185,8 @@ class IndicatorsAnalysis:
             self.β_CTX.range = "高"
             self.β_CTX.result = "高动力型（继发性）"
             self.β_CTX.is_abnormal = True  # 标记为异常
-            self.β_CTX.reference_value_range = f"β ≥ 2.0{self.β_CTX.unit}（约两倍参考值）"
-            self.β_CTX.reference_value_range_min = 2.0
+            self.β_CTX.reference_value_range = f"β ≥ {high}{self.β_CTX.unit}（约两倍参考值）"
+            self.β_CTX.reference_value_range_min = high
             self.β_CTX.interpretation += f"当前指标处于高区间：{self.β_CTX.reference_value_range}。" \
                                          f"骨吸收极为活跃，属于高动力型（继发性）骨质疏松，通常由 继发性病因（如甲状旁腺功能亢进）导致，病因明确的情况下，应先解决基础问题，再进行骨质疏松治疗。"
             self.β_CTX.medication_suggestion = "抗骨治疗：双膦酸盐、地舒单抗"
@@ -180,15 +199,9 @@ class IndicatorsAnalysis:
         self.P1NP.interpretation = "P1NP指标是骨形成标志物，反映成骨细胞活性。"
 
         # 正常区间
-        self.P1NP.standard_value_range_min, self.P1NP.standard_value_range_max = 22.59, 75.17
+        self.P1NP.standard_value_range_min, self.P1NP.standard_value_range_max = self.profile.P1NP["standard"]
 
-        threshold_low = 14.56
-        threshold_high = 59.62
-        if self.is_male:
-            threshold_low = 22.59
-            threshold_high = 75.17
-        else:
-            pass
+        threshold_low, threshold_high = self.profile.P1NP["male" if self.is_male else "female"]
 
         if self.P1NP.value < threshold_low:
             self.P1NP.range = "低"
@@ -224,25 +237,27 @@ class IndicatorsAnalysis:
     def compute_VD(self):
         """计算 25-羟基维生素D 的区间和解读"""
         # 正常区间
-        self.VD.standard_value_range_min, self.VD.standard_value_range_max = 20, 30
-        if self.VD.value < 20:
+        ranges = self.profile.VD
+        deficient_below, sufficient_from = ranges["deficient_below"], ranges["sufficient_from"]
+        self.VD.standard_value_range_min, self.VD.standard_value_range_max = ranges["standard"]
+        if self.VD.value < deficient_below:
             self.VD.range = "严重不足"
             self.VD.is_abnormal = True  # 标记为异常
-            self.VD.reference_value_range = f"VD < 20{self.VD.unit}"
-            self.VD.reference_value_range_max = 20
+            self.VD.reference_value_range = f"VD < {deficient_below}{self.VD.unit}"
+            self.VD.reference_value_range_max = deficient_below
             self.VD.result = "维生素D缺乏"
             self.VD.interpretation += f"维生素D严重不足，可能导致钙吸收降低，引发骨质疏松、骨软化甚至低钙血症。" \
                                         f"老年人、孕妇、长期日照不足者或肝肾功能不全患者常见。需快速补充维生素D，避免进一步骨质流失或并发症。"
-        elif 20 <= self.VD.value < 30:
+        elif deficient_below <= self.VD.value < sufficient_from:
             self.VD.range = "低"
-            self.VD.reference_value_range = f"20 ≤ VD < 30{self.VD.unit}"
-            self.VD.reference_value_range_min, self.VD.reference_value_range_max = 20, 30
+            self.VD.reference_value_range = f"{deficient_below} ≤ VD < {sufficient_from}{self.VD.unit}"
+            self.VD.reference_value_range_min, self.VD.reference_value_range_max = deficient_below, sufficient_from
             self.VD.result = "维生素D不足"
             self.VD.interpretation += f"维生素D水平低于理想范围，但尚未导致严重代谢紊乱。钙吸收率下降，可能存在轻度骨质减少，长期维持此状态会增加骨质疏松风险。"
         else:
             self.VD.range = "正常"
-            self.VD.reference_value_range = f"VD ≥ 30{self.VD.unit}"
-            self.VD.reference_value_range_min = 30
+            self.VD.reference_value_range = f"VD ≥ {sufficient_from}{self.VD.unit}"
+            self.VD.reference_value_range_min = sufficient_from
             self.VD.result = "维生素D充足"
             self.VD.interpretation += f"维生素D水平在理想范围内，钙吸收效率高，骨代谢处于正常状态。"
 
@@ -252,44 +267,24 @@ class IndicatorsAnalysis:
         """计算 N-MID 骨钙素"""
         self.N_MID.interpretation = "N-MID指标反映成骨细胞功能水平, 在血液中相比骨钙素更稳定。"
 
-        threshold_low = 22
-        threshold_high = 69
-        reference_age_range = ""
-        reference_age_range = ""
-        if self.age <= 29:
-            # 参考范围为 22-69
-            self.N_MID.reference_age_range = "18~29岁"
-            self.N_MID.reference_value_range = "22 < N-MID < 69ng/ml"
-            # 正常区间
-            self.N_MID.standard_value_range_min, self.N_MID.standard_value_range_max = 14.8, 64.5
-        elif 29 < self.age <= 50:
-            # 参考范围为 15-41
-            threshold_low = 22
-            threshold_high = 69
-            self.N_MID.reference_age_range = "30~50岁"
-            self.N_MID.reference_value_range = "15 < N-MID < 41ng/ml"
-            # 正常区间
-            self.N_MID.standard_value_range_min, self.N_MID.standard_value_range_max = 15, 41
-        elif 50 < self.age <= 70:
-            # 参考范围为 15-41
-            threshold_low = 15
-            threshold_high = 46
-            self.N_MID.reference_age_range = "51~70岁"
-            self.N_MID.reference_value_range = "15 < N-MID < 46ng/ml"
-            # 正常区间
-            self.N_MID.standard_value_range_min, self.N_MID.standard_value_range_max = 15, 46
-        else:
-            # 老年人
-            threshold_low = threshold_high = 13
-            self.N_MID.reference_age_range = "70岁以上"
-            self.N_MID.reference_value_range = "N-MID  < 13g/ml"
-            self.N_MID.standard_value_range_max = 13
+        # 按年龄段确定参考范围
+        age_band = self.profile.lookup_band(self.profile.N_MID_age_bands, self.age)
+        threshold_low, threshold_high = age_band.values["threshold_low"], age_band.values["threshold_high"]
+        self.N_MID.reference_age_range = age_band.label
+        self.N_MID.reference_value_range = age_band.values["reference_text"]
+        # 正常区间，未配置的一端保持 init() 中的全区间
+        standard_min, standard_max = age_band.values["standard"]
+        if standard_min is not None:
+            self.N_MID.standard_value_range_min = standard_min
+        if standard_max is not None:
+            self.N_MID.standard_value_range_max = standard_max
+        osteoporosis = self.profile.bone_density["osteoporosis"]
 
         if self.N_MID.value < threshold_low:
             self.N_MID.reference_value_range_max = threshold_low
             self.N_MID.range = "低"
             if self.has_bone_density:
-                if self.bone_density.value < -2.5:
+                if self.bone_density.value < osteoporosis:
                     self.N_MID.is_abnormal = True  # 标记为异常
                     self.N_MID.result = "骨形成不足或低动力型骨质疏松(缺失材料)"
                     self.N_MID.interpretation = f"对于{self.N_MID.reference_age_range}年龄群体的N-MID参考范围" \
@@ -311,7 +306,7 @@ class IndicatorsAnalysis:
             self.N_MID.standard_value_range_min, self.N_MID.standard_value_range_max = threshold_low, threshold_high * 2
             self.N_MID.range = "正常"
             if self.has_bone_density:
-                if self.bone_density.value < -2.5:
+                if self.bone_density.value < osteoporosis:
                     self.N_MID.is_abnormal = True  # 标记为异常
                     self.N_MID.result = "低动力型骨质疏松"
                     self.N_MID.interpretation = f"对于{self.N_MID.reference_age_range}年龄群体的N-MID参考范围" \
@@ -353,14 +348,17 @@ class IndicatorsAnalysis:
     def compute_PTH(self):
         """计算 PTH 的区间和解读"""
         # 正常区间
-        self.PTH.standard_value_range_min, self.PTH.standard_value_range_max = 14.8, 64.5
-        if self.PTH.value < 14.8:
+        ranges = self.profile.PTH
+        low, high = ranges["low"], ranges["high"]
+        osteoporosis = self.profile.bone_density["osteoporosis"]
+        self.PTH.standard_value_range_min, self.PTH.standard_value_range_max = ranges["standard"]
+        if self.PTH.value < low:
             self.PTH.range = "低"
-            self.PTH.reference_value_range = f"PTH < 14.8{self.VD.unit}"
-            self.PTH.reference_value_range_max = 14.8
+            self.PTH.reference_value_range = f"PTH < {low}{self.VD.unit}"
+            self.PTH.reference_value_range_max = low
             self.PTH.is_abnormal = True  # 标记为异常
             if self.has_bone_density:
-                if self.bone_density.value < -2.5:
+                if self.bone_density.value < osteoporosis:
                     self.PTH.result = "非甲旁引起的骨质疏松症"
                     self.PTH.interpretation += (
                         f"当前指标处于低区间：{self.PTH.reference_value_range}。结合骨密度 (T值) 低于-2.5，提示骨质疏松可能由其他非甲状旁腺原因引起，"
@@ -376,12 +374,12 @@ class IndicatorsAnalysis:
                 self.PTH.interpretation += (
                     f"当前指标处于低区间：{self.PTH.reference_value_range}。未提供骨密度 (T值) 数据，建议结合骨密度检查进一步评估是否存在骨质疏松或其他代谢异常。"
                 )
-        elif 14.8 <= self.PTH.value <= 64.5:
+        elif low <= self.PTH.value <= high:
             self.PTH.range = "正常"
-            self.PTH.reference_value_range = f"14.8 ≤ PTH ≤ 64.5{self.VD.unit}"
-            self.PTH.reference_value_range_min, self.PTH.reference_value_range_max = 14.8, 64.5
+            self.PTH.reference_value_range = f"{low} ≤ PTH ≤ {high}{self.VD.unit}"
+            self.PTH.reference_value_range_min, self.PTH.reference_value_range_max = low, high
             if self.has_bone_density:
-                if self.bone_density.value < -2.5:
+                if self.bone_density.value < osteoporosis:
                     self.PTH.is_abnormal = True  # 标记为异常
                     self.PTH.result = "非甲旁引起的骨质疏松症"
                     self.PTH.interpretation += (
@@ -400,10 +398,10 @@ class IndicatorsAnalysis:
         else:
             self.PTH.range = "偏高"
             self.PTH.is_abnormal = True  # 标记为异常
-            self.PTH.reference_value_range = f"PTH > 64.5{self.VD.unit}"
-            self.PTH.reference_value_range_min = 64.5
+            self.PTH.reference_value_range = f"PTH > {high}{self.VD.unit}"
+            self.PTH.reference_value_range_min = high
             if self.has_bone_density:
-                if self.bone_density.value < -2.5:
+                if self.bone_density.value < osteoporosis:
                     self.PTH.result = "甲旁亢引起的骨质疏松症"
                     self.PTH.interpretation += (
                         f"当前指标处于偏高区间：{self.PTH.reference_value_range}。结合骨密度 (T值) 低于-2.5，提示甲状旁腺功能亢进导致的骨吸收过高，可能伴随骨质疏松症风险。"
@@ -425,17 +423,13 @@ class IndicatorsAnalysis:
 
     def compute_CT(self):
         """计算降钙素的区间和解读"""
-        threshold_value = 6.26
-        if self.is_male:
-            threshold_value = 9.72
-        else:
-            pass
+        threshold_value = self.profile.CT["male_threshold" if self.is_male else "female_threshold"]
         # 正常区间
         self.CT.standard_value_range_max = threshold_value
 
         if self.CT.value < threshold_value:
             self.CT.range = "正常"
-            self.CT.reference_value_range = f"CT ≤ {9.72 if self.is_male else 6.26}{self.VD.unit}"
+            self.CT.reference_value_range = f"CT ≤ {threshold_value}{self.VD.unit}"
             self.CT.reference_value_range_max = threshold_value
             self.CT.result = "正常"
             self.CT.interpretation = f"{'男性' if self.is_male else '女性'}正常区间为CT值 ≤ {threshold_value}pg/ml，" \
@@ -444,7 +438,7 @@ class IndicatorsAnalysis:
         else:
             self.CT.is_abnormal = True  # 标记为异常
             self.CT.range = "偏高"
-            self.CT.reference_value_range = f"CT ≥ {9.72 if self.is_male else 6.26}{self.VD.unit}"
+            self.CT.reference_value_range = f"CT ≥ {threshold_value}{self.VD.unit}"
             self.bone_density.reference_value_range_min = threshold_value
             self.CT.result = "提示甲状腺髓样瘤"
             self.CT.interpretation = f"{'男性' if self.is_male else '女性'}正常区间为CT值 ≤ {threshold_value}pg/ml，" \
@@ -457,21 +451,23 @@ class IndicatorsAnalysis:
         """计算骨密度"""
         self.bone_density.interpretation = "骨密度（T值）是骨量的重要指标，用于评估骨质疏松风险。"
         # 正常区间
-        self.bone_density.standard_value_range_min, self.bone_density.standard_value_range_max = -1.0, 1.0
+        ranges = self.profile.bone_density
+        normal_from, osteoporosis = ranges["normal_from"], ranges["osteoporosis"]
+        self.bone_density.standard_value_range_min, self.bone_density.standard_value_range_max = ranges["standard"]
 
-        if self.bone_density.value >= -1.0:
+        if self.bone_density.value >= normal_from:
             self.bone_density.range = "正常"
-            self.bone_density.reference_value_range = f"T值 ≥ -1.0"
-            self.bone_density.reference_value_range_min = -1.0
+            self.bone_density.reference_value_range = f"T值 ≥ {normal_from}"
+            self.bone_density.reference_value_range_min = normal_from
             self.bone_density.result = "骨密度正常"
             self.bone_density.interpretation += (
                 f"当前骨密度T值为{self.bone_density.value}，处于正常范围：{self.CT.reference_value_range}。"
                 f"提示骨量良好，骨折风险较低，无需特别干预，但建议定期监测骨密度变化。"
             )
-        elif -2.5 < self.bone_density.value < -1.0:
+        elif osteoporosis < self.bone_density.value < normal_from:
             self.bone_density.range = "偏低"
-            self.bone_density.reference_value_range = f"-2.5 < T值 < -1.0"
-            self.bone_density.reference_value_range_min, self.bone_density.reference_value_range_max = -2.5, -1.0
+            self.bone_density.reference_value_range = f"{osteoporosis} < T值 < {normal_from}"
+            self.bone_density.reference_value_range_min, self.bone_density.reference_value_range_max = osteoporosis, normal_from
             self.bone_density.result = "骨量减少"
             self.bone_density.interpretation += (
                 f"当前骨密度T值为{self.bone_density.value}，处于骨量减少范围：{self.CT.reference_value_range}。"
@@ -481,8 +477,8 @@ class IndicatorsAnalysis:
         else:
             self.bone_density.is_abnormal = True  # 标记为异常
             self.bone_density.range = "过低"
-            self.bone_density.reference_value_range = f"T值 ≤ -2.5"
-            self.bone_density.reference_value_range_max = -2.5
+            self.bone_density.reference_value_range = f"T值 ≤ {osteoporosis}"
+            self.bone_density.reference_value_range_max = osteoporosis
             self.bone_density.result = "骨质疏松"
             self.bone_density.interpretation += (
                 f"当前骨密度T值为{self.bone_density.value}，低于骨质疏松诊断标准：{self.CT.reference_value_range}。"
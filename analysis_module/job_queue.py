@@ -0,0 +1,252 @@
+"""
+全面分析（slow 模式）任务队列：有界队列 + 工作线程池 + SQLite 持久化
+"""
+import itertools
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from analysis_module import result_codec
+
+# 优先级通道，数值越小越先执行
+PRIORITY_LANES = {"interactive": 0, "batch": 1}
+
+# 任务状态
+STATUS_DEFERRED = "deferred"  # 队列已满，暂缓入队
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED)
+
+
+class QueueFullError(Exception):
+    """队列已满且不允许暂缓时，拒绝新任务"""
+
+
+class JobNotFoundError(KeyError):
+    """任务 id 不存在"""
+
+
+def default_handler(input_data):
+    from ai_analysis import ai_analysis
+    # 异步任务由客户端轮询结果，不受全面分析时限限制
+    return ai_analysis(input_data, mode="slow", deadline_seconds=0)
+
+
+class AnalysisJobQueue:
+    """
+    提交任务立即返回 job_id，由工作线程异步执行；任务及结果保存在本地 SQLite 中，服务重启后未完成的任务会重新入队。
+
+    Args:
+        db_path: SQLite 文件路径
+        workers: 工作线程数
+        max_pending: 排队中与执行中任务数的上限
+        overflow: 队列满时的处理方式，"reject" 直接拒绝，"defer" 暂缓（落库但不入队，有空位时按优先级补入）
+        max_deferred: 暂缓任务数的上限，超过后同样拒绝
+        handler: 执行单个任务的函数，默认调用 ai_analysis(input_data, mode="slow", deadline_seconds=0)
+    """
+
+    def __init__(self, db_path: str = "analysis_jobs.db", workers: int = 4, max_pending: int = 64,
+                 overflow: str = "reject", max_deferred: int = 1024,
+                 handler: Optional[Callable[[dict], dict]] = None):
+        if overflow not in ("reject", "defer"):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.max_deferred = max_deferred
+        self.handler = handler or default_handler
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                input_data TEXT NOT NULL,
+                result BLOB,  -- result_codec 编码；升级前写入的为 JSON 文本
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, created_at)")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()  # 同一优先级内按提交顺序执行
+        self._pending = 0  # 排队中 + 执行中的任务数
+        self._state_lock = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        """恢复上次未完成的任务并启动工作线程"""
+        with self._db_lock:
+            # 上次中断时正在执行的任务重新执行
+            self._db.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?",
+                             (STATUS_QUEUED, STATUS_RUNNING))
+            self._db.commit()
+            rows = self._db.execute("SELECT job_id, priority FROM jobs WHERE status = ? ORDER BY created_at",
+                                    (STATUS_QUEUED,)).fetchall()
+        with self._state_lock:
+            for job_id, priority in rows:
+                self._queue.put((priority, next(self._sequence), job_id))
+                self._pending += 1
+        self._promote_deferred()
+
+        self._stopping = False
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"analysis-job-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止工作线程，正在执行的任务会执行完毕，排队中的任务保留在数据库中"""
+        self._stopping = True
+        for _ in self._threads:
+            self._queue.put((-1, next(self._sequence), None))
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # ---------- 对外接口 ----------
+
+    def submit(self, input_data: dict, priority: str = "interactive") -> str:
+        """提交任务，返回 job_id；队列已满时按 overflow 策略拒绝（QueueFullError）或暂缓"""
+        if priority not in PRIORITY_LANES:
+            raise ValueError(f"Unknown priority lane: {priority}")
+        lane = PRIORITY_LANES[priority]
+        job_id = uuid.uuid4().hex
+
+        with self._state_lock:
+            if self._pending < self.max_pending:
+                status = STATUS_QUEUED
+                self._pending += 1
+            elif self.overflow == "defer" and self._count(STATUS_DEFERRED) < self.max_deferred:
+                status = STATUS_DEFERRED
+            else:
+                raise QueueFullError(f"Analysis queue is full ({self._pending} pending jobs)")
+
+            with self._db_lock:
+                self._db.execute("INSERT INTO jobs (job_id, priority, status, input_data, created_at) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 (job_id, lane, status, json.dumps(input_data, ensure_ascii=False), time.time()))
+                self._db.commit()
+            if status == STATUS_QUEUED:
+                self._queue.put((lane, next(self._sequence), job_id))
+        return job_id
+
+    def poll(self, job_id: str) -> dict:
+        """查询任务状态，已完成的任务附带结果"""
+        with self._db_lock:
+            row = self._db.execute("SELECT status, result, created_at, started_at, finished_at FROM jobs "
+                                   "WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFoundError(job_id)
+        status, result, created_at, started_at, finished_at = row
+        job = {"job_id": job_id, "status": status, "created_at": created_at,
+               "started_at": started_at, "finished_at": finished_at}
+        if status == STATUS_QUEUED or status == STATUS_DEFERRED:
+            job["queue_depth"] = self.depth()
+        if result is not None:
+            job["result"] = result_codec.decode(result)
+        return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> dict:
+        """阻塞等待任务完成（或超时），返回与 poll 相同的结构"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._state_lock:
+            while True:
+                job = self.poll(job_id)
+                if job["status"] in FINISHED_STATUSES:
+                    return job
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return job
+                self._state_lock.wait(remaining)
+
+    def depth(self) -> int:
+        """排队中与执行中的任务数"""
+        return self._pending
+
+    # ---------- 内部实现 ----------
+
+    def _count(self, status: str) -> int:
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def _set_status(self, job_id: str, status: str, **columns):
+        assignments = ", ".join(["status = ?"] + [f"{column} = ?" for column in columns])
+        with self._db_lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                             (status, *columns.values(), job_id))
+            self._db.commit()
+
+    def _promote_deferred(self):
+        """队列有空位时，将暂缓的任务按优先级、提交时间补入队列"""
+        with self._state_lock:
+            free = self.max_pending - self._pending
+            if free <= 0:
+                return
+            with self._db_lock:
+                rows = self._db.execute("SELECT job_id, priority FROM jobs WHERE status = ? "
+                                        "ORDER BY priority, created_at LIMIT ?", (STATUS_DEFERRED, free)).fetchall()
+                self._db.executemany("UPDATE jobs SET status = ? WHERE job_id = ?",
+                                     [(STATUS_QUEUED, job_id) for job_id, _ in rows])
+                self._db.commit()
+            for job_id, priority in rows:
+                self._queue.put((priority, next(self._sequence), job_id))
+                self._pending += 1
+
+    def _worker_loop(self):
+        while True:
+            priority, _, job_id = self._queue.get()
+            if job_id is None or self._stopping:
+                if job_id is not None:
+                    # 放回队列，留给重启后的工作线程
+                    self._queue.put((priority, next(self._sequence), job_id))
+                return
+
+            self._set_status(job_id, STATUS_RUNNING, started_at=time.time())
+            with self._db_lock:
+                input_data = json.loads(self._db.execute("SELECT input_data FROM jobs WHERE job_id = ?",
+                                                         (job_id,)).fetchone()[0])
+            try:
+                result = self.handler(input_data)
+            except Exception as e:
+                result = {"status": "error", "message": f"An error occurred: {str(e)}"}
+            status = STATUS_DONE if result.get("status") == "success" else STATUS_FAILED
+            self._set_status(job_id, status, result=result_codec.encode(result), finished_at=time.time())
+
+            with self._state_lock:
+                self._pending -= 1
+                self._state_lock.notify_all()
+            self._promote_deferred()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import os
+
+    def sleepy_handler(input_data):
+        time.sleep(0.2)
+        return {"status": "success", "message": "Data processed successfully.", "result": input_data}
+
+    db_path = os.path.join(tempfile.mkdtemp(), "jobs.db")
+    job_queue = AnalysisJobQueue(db_path, workers=2, max_pending=4, overflow="defer", handler=sleepy_handler).start()
+    job_ids = [job_queue.submit({"index": index}, priority="batch" if index % 2 else "interactive")
+               for index in range(8)]
+    print([job_queue.poll(job_id)["status"] for job_id in job_ids])
+    print([job_queue.wait(job_id, timeout=5)["status"] for job_id in job_ids])
+    job_queue.stop()
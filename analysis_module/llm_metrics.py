@@ -0,0 +1,219 @@
+"""
+大模型调用的 token、耗时与费用统计
+每次调用记录 prompt/completion token、总耗时、流式输出时的首 token 耗时、模型及结果（ok / parse_failure / error），
+在进程内聚合为计数器与直方图，并输出 Prometheus 文本格式（api_server 的 /metrics，或定期写入 LLM_METRICS_FILE）
+
+Streamlit 的多个会话运行在不同线程中：每个线程写入自己的分片，不加锁；只有导出时才合并各分片，
+已结束线程的分片并入汇总后丢弃（Streamlit 每次运行脚本都会新建线程）
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+OUTCOME_OK = "ok"
+OUTCOME_PARSE_FAILURE = "parse_failure"
+OUTCOME_ERROR = "error"
+
+# 直方图桶上界（秒）
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10)
+
+# 每百万 token 的价格（美元）：(prompt, completion)；可用 LLM_PRICES_JSON 覆盖，格式相同
+MODEL_PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+MODEL_PRICES.update({model: tuple(prices) for model, prices in json.loads(os.getenv("LLM_PRICES_JSON", "{}")).items()})
+
+METRICS_FILE = os.getenv("LLM_METRICS_FILE", "")
+METRICS_FILE_INTERVAL_SECONDS = 15
+# 注册新分片时，分片数超过该值即合并已结束线程的分片
+COMPACT_SHARDS_ABOVE = 64
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按价格表估算一次调用的费用（美元），未知模型记为 0"""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class _Shard:
+    """单个线程的统计数据，只由所属线程写入"""
+
+    def __init__(self):
+        # (模型, 结果) -> [调用次数, 耗时总和, 各桶计数..., +Inf 桶]
+        self.calls: Dict[tuple, List[float]] = {}
+        # 模型 -> [prompt token, completion token, 命中缓存的 prompt token, 费用]
+        self.tokens: Dict[str, List[float]] = {}
+        # 模型 -> [次数, 总和, 各桶计数..., +Inf 桶]
+        self.ttft: Dict[str, List[float]] = {}
+
+
+def _observe(series: List[float], buckets, value: float):
+    series[0] += 1
+    series[1] += value
+    series[2 + bisect.bisect_left(buckets, value)] += 1
+
+
+def _merge_into(target: _Shard, source: _Shard):
+    for name in ("calls", "tokens", "ttft"):
+        merged = getattr(target, name)
+        for key, series in list(getattr(source, name).items()):
+            total = merged.get(key)
+            merged[key] = list(series) if total is None else [a + b for a, b in zip(total, series)]
+
+
+class LLMMetrics:
+    def __init__(self):
+        self._local = threading.local()
+        # (所属线程, 分片)
+        self._shards: List[tuple] = []
+        # 已结束线程的分片汇总
+        self._retired = _Shard()
+        self._register_lock = threading.Lock()
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            # 每个线程只注册一次
+            with self._register_lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > COMPACT_SHARDS_ABOVE:
+                    self._compact()
+        return shard
+
+    def _compact(self):
+        """需持有 _register_lock；已结束的线程不会再写入其分片，可安全合并"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge_into(self._retired, shard)
+        self._shards = alive
+
+    def record(self, model: str, outcome: str, seconds: float, usage: Optional[dict] = None,
+               ttft_seconds: Optional[float] = None):
+        shard = self._shard()
+        calls = shard.calls.get((model, outcome))
+        if calls is None:
+            calls = shard.calls[(model, outcome)] = [0, 0.0] + [0] * (len(LATENCY_BUCKETS) + 1)
+        _observe(calls, LATENCY_BUCKETS, seconds)
+
+        if usage:
+            tokens = shard.tokens.get(model)
+            if tokens is None:
+                tokens = shard.tokens[model] = [0, 0, 0, 0.0]
+            prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+            tokens[0] += prompt_tokens
+            tokens[1] += completion_tokens
+            tokens[2] += usage.get("cached_tokens", 0)
+            tokens[3] += call_cost(model, prompt_tokens, completion_tokens)
+
+        if ttft_seconds is not None:
+            ttft = shard.ttft.get(model)
+            if ttft is None:
+                ttft = shard.ttft[model] = [0, 0.0] + [0] * (len(TTFT_BUCKETS) + 1)
+            _observe(ttft, TTFT_BUCKETS, ttft_seconds)
+
+    def snapshot(self) -> dict:
+        """合并各线程分片；读取时其他线程可能正在写入，个别计数可能滞后一次调用"""
+        merged = _Shard()
+        with self._register_lock:
+            self._compact()
+            _merge_into(merged, self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            _merge_into(merged, shard)
+        return {"calls": merged.calls, "tokens": merged.tokens, "ttft": merged.ttft}
+
+    def prometheus_text(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        def histogram(name, help_text, series_by_labels, buckets):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, series in sorted(series_by_labels.items()):
+                cumulative = 0
+                for bound, count in zip([*buckets, "+Inf"], series[2:]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {series[1]:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {series[0]}")
+
+        histogram("llm_request_duration_seconds", "LLM call wall time by model and outcome.",
+                  {f'model="{model}",outcome="{outcome}"': series
+                   for (model, outcome), series in snapshot["calls"].items()}, LATENCY_BUCKETS)
+        histogram("llm_time_to_first_token_seconds", "Time to first streamed token by model.",
+                  {f'model="{model}"': series for model, series in snapshot["ttft"].items()}, TTFT_BUCKETS)
+
+        for index, (name, help_text) in enumerate([
+            ("llm_prompt_tokens_total", "Prompt tokens by model."),
+            ("llm_completion_tokens_total", "Completion tokens by model."),
+            ("llm_cached_prompt_tokens_total", "Prompt tokens served from the provider prompt cache."),
+            ("llm_cost_usd_total", "Estimated spend in USD by model."),
+        ]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for model, tokens in sorted(snapshot["tokens"].items()):
+                value = f"{tokens[index]:.6f}" if index == 3 else str(tokens[index])
+                lines.append(f'{name}{{model="{model}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: str):
+        """先写临时文件再替换，采集端不会读到写了一半的文件"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+
+llm_metrics = LLMMetrics()
+_file_writer_started = False
+
+
+def start_metrics_file_writer(path: str = None, interval: float = METRICS_FILE_INTERVAL_SECONDS) -> bool:
+    """
+    定期将统计写入文件（例如 node_exporter 的 textfile 目录），用于没有 HTTP 接口的 Streamlit 进程
+    未配置路径时不启动；每个进程只启动一次
+    """
+    global _file_writer_started
+    path = path or METRICS_FILE
+    if not path or _file_writer_started:
+        return False
+    _file_writer_started = True
+
+    def loop():
+        while True:
+            try:
+                llm_metrics.write_file(path)
+            except OSError as e:
+                print(f"Failed to write LLM metrics file {path}: {str(e)}")
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="llm-metrics-writer", daemon=True).start()
+    return True
+
+
+if __name__ == "__main__":
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    def simulate(_):
+        for _ in range(10000):
+            llm_metrics.record("gpt-4o", random.choice([OUTCOME_OK] * 8 + [OUTCOME_PARSE_FAILURE, OUTCOME_ERROR]),
+                               random.uniform(1, 40), {"prompt_tokens": 1500, "completion_tokens": 400},
+                               random.uniform(0.2, 2))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(simulate, range(8)))
+    elapsed = time.perf_counter() - start
+    print(f"80000 次记录耗时 {elapsed * 1000:.0f} ms（{elapsed / 80000 * 1e6:.2f} μs/次）")
+    print(llm_metrics.prometheus_text())
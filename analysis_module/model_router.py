@@ -0,0 +1,129 @@
+"""
+AI全面分析的大模型路由：按病例复杂度、队列深度和各模型近期延迟（EWMA）为每个请求选择模型
+并按路由统计延迟与 token 用量，便于调整阈值
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+FAST_MODEL = os.getenv("ROUTER_FAST_MODEL", "gpt-4o-mini")
+STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL", "gpt-4o")
+# 复杂度不超过该值的病例使用快速模型
+SIMPLE_MAX_COMPLEXITY = int(os.getenv("ROUTER_SIMPLE_MAX_COMPLEXITY", "2"))
+# 强模型过载时，复杂度不超过该值的病例改用快速模型；更复杂的病例始终使用强模型
+OVERLOAD_MAX_COMPLEXITY = int(os.getenv("ROUTER_OVERLOAD_MAX_COMPLEXITY", "4"))
+# 过载判定：队列深度与强模型延迟 EWMA（秒）同时超过阈值
+OVERLOAD_QUEUE_DEPTH = int(os.getenv("ROUTER_OVERLOAD_QUEUE_DEPTH", "16"))
+OVERLOAD_LATENCY_SECONDS = float(os.getenv("ROUTER_OVERLOAD_LATENCY_SECONDS", "20"))
+EWMA_ALPHA = 0.2
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str  # simple / complex / overload
+    model: str
+    complexity: int
+
+
+def case_complexity(indicators_analysis) -> int:
+    """
+    病例复杂度：异常指标数 + 有骨密度T值时加 1 + 需要进一步鉴别（非明确分型）时加 2
+    """
+    overall = indicators_analysis.overall
+    complexity = overall["abnormal_count"]
+    if indicators_analysis.has_bone_density:
+        complexity += 1
+    if not overall["clear_cut"]:
+        complexity += 2
+    return complexity
+
+
+class ModelRouter:
+    def __init__(self, fast_model: str = FAST_MODEL, strong_model: str = STRONG_MODEL,
+                 simple_max_complexity: int = SIMPLE_MAX_COMPLEXITY,
+                 overload_max_complexity: int = OVERLOAD_MAX_COMPLEXITY,
+                 overload_queue_depth: int = OVERLOAD_QUEUE_DEPTH,
+                 overload_latency_seconds: float = OVERLOAD_LATENCY_SECONDS):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.simple_max_complexity = simple_max_complexity
+        self.overload_max_complexity = overload_max_complexity
+        self.overload_queue_depth = overload_queue_depth
+        self.overload_latency_seconds = overload_latency_seconds
+
+        self._queue_depth_provider: Optional[Callable[[], int]] = None
+        self._lock = threading.Lock()
+        self._latency_ewma: Dict[str, float] = {}
+        self._route_stats: Dict[tuple, dict] = {}
+
+    def set_queue_depth_provider(self, provider: Callable[[], int]):
+        """注册当前排队任务数的查询函数，例如 AnalysisJobQueue.depth"""
+        self._queue_depth_provider = provider
+
+    def queue_depth(self) -> int:
+        return self._queue_depth_provider() if self._queue_depth_provider else 0
+
+    def latency_ewma(self, model: str) -> Optional[float]:
+        return self._latency_ewma.get(model)
+
+    def is_overloaded(self, queue_depth: Optional[int] = None) -> bool:
+        queue_depth = self.queue_depth() if queue_depth is None else queue_depth
+        strong_latency = self._latency_ewma.get(self.strong_model)
+        return (queue_depth >= self.overload_queue_depth and strong_latency is not None
+                and strong_latency >= self.overload_latency_seconds)
+
+    def choose(self, indicators_analysis, queue_depth: Optional[int] = None) -> Route:
+        complexity = case_complexity(indicators_analysis)
+        if complexity <= self.simple_max_complexity:
+            return Route("simple", self.fast_model, complexity)
+        if complexity <= self.overload_max_complexity and self.is_overloaded(queue_depth):
+            return Route("overload", self.fast_model, complexity)
+        return Route("complex", self.strong_model, complexity)
+
+    def record(self, route: Route, seconds: float, usage: Optional[dict] = None, ok: bool = True):
+        """记录一次调用的延迟与 token 用量，更新模型延迟 EWMA"""
+        with self._lock:
+            previous = self._latency_ewma.get(route.model)
+            self._latency_ewma[route.model] = seconds if previous is None else \
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous
+            stats = self._route_stats.setdefault((route.name, route.model), {
+                "calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            stats["calls"] += 1
+            stats["errors"] += not ok
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if usage:
+                stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                stats["completion_tokens"] += usage.get("completion_tokens", 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = []
+            for (name, model), stats in self._route_stats.items():
+                calls = stats["calls"]
+                routes.append({
+                    "route": name,
+                    "model": model,
+                    **stats,
+                    "avg_seconds": round(stats["total_seconds"] / calls, 3) if calls else None,
+                    "avg_prompt_tokens": round(stats["prompt_tokens"] / calls, 1) if calls else None,
+                    "avg_completion_tokens": round(stats["completion_tokens"] / calls, 1) if calls else None,
+                })
+            return {
+                "latency_ewma": {model: round(value, 3) for model, value in self._latency_ewma.items()},
+                "queue_depth": self.queue_depth(),
+                "thresholds": {
+                    "simple_max_complexity": self.simple_max_complexity,
+                    "overload_max_complexity": self.overload_max_complexity,
+                    "overload_queue_depth": self.overload_queue_depth,
+                    "overload_latency_seconds": self.overload_latency_seconds,
+                },
+                "routes": routes,
+            }
+
+
+# 进程内共享的路由器
+model_router = ModelRouter()
@@ -0,0 +1,221 @@
+"""
+患者随访记录：本地 SQLite（WAL）保存每次检测的指标数值，按 (患者编号, 检测日期) 建索引
+趋势接口一次取出患者的全部检测记录，用 NumPy 一次性计算各指标的逐次变化、相对基线的变化率以及治疗反应
+（例如抗骨吸收治疗后 β-CTX 的下降幅度）
+"""
+import sqlite3
+import threading
+import time
+from datetime import date
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+# 指标列名与 input_data 中字段的对应关系
+INDICATOR_COLUMNS = {
+    "β_CTX": ("biochemical_indicators", "β-CTX"),
+    "P1NP": ("biochemical_indicators", "P1NP"),
+    "VD": ("biochemical_indicators", "25-Hydroxy Vitamin D"),
+    "N_MID": ("biochemical_indicators", "N-MID Osteocalcin"),
+    "PTH": ("biochemical_indicators", "Parathyroid Hormone"),
+    "CT": ("biochemical_indicators", "Calcitonin"),
+    "bone_density": ("imaging_data", "Bone Density"),
+}
+
+# 用药史中出现以下药物即视为正在接受相应治疗
+ANTIRESORPTIVE_DRUGS = ("双膦酸盐", "阿仑膦酸", "唑来膦酸", "利塞膦酸", "伊班膦酸", "地舒单抗")
+ANABOLIC_DRUGS = ("特立帕肽", "阿巴洛肽", "罗莫佐单抗")
+# 治疗有效的判定：抗骨吸收治疗后 β-CTX 较治疗前下降 ≥ 30%；促骨形成治疗后 P1NP 较治疗前升高 ≥ 30%
+# （骨转换标志物的最小有意义变化约为 30%）
+ANTIRESORPTIVE_RESPONSE_PERCENT = -30.0
+ANABOLIC_RESPONSE_PERCENT = 30.0
+
+
+def _indicator_value(input_data: dict, section: str, key: str) -> Optional[float]:
+    value = input_data.get(section, {}).get(key)
+    if value is None or value == "未输入" or value == "":
+        return None
+    return float(value)
+
+
+def _therapy_mask(medications: np.ndarray, drugs) -> np.ndarray:
+    return np.array([any(drug in (text or "") for drug in drugs) for text in medications], dtype=bool)
+
+
+def _json_list(values: np.ndarray, digits: int = 3) -> list:
+    """NaN 转为 None，便于 JSON 输出"""
+    return [None if np.isnan(value) else round(float(value), digits) for value in values]
+
+
+class PatientHistoryStore:
+    def __init__(self, db_path: str = "patient_history.db"):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"""
+            CREATE TABLE IF NOT EXISTS visits (
+                patient_id TEXT NOT NULL,
+                test_date TEXT NOT NULL,
+                visit_label TEXT NOT NULL DEFAULT '',
+                gender TEXT,
+                age INTEGER,
+                {", ".join(f"{column} REAL" for column in INDICATOR_COLUMNS)},
+                medications TEXT NOT NULL DEFAULT '',
+                created_at REAL NOT NULL
+            )
+        """)
+        # 同一患者同一天只保留一条记录，重复分析时覆盖
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_visits_patient_date ON visits (patient_id, test_date)")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+
+    @staticmethod
+    def _row(patient_id: str, input_data: dict, test_date=None) -> tuple:
+        test_date = test_date or date.today()
+        # 统一为 YYYY-MM-DD，保证按字符串排序即按日期排序；格式错误时抛出 ValueError
+        test_date = (test_date if isinstance(test_date, date) else date.fromisoformat(test_date)).isoformat()
+        patient_info = input_data.get("patient_info", {})
+        medical_history = input_data.get("medical_history", {})
+        return (str(patient_id), test_date, medical_history.get("testing_time", ""),
+                patient_info.get("gender"), patient_info.get("age"),
+                *[_indicator_value(input_data, section, key) for section, key in INDICATOR_COLUMNS.values()],
+                medical_history.get("medications", ""), time.time())
+
+    def add_visits(self, visits: Iterable[tuple]) -> List[bool]:
+        """
+        批量写入，单个事务
+
+        Args:
+            visits: (患者编号, input_data, 检测日期) 的序列，检测日期为 date 或 "YYYY-MM-DD"，为空时取当天
+
+        Returns:
+            list: 每条是否为新记录；该患者当天已有记录（包括本批中靠前的一条）、被覆盖时为 False
+        """
+        rows = [self._row(*visit) for visit in visits]
+        columns = ["patient_id", "test_date", "visit_label", "gender", "age", *INDICATOR_COLUMNS,
+                   "medications", "created_at"]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[2:])
+        inserted, seen = [], set()
+        with self._db_lock:
+            for row in rows:
+                key = row[:2]
+                inserted.append(key not in seen and self._db.execute(
+                    "SELECT 1 FROM visits WHERE patient_id = ? AND test_date = ?", key).fetchone() is None)
+                seen.add(key)
+            self._db.executemany(
+                f"INSERT INTO visits ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT (patient_id, test_date) DO UPDATE SET {updates}", rows)
+            self._db.commit()
+        return inserted
+
+    def add_visit(self, patient_id: str, input_data: dict, test_date=None) -> bool:
+        """写入一次检测，返回是否为新记录"""
+        return self.add_visits([(patient_id, input_data, test_date)])[0]
+
+    def visits(self, patient_id: str) -> dict:
+        """按检测日期返回患者的全部记录（按列组织），缺失的数值为 NaN"""
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT test_date, visit_label, medications, {', '.join(INDICATOR_COLUMNS)} "
+                f"FROM visits WHERE patient_id = ? ORDER BY test_date", (str(patient_id),)).fetchall()
+        values = np.array([row[3:] for row in rows], dtype=np.float64).reshape(len(rows), len(INDICATOR_COLUMNS))
+        return {
+            "test_date": [row[0] for row in rows],
+            "visit_label": [row[1] for row in rows],
+            "medications": np.array([row[2] for row in rows], dtype=object),
+            "values": values,  # (检测次数, 指标数)，列顺序同 INDICATOR_COLUMNS
+        }
+
+    def trend(self, patient_id: str) -> dict:
+        """
+        计算患者各指标的变化趋势与治疗反应
+
+        Returns:
+            dict: 每个指标的数值、与上次相比的变化、相对首次检测的变化率（%），以及每次检测的治疗反应
+        """
+        visits = self.visits(patient_id)
+        values = visits["values"]
+        visit_count = len(values)
+        deltas = np.full_like(values, np.nan)
+        if visit_count > 1:
+            deltas[1:] = np.diff(values, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            baseline = values[:1] if visit_count else values
+            # 骨密度T值可为负数或 0，只计算差值不计算变化率
+            percent_from_baseline = (values - baseline) / np.abs(baseline) * 100
+        percent_from_baseline[:, list(INDICATOR_COLUMNS).index("bone_density")] = np.nan
+
+        indicators = {}
+        for index, column in enumerate(INDICATOR_COLUMNS):
+            indicators[column] = {
+                "values": _json_list(values[:, index]),
+                "delta": _json_list(deltas[:, index]),
+                "percent_from_baseline": _json_list(percent_from_baseline[:, index], 1),
+            }
+
+        return {
+            "patient_id": str(patient_id),
+            "test_date": visits["test_date"],
+            "visit_label": visits["visit_label"],
+            "indicators": indicators,
+            "treatment_response": [
+                *self._treatment_response(values, visits["medications"], ANTIRESORPTIVE_DRUGS, "β_CTX",
+                                          "抗骨吸收治疗", ANTIRESORPTIVE_RESPONSE_PERCENT),
+                *self._treatment_response(values, visits["medications"], ANABOLIC_DRUGS, "P1NP",
+                                          "促骨形成治疗", ANABOLIC_RESPONSE_PERCENT),
+            ],
+        }
+
+    @staticmethod
+    def _treatment_response(values, medications, drugs, column, therapy, response_percent) -> list:
+        """以开始治疗前最后一次检测为基线（首次检测即已用药时以首次为基线），计算治疗后每次检测的变化率"""
+        on_therapy = _therapy_mask(medications, drugs)
+        if not on_therapy.any():
+            return []
+        first_on_therapy = int(np.argmax(on_therapy))
+        baseline_index = max(first_on_therapy - 1, 0)
+        series = values[:, list(INDICATOR_COLUMNS).index(column)]
+        baseline = series[baseline_index]
+        follow_up = np.arange(baseline_index + 1, len(series))
+        follow_up = follow_up[on_therapy[follow_up] & ~np.isnan(series[follow_up])]
+        if np.isnan(baseline) or baseline == 0 or not len(follow_up):
+            return []
+        percent = (series[follow_up] - baseline) / baseline * 100
+        responded = percent <= response_percent if response_percent < 0 else percent >= response_percent
+        return [{"therapy": therapy, "indicator": column, "visit_index": int(index),
+                 "baseline_visit_index": baseline_index, "percent_change": round(float(change), 1),
+                 "responded": bool(ok)}
+                for index, change, ok in zip(follow_up, percent, responded)]
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    from analysis_module.warmup import SAMPLE_INPUT_DATA
+
+    db_path = os.path.join(tempfile.mkdtemp(), "patient_history.db")
+    store = PatientHistoryStore(db_path)
+    rng = np.random.default_rng(0)
+    patient_count, visits_per_patient = 2000, 50
+    visits = []
+    for patient in range(patient_count):
+        for visit in range(visits_per_patient):
+            input_data = {**SAMPLE_INPUT_DATA,
+                          "biochemical_indicators": {**SAMPLE_INPUT_DATA["biochemical_indicators"],
+                                                     "β-CTX": round(float(rng.uniform(0.2, 1.2)), 3)},
+                          "medical_history": {"history": "", "medications": "阿仑膦酸" if visit >= 10 else "",
+                                              "testing_time": "首次检测" if visit == 0 else "随访复测"}}
+            visits.append((f"P{patient:05d}", input_data, date.fromordinal(date(2020, 1, 1).toordinal() + visit * 30)))
+
+    start = time.perf_counter()
+    store.add_visits(visits)
+    print(f"批量写入 {len(visits)} 条检测记录耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    start = time.perf_counter()
+    rounds = 200
+    for patient in rng.integers(0, patient_count, size=rounds):
+        trend = store.trend(f"P{patient:05d}")
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"单个患者（{visits_per_patient} 次检测）趋势计算平均耗时 {elapsed * 1000:.2f} ms")
+    print(trend["indicators"]["β_CTX"]["percent_from_baseline"][:12])
+    print(trend["treatment_response"][:3])
@@ -0,0 +1,233 @@
+"""
+人群百分位（全国数据对比）
+按 指标 × 性别 × 年龄段 维护可合并的分位数草图：各指标的取值范围有界（ALL_RANGES），草图采用全区间内的定宽直方图，
+合并即计数相加；查询时用缓存的累积分布表按桶号直接取百分位（O(1)），不扫描原始数据
+检测记录保存时增量更新，定期写入磁盘；可从患者随访记录库并行重建
+使用方式: python -m analysis_module.population_sketch --rebuild patient_history.db --workers 4
+"""
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+
+from analysis_module.indicators_anlaysis import ALL_RANGES
+from analysis_module.patient_history import INDICATOR_COLUMNS
+
+SKETCH_PATH = os.getenv("POPULATION_SKETCH_PATH", "population_sketch.npz")
+BINS = 2048
+# 年龄段下限：18-29、30-39、...、80 岁及以上
+AGE_BAND_STARTS = (18, 30, 40, 50, 60, 70, 80)
+SEXES = ("男", "女")
+# 样本数少于该值时不显示百分位
+MIN_SAMPLES = 30
+# 两次写盘的最小间隔（秒）
+SAVE_INTERVAL_SECONDS = 60
+
+# 指标列名到全区间的映射，列顺序同 INDICATOR_COLUMNS
+RANGE_KEYS = {column: "Bone_analysis" if column == "bone_density" else f"{column}_analysis"
+              for column in INDICATOR_COLUMNS}
+RANGE_LOW = np.array([ALL_RANGES[RANGE_KEYS[column]][0] for column in INDICATOR_COLUMNS])
+RANGE_HIGH = np.array([ALL_RANGES[RANGE_KEYS[column]][1] for column in INDICATOR_COLUMNS])
+
+
+def age_band(age) -> int:
+    return int(np.searchsorted(AGE_BAND_STARTS, age, side="right")) - 1 if age >= AGE_BAND_STARTS[0] else 0
+
+
+def bin_index(column_index: int, value: float) -> int:
+    low, high = RANGE_LOW[column_index], RANGE_HIGH[column_index]
+    position = int((value - low) / (high - low) * BINS)
+    return min(max(position, 0), BINS - 1)
+
+
+def empty_counts() -> np.ndarray:
+    return np.zeros((len(INDICATOR_COLUMNS), len(SEXES), len(AGE_BAND_STARTS), BINS), dtype=np.int64)
+
+
+def counts_from_rows(gender, age, values) -> np.ndarray:
+    """
+    按列批量计数
+
+    Args:
+        gender: (n,) 性别；age: (n,) 年龄；values: (n, 指标数) 数值，缺失为 NaN
+    """
+    counts = empty_counts()
+    if not len(age):
+        return counts
+    sex_index = np.where(np.asarray(gender, dtype=object) == SEXES[0], 0, 1)
+    age = np.asarray(age, dtype=np.float64)
+    band_index = np.clip(np.searchsorted(AGE_BAND_STARTS, age, side="right") - 1, 0, len(AGE_BAND_STARTS) - 1)
+    values = np.asarray(values, dtype=np.float64).reshape(len(age), len(INDICATOR_COLUMNS))
+    present = ~np.isnan(values)
+    bins = np.clip(np.nan_to_num((values - RANGE_LOW) / (RANGE_HIGH - RANGE_LOW) * BINS), 0, BINS - 1).astype(np.int64)
+    for column_index in range(len(INDICATOR_COLUMNS)):
+        mask = present[:, column_index]
+        np.add.at(counts[column_index], (sex_index[mask], band_index[mask], bins[mask, column_index]), 1)
+    return counts
+
+
+class PopulationSketch:
+    def __init__(self, path: str = SKETCH_PATH):
+        self.path = path
+        self.counts = empty_counts()
+        if path and os.path.exists(path):
+            with np.load(path) as data:
+                if data["counts"].shape == self.counts.shape:
+                    self.counts = data["counts"]
+        self._lock = threading.Lock()
+        # 累积分布表：(指标, 性别, 年龄段) 的 CDF 在计数变化后按需重建
+        self._cdf = np.zeros(self.counts.shape, dtype=np.float32)
+        self._totals = np.zeros(self.counts.shape[:3], dtype=np.int64)
+        self._stale = np.ones(self.counts.shape[:3], dtype=bool)
+        self._dirty = False
+        self._last_saved = time.monotonic()
+
+    def add_input_data(self, input_data: dict):
+        """加入一次检测（input_data 结构同界面输入），只更新对应的桶"""
+        patient_info = input_data["patient_info"]
+        sex_index = 0 if patient_info["gender"] == SEXES[0] else 1
+        band_index = age_band(patient_info["age"])
+        with self._lock:
+            for column_index, (section, key) in enumerate(INDICATOR_COLUMNS.values()):
+                value = input_data.get(section, {}).get(key)
+                if value in (None, "", "未输入"):
+                    continue
+                self.counts[column_index, sex_index, band_index, bin_index(column_index, float(value))] += 1
+                self._stale[column_index, sex_index, band_index] = True
+            self._dirty = True
+        self.maybe_save()
+
+    def add_batch(self, input_data_list):
+        """批量加入多次检测，按列一次计数后合并"""
+        input_data_list = list(input_data_list)
+        values = [[np.nan if input_data.get(section, {}).get(key) in (None, "", "未输入")
+                   else float(input_data[section][key]) for section, key in INDICATOR_COLUMNS.values()]
+                  for input_data in input_data_list]
+        self.merge(counts_from_rows([input_data["patient_info"]["gender"] for input_data in input_data_list],
+                                    [input_data["patient_info"]["age"] for input_data in input_data_list], values))
+
+    def merge(self, counts: np.ndarray):
+        with self._lock:
+            self.counts += counts
+            self._stale |= counts.any(axis=3)
+            self._dirty = True
+        self.maybe_save()
+
+    def _refresh(self, column_index: int, sex_index: int, band_index: int):
+        counts = self.counts[column_index, sex_index, band_index]
+        total = int(counts.sum())
+        # 桶内取中点：低于该桶的样本数 + 桶内样本数的一半
+        self._cdf[column_index, sex_index, band_index] = (np.cumsum(counts) - counts / 2) / max(total, 1) * 100
+        self._totals[column_index, sex_index, band_index] = total
+        self._stale[column_index, sex_index, band_index] = False
+
+    def percentile(self, column: str, gender: str, age, value) -> Optional[tuple]:
+        """返回 (百分位, 样本数)；样本不足 MIN_SAMPLES 时返回 None"""
+        column_index = list(INDICATOR_COLUMNS).index(column)
+        sex_index = 0 if gender == SEXES[0] else 1
+        band_index = age_band(age)
+        if self._stale[column_index, sex_index, band_index]:
+            with self._lock:
+                self._refresh(column_index, sex_index, band_index)
+        total = int(self._totals[column_index, sex_index, band_index])
+        if total < MIN_SAMPLES:
+            return None
+        return float(self._cdf[column_index, sex_index, band_index, bin_index(column_index, float(value))]), total
+
+    def percentiles(self, input_data: dict) -> Dict[str, tuple]:
+        """input_data 中各指标的人群百分位，键为 to_dict() 的键（如 "β_CTX_analysis"）"""
+        patient_info = input_data["patient_info"]
+        result = {}
+        for column, (section, key) in INDICATOR_COLUMNS.items():
+            value = input_data.get(section, {}).get(key)
+            if value in (None, "", "未输入"):
+                continue
+            percentile = self.percentile(column, patient_info["gender"], patient_info["age"], value)
+            if percentile is not None:
+                result[RANGE_KEYS[column]] = percentile
+        return result
+
+    def maybe_save(self, force: bool = False):
+        if not self.path or not self._dirty:
+            return
+        if not force and time.monotonic() - self._last_saved < SAVE_INTERVAL_SECONDS:
+            return
+        with self._lock:
+            counts = self.counts.copy()
+            self._dirty = False
+            self._last_saved = time.monotonic()
+        # np.savez 会自动补 .npz 后缀，临时文件名同样以 .npz 结尾
+        temp_path = f"{self.path}.tmp.npz"
+        np.savez_compressed(temp_path, counts=counts)
+        os.replace(temp_path, self.path)
+
+
+def _count_rowid_range(args) -> np.ndarray:
+    db_path, first_rowid, last_rowid = args
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    rows = connection.execute(
+        f"SELECT gender, age, {', '.join(INDICATOR_COLUMNS)} FROM visits WHERE rowid BETWEEN ? AND ?",
+        (first_rowid, last_rowid)).fetchall()
+    connection.close()
+    if not rows:
+        return empty_counts()
+    return counts_from_rows([row[0] for row in rows], [row[1] or 0 for row in rows],
+                            np.array([row[2:] for row in rows], dtype=np.float64))
+
+
+def rebuild_from_history(db_path: str, workers: int = 4, chunk_rows: int = 200000) -> np.ndarray:
+    """按 rowid 分段，多进程并行统计患者随访记录库中的全部检测，合并为一份计数"""
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    min_rowid, max_rowid = connection.execute("SELECT MIN(rowid), MAX(rowid) FROM visits").fetchone()
+    connection.close()
+    counts = empty_counts()
+    if min_rowid is None:
+        return counts
+    tasks = [(db_path, start, min(start + chunk_rows - 1, max_rowid))
+             for start in range(min_rowid, max_rowid + 1, chunk_rows)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial in executor.map(_count_rowid_range, tasks):
+            counts += partial
+    return counts
+
+
+population_sketch = PopulationSketch()
+# 进程退出时写入尚未保存的计数
+atexit.register(population_sketch.maybe_save, True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="人群百分位草图")
+    parser.add_argument("--rebuild", default="", help="从患者随访记录库（SQLite）重建")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", default=SKETCH_PATH)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        start = time.perf_counter()
+        sketch = PopulationSketch(path=args.output)
+        sketch.counts = rebuild_from_history(args.rebuild, workers=args.workers)
+        sketch._dirty = True
+        sketch.maybe_save(force=True)
+        print(f"重建完成：{int(sketch.counts[0].sum())} 条检测，耗时 {time.perf_counter() - start:.2f}s，已写入 {args.output}")
+    else:
+        rng = np.random.default_rng(0)
+        sketch = PopulationSketch(path="")
+        row_count = 1000000
+        values = np.column_stack([rng.uniform(low, high, row_count) for low, high in zip(RANGE_LOW, RANGE_HIGH)])
+        start = time.perf_counter()
+        sketch.merge(counts_from_rows(rng.choice(SEXES, row_count), rng.integers(18, 100, row_count), values))
+        print(f"{row_count} 条检测计数耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+        start = time.perf_counter()
+        lookups = 100000
+        for _ in range(lookups):
+            sketch.percentile("β_CTX", "女", 62, 0.8)
+        print(f"单次百分位查询 {(time.perf_counter() - start) / lookups * 1e6:.2f} μs，"
+              f"β-CTX 0.8 位于第 {sketch.percentile('β_CTX', '女', 62, 0.8)[0]:.1f} 百分位（均匀分布理论值 20）")
@@ -0,0 +1,164 @@
+"""
+按实验室/医院区分的参考区间配置
+配置文件位于 config/range_profiles/<名称>.json（带 version 字段），每个配置只编译一次并缓存在进程内；
+文件修改后自动重新编译并整体替换缓存中的引用，正在计算的请求继续使用旧配置，不受影响
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+
+DEFAULT_PROFILE_NAME = "default"
+PROFILE_DIR = os.getenv("RANGE_PROFILE_DIR",
+                        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     "config", "range_profiles"))
+# 两次检查配置文件是否修改的最小间隔（秒），避免每个请求都访问文件系统
+CHECK_INTERVAL_SECONDS = 1.0
+
+
+class RangeProfileError(Exception):
+    """配置不存在或格式错误"""
+
+
+@dataclass(frozen=True)
+class AgeBand:
+    """年龄段：age < age_below，或 age <= age_up_to；两者都为空时匹配其余所有年龄"""
+    age_below: Optional[float]
+    age_up_to: Optional[float]
+    label: str
+    values: Mapping
+
+    def matches(self, age) -> bool:
+        if self.age_below is not None:
+            return age < self.age_below
+        if self.age_up_to is not None:
+            return age <= self.age_up_to
+        return True
+
+
+@dataclass(frozen=True)
+class CompiledRangeProfile:
+    name: str
+    version: int
+    all_ranges: Mapping[str, Tuple[float, float]]
+    β_CTX: Mapping
+    β_CTX_male_age_bands: Tuple[AgeBand, ...]
+    P1NP: Mapping
+    VD: Mapping
+    N_MID_age_bands: Tuple[AgeBand, ...]
+    PTH: Mapping
+    CT: Mapping
+    bone_density: Mapping
+
+    @staticmethod
+    def lookup_band(bands: Tuple[AgeBand, ...], age) -> AgeBand:
+        for band in bands:
+            if band.matches(age):
+                return band
+        return bands[-1]
+
+
+def _freeze(section: dict) -> Mapping:
+    return MappingProxyType({key: tuple(value) if isinstance(value, list) else value
+                             for key, value in section.items()})
+
+
+def _compile_bands(bands: list) -> Tuple[AgeBand, ...]:
+    if not bands:
+        raise RangeProfileError("age bands must not be empty")
+    compiled = []
+    for band in bands:
+        values = {key: value for key, value in band.items() if key not in ("age_below", "age_up_to", "label")}
+        compiled.append(AgeBand(age_below=band.get("age_below"), age_up_to=band.get("age_up_to"),
+                                label=band.get("label", ""), values=_freeze(values)))
+    return tuple(compiled)
+
+
+def compile_profile(config: dict) -> CompiledRangeProfile:
+    """将配置文件内容编译为只读的查找表"""
+    try:
+        return CompiledRangeProfile(
+            name=config["name"],
+            version=config["version"],
+            all_ranges=MappingProxyType({key: tuple(value) for key, value in config["all_ranges"].items()}),
+            β_CTX=_freeze(config["β_CTX"]),
+            β_CTX_male_age_bands=_compile_bands(config["β_CTX"]["male_age_bands"]),
+            P1NP=_freeze(config["P1NP"]),
+            VD=_freeze(config["VD"]),
+            N_MID_age_bands=_compile_bands(config["N_MID"]["age_bands"]),
+            PTH=_freeze(config["PTH"]),
+            CT=_freeze(config["CT"]),
+            bone_density=_freeze(config["bone_density"]),
+        )
+    except (KeyError, TypeError) as e:
+        raise RangeProfileError(f"Invalid range profile {config.get('name', '')}: {str(e)}")
+
+
+def profile_path(name: str) -> str:
+    if not name or os.sep in name or "/" in name or name.startswith("."):
+        raise RangeProfileError(f"Invalid range profile name: {name}")
+    return os.path.join(PROFILE_DIR, f"{name}.json")
+
+
+class RangeProfileCache:
+    """编译后的配置缓存；文件修改时间或大小变化即重新编译并原子替换"""
+
+    def __init__(self):
+        # 名称 -> (编译结果, 文件签名, 上次检查时间)
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str = DEFAULT_PROFILE_NAME) -> CompiledRangeProfile:
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is not None and now - entry[2] < CHECK_INTERVAL_SECONDS:
+            return entry[0]
+
+        path = profile_path(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if entry is not None:
+                # 文件被删除时继续使用已加载的配置
+                return entry[0]
+            raise RangeProfileError(f"Unknown range profile: {name}")
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if entry is not None and entry[1] == signature:
+            self._entries[name] = (entry[0], signature, now)
+            return entry[0]
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] == signature:
+                return entry[0]
+            try:
+                with open(path, encoding="utf-8") as f:
+                    profile = compile_profile(json.load(f))
+            except (ValueError, RangeProfileError) as e:
+                if entry is not None:
+                    # 新文件有误（例如正在写入）时保留旧配置，下次检查再重试
+                    print(f"Failed to reload range profile {name}: {str(e)}")
+                    return entry[0]
+                raise RangeProfileError(f"Failed to load range profile {name}: {str(e)}")
+            # 整体替换字典中的引用，读取方无需加锁
+            self._entries[name] = (profile, signature, now)
+            return profile
+
+    def available_profiles(self):
+        return sorted(file_name[:-5] for file_name in os.listdir(PROFILE_DIR) if file_name.endswith(".json"))
+
+
+profile_cache = RangeProfileCache()
+
+
+def get_profile(name: str = DEFAULT_PROFILE_NAME) -> CompiledRangeProfile:
+    return profile_cache.get(name or DEFAULT_PROFILE_NAME)
+
+
+if __name__ == "__main__":
+    for profile_name in profile_cache.available_profiles():
+        profile = get_profile(profile_name)
+        print(profile.name, profile.version, dict(profile.all_ranges))
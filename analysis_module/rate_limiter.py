@@ -0,0 +1,233 @@
+"""
+大模型调用的进程级限流与准入控制
+所有会话共用 ai_agent.client，高峰时并发的全面分析会触发服务商的 429 限流。调用前先在本进程的令牌桶中申请
+请求数与 token 数（按 get_prompt 生成的提示词长度估算），额度不足时按到达顺序排队（先到先得，各会话公平）；
+调用完成后按实际用量修正 token 桶
+
+等待中的调用方可通过 listen() 注册回调，获得排队位置与预计等待时间（界面据此显示“排队第 N 位，预计等待 M 秒”）
+LLM_RPM / LLM_TPM 为 0 时不限流
+使用方式: python -m analysis_module.rate_limiter   （用限流的模拟大模型对比有无准入控制时的 429 次数）
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+# token 估算：每个字符按该数量计（中文约 1 token/字，偏保守），另加预计的输出 token
+TOKENS_PER_CHAR = float(os.getenv("LLM_TOKENS_PER_CHAR", "1.0"))
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "800"))
+# 排队超过该秒数仍未获得额度时放弃
+ADMISSION_TIMEOUT_SECONDS = float(os.getenv("LLM_ADMISSION_TIMEOUT", "120"))
+# 排队期间回调的最短间隔（秒）
+LISTENER_INTERVAL_SECONDS = 1.0
+
+
+class AdmissionTimeoutError(Exception):
+    """排队超时，未获得调用额度"""
+
+
+def estimate_tokens(prompt_chars: int, completion_tokens: int = EXPECTED_COMPLETION_TOKENS) -> int:
+    return math.ceil(prompt_chars * TOKENS_PER_CHAR) + completion_tokens
+
+
+class _Ticket:
+    """一次排队中的申请；按对象身份比较，数值相同的申请互不混淆"""
+    __slots__ = ("requests", "tokens")
+
+    def __init__(self, requests: float, tokens: float):
+        self.requests = requests
+        self.tokens = tokens
+
+
+class _Bucket:
+    """容量为每分钟额度、匀速补充的令牌桶"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """攒够 amount 还需的秒数（amount 可超过容量，用于估算排在后面的调用的等待时间）"""
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class TokenBucketLimiter:
+    """
+    Args:
+        requests_per_minute: 每分钟请求数上限，0 为不限
+        tokens_per_minute: 每分钟 token 数上限，0 为不限
+    """
+
+    def __init__(self, requests_per_minute: int = LLM_RPM, tokens_per_minute: int = LLM_TPM):
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._cond = threading.Condition()
+        # 排队中的 _Ticket，按到达顺序
+        self._queue = deque()
+        self._local = threading.local()
+        self.admitted = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._requests is not None or self._tokens is not None
+
+    @contextmanager
+    def listen(self, callback: Callable[[int, float], None]):
+        """在当前线程内注册排队回调 callback(排队位置, 预计等待秒数)"""
+        previous = getattr(self._local, "listener", None)
+        self._local.listener = callback
+        try:
+            yield
+        finally:
+            self._local.listener = previous
+
+    def current_listener(self) -> Optional[Callable[[int, float], None]]:
+        """当前线程注册的排队回调，用于转交给代为调用大模型的后台线程"""
+        return getattr(self._local, "listener", None)
+
+    def _needs(self, requests: float, tokens: float) -> tuple:
+        # 单次申请超过桶容量时按容量计，否则永远无法获得额度
+        return (min(requests, self._requests.capacity) if self._requests else 0,
+                min(tokens, self._tokens.capacity) if self._tokens else 0)
+
+    def _seconds_until(self, requests: float, tokens: float) -> float:
+        return max(self._requests.seconds_until(requests) if self._requests else 0.0,
+                   self._tokens.seconds_until(tokens) if self._tokens else 0.0)
+
+    def acquire(self, requests: int = 1, tokens: int = 0, timeout: Optional[float] = None) -> float:
+        """
+        申请额度，必要时排队等待
+
+        Returns:
+            float: 排队等待的秒数
+        Raises:
+            AdmissionTimeoutError: 超过 timeout（默认 ADMISSION_TIMEOUT_SECONDS）仍未获得额度
+        """
+        if not self.enabled:
+            return 0.0
+        timeout = ADMISSION_TIMEOUT_SECONDS if timeout is None else timeout
+        listener = getattr(self._local, "listener", None)
+        ticket = _Ticket(*self._needs(requests, tokens))
+        start = time.monotonic()
+        last_notified = None
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    for bucket in (self._requests, self._tokens):
+                        if bucket:
+                            bucket.refill(now)
+                    # 排在前面的申请（含自己）全部满足所需的等待时间
+                    position, ahead_requests, ahead_tokens = 0, 0.0, 0.0
+                    for queued in self._queue:
+                        position += 1
+                        ahead_requests += queued.requests
+                        ahead_tokens += queued.tokens
+                        if queued is ticket:
+                            break
+                    wait = self._seconds_until(ahead_requests, ahead_tokens)
+                    if position == 1 and wait == 0:
+                        if self._requests:
+                            self._requests.level -= ticket.requests
+                        if self._tokens:
+                            self._tokens.level -= ticket.tokens
+                        self._queue.popleft()
+                        waited = now - start
+                        self.admitted += 1
+                        self.wait_seconds += waited
+                        self._cond.notify_all()
+                        return waited
+                    remaining = start + timeout - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise AdmissionTimeoutError(f"大模型调用排队超过 {timeout:.0f} 秒，请稍后重试")
+                    if listener and (last_notified is None or now - last_notified >= LISTENER_INTERVAL_SECONDS):
+                        last_notified = now
+                        try:
+                            listener(position, wait)
+                        except Exception as e:
+                            print(f"Rate limiter listener failed: {str(e)}")
+                    # 队首等待额度补充；其余等待前面的申请通过时被唤醒，定时醒来刷新预计等待时间
+                    self._cond.wait(min(max(wait, 0.01) if position == 1 else LISTENER_INTERVAL_SECONDS,
+                                        LISTENER_INTERVAL_SECONDS, remaining))
+            finally:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """按实际用量修正 token 桶：估多了退回，估少了补扣"""
+        if not self._tokens or not actual_tokens:
+            return
+        with self._cond:
+            self._tokens.refill(time.monotonic())
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level + estimated_tokens - actual_tokens)
+            self._cond.notify_all()
+
+    def queue_length(self) -> int:
+        return len(self._queue)
+
+    def prometheus_text(self) -> str:
+        lines = []
+        for name, metric_type, help_text, value in [
+            ("llm_admission_queue_length", "gauge", "LLM calls waiting for rate limit capacity.", self.queue_length()),
+            ("llm_admission_admitted_total", "counter", "LLM calls admitted by the rate limiter.", self.admitted),
+            ("llm_admission_timeouts_total", "counter", "LLM calls rejected after waiting too long.", self.timeouts),
+            ("llm_admission_wait_seconds_total", "counter", "Total time LLM calls spent queued.",
+             f"{self.wait_seconds:.3f}"),
+        ]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+llm_rate_limiter = TokenBucketLimiter()
+
+
+if __name__ == "__main__":
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    from analysis_module import ai_agent
+    from analysis_module.stub_llm import install_stub_llm, StubRateLimitError
+    from bench_section_generation import build_input_message
+
+    parser = argparse.ArgumentParser(description="大模型限流与准入控制测试")
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--tpm", type=int, default=60000)
+    parser.add_argument("--requests", type=int, default=40, help="同时发起的全面分析数")
+    args = parser.parse_args()
+
+    input_message, _ = build_input_message()
+    for limited in (False, True):
+        install_stub_llm(latency="fixed:0.5", rpm_limit=args.rpm, tpm_limit=args.tpm)
+        # 模拟大模型按 2 字符/token 计费，与本地的保守估算不同，由 settle() 修正
+        ai_agent.rate_limiter = TokenBucketLimiter(args.rpm, args.tpm) if limited else TokenBucketLimiter(0, 0)
+
+        def one(_):
+            try:
+                ai_agent.get_completion(input_message, model="stub")
+                return "ok"
+            except StubRateLimitError:
+                return "429"
+            except AdmissionTimeoutError:
+                return "timeout"
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.requests) as executor:
+            outcomes = list(executor.map(one, range(args.requests)))
+        print(f"{'有' if limited else '无'}准入控制: 成功 {outcomes.count('ok')}  429 {outcomes.count('429')}  "
+              f"排队超时 {outcomes.count('timeout')}  总耗时 {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,70 @@
+"""
+记录 ai_analysis 的调用，用于回放压测（replay_load.py）
+设置 ANALYSIS_RECORD_FILE 后，每次调用追加一行 JSONL：{"ts": 时间戳, "mode": "fast" | "slow", "input_data": 脱敏后的输入}
+脱敏：去掉病史、用药等自由文本，年龄取整到 5 岁，身高体重取整到 5cm / 5kg；检验值原样保留以便复现规则与模型负载
+"""
+import json
+import os
+import threading
+import time
+from typing import Iterator
+
+RECORD_FILE = os.getenv("ANALYSIS_RECORD_FILE", "")
+
+
+def _round_to(value, step):
+    try:
+        return float(round(float(value) / step) * step)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def anonymize(input_data: dict) -> dict:
+    patient_info = input_data.get("patient_info", {})
+    age = int(_round_to(patient_info.get("age", 0), 5))
+    return {
+        "patient_info": {
+            "gender": patient_info.get("gender"),
+            # 取整后仍需满足界面与校验的年龄下限
+            "age": max(age, 18),
+            "height": _round_to(patient_info.get("height", 0.0), 5),
+            "weight": _round_to(patient_info.get("weight", 0.0), 5),
+        },
+        "biochemical_indicators": dict(input_data.get("biochemical_indicators", {})),
+        "imaging_data": {"Bone Density": input_data.get("imaging_data", {}).get("Bone Density", "未输入")},
+        "medical_history": {"history": "", "medications": "", "testing_time": ""},
+        **({"range_profile": input_data["range_profile"]} if "range_profile" in input_data else {}),
+    }
+
+
+class RequestRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, input_data: dict, mode: str):
+        line = json.dumps({"ts": time.time(), "mode": mode, "input_data": anonymize(input_data)},
+                          ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+recorder = RequestRecorder(RECORD_FILE) if RECORD_FILE else None
+
+
+def record_call(input_data: dict, mode: str):
+    """未配置 ANALYSIS_RECORD_FILE 时不记录；记录失败不影响分析"""
+    if recorder is None:
+        return
+    try:
+        recorder.record(input_data, mode)
+    except (OSError, TypeError, ValueError, AttributeError) as e:
+        print(f"Failed to record analysis request: {str(e)}")
+
+
+def load_recording(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
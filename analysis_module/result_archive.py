@@ -0,0 +1,309 @@
+"""
+规则计算结果的列式归档，供质控看板查询（如“上季度各年龄段 PTH 异常率”）
+每个字段一个只追加的二进制列文件，读取时按内存映射（np.memmap）分块扫描，不把整个归档读入内存；
+meta.json 记录已提交的行数，追加时先写列文件、最后更新行数，中途中断不会读到半行
+区间与结果存为 compact_result 码表中的编码；可零拷贝导出为 Arrow 表，再写 Parquet
+使用方式: python -m analysis_module.result_archive --rows 5000000   （生成示例归档并测试查询耗时）
+"""
+import atexit
+import json
+import os
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from analysis_module.compact_result import INDICATOR_KEYS, FLAG_ABNORMAL, FLAG_MALE, \
+    FLAG_HAS_BONE_DENSITY, codebook, encode_batch
+from analysis_module.population_sketch import AGE_BAND_STARTS
+
+ARCHIVE_DIR = os.getenv("RESULT_ARCHIVE_DIR", "")
+# 分块扫描的行数
+CHUNK_ROWS = 1 << 20
+# 缓冲的行数达到该值时写入磁盘
+FLUSH_ROWS = 1000
+
+SEX_MALE, SEX_FEMALE = 0, 1
+SEX_LABELS = ("男", "女")
+AGE_BAND_LABELS = tuple(f"{start}-{end - 1}" for start, end in zip(AGE_BAND_STARTS, AGE_BAND_STARTS[1:])) + \
+                  (f"{AGE_BAND_STARTS[-1]}+",)
+
+# 字段名 -> dtype；test_date 为 1970-01-01 起的天数（与 Arrow date32 相同）
+COLUMNS = {
+    "test_date": np.dtype("<i4"),
+    "sex": np.dtype("u1"),
+    "age": np.dtype("u1"),
+    "profile": np.dtype("<u2"),
+}
+for _attribute in INDICATOR_KEYS.values():
+    COLUMNS[f"{_attribute}_value"] = np.dtype("<f8")  # 未检测为 NaN
+    COLUMNS[f"{_attribute}_range"] = np.dtype("<u2")
+    COLUMNS[f"{_attribute}_result"] = np.dtype("<u2")
+    COLUMNS[f"{_attribute}_abnormal"] = np.dtype("u1")
+
+
+def _days(test_date) -> int:
+    if isinstance(test_date, str):
+        test_date = date.fromisoformat(test_date)
+    return (test_date - date(1970, 1, 1)).days
+
+
+def columns_from_records(records: np.ndarray, test_dates) -> Dict[str, np.ndarray]:
+    """将 compact_result 的定长记录批量转为归档的各列"""
+    test_dates = np.asarray([_days(test_date) for test_date in test_dates], dtype=np.int32) \
+        if not isinstance(test_dates, np.ndarray) else test_dates.astype(np.int32)
+    columns = {
+        "test_date": test_dates,
+        "sex": np.where(records["flags"] & FLAG_MALE, SEX_MALE, SEX_FEMALE).astype(np.uint8),
+        "age": np.clip(records["age"], 0, 255).astype(np.uint8),
+        "profile": records["profile"],
+    }
+    has_bone_density = (records["flags"] & FLAG_HAS_BONE_DENSITY).astype(bool)
+    for attribute in INDICATOR_KEYS.values():
+        slot = records[attribute]
+        value = slot["value"].astype(np.float64)
+        if attribute == "bone_density":
+            value = np.where(has_bone_density, value, np.nan)
+        columns[f"{attribute}_value"] = value
+        columns[f"{attribute}_range"] = slot["range"]
+        columns[f"{attribute}_result"] = slot["result"]
+        columns[f"{attribute}_abnormal"] = (slot["flags"] & FLAG_ABNORMAL).astype(np.uint8)
+    return columns
+
+
+class ResultArchive:
+    """
+    Args:
+        directory: 归档目录，每个字段一个 <字段名>.col 文件
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.Lock()
+        self._buffer: List[Dict[str, np.ndarray]] = []
+        self._buffered_rows = 0
+        self._maps: Dict[str, np.memmap] = {}
+        self._mapped_rows = 0
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["columns"] != {name: dtype.str for name, dtype in COLUMNS.items()}:
+                raise ValueError(f"Archive {directory} has a different column layout")
+            self.rows = meta["rows"]
+        else:
+            self.rows = 0
+            self._write_meta()
+        # 丢弃上次中断时写了一半的数据
+        for name, dtype in COLUMNS.items():
+            path = self._column_path(name)
+            with open(path, "ab") as f:
+                f.truncate(self.rows * dtype.itemsize)
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.col")
+
+    def _write_meta(self):
+        temp_path = f"{self._meta_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "columns": {name: dtype.str for name, dtype in COLUMNS.items()}}, f)
+        os.replace(temp_path, self._meta_path)
+
+    # ---------- 写入 ----------
+
+    def append_columns(self, columns: Dict[str, np.ndarray]):
+        """按列追加一批数据（先缓冲，达到 FLUSH_ROWS 后写盘）"""
+        row_count = len(columns["test_date"])
+        with self._lock:
+            self._buffer.append({name: np.asarray(columns[name], dtype=dtype) for name, dtype in COLUMNS.items()})
+            self._buffered_rows += row_count
+            if self._buffered_rows >= FLUSH_ROWS:
+                self._flush_locked()
+
+    def append_analyses(self, indicators_analyses: Iterable, test_dates):
+        """追加已完成 analysis() 的 IndicatorsAnalysis"""
+        self.append_columns(columns_from_records(encode_batch(indicators_analyses), test_dates))
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        for name in COLUMNS:
+            with open(self._column_path(name), "ab") as f:
+                for part in self._buffer:
+                    f.write(part[name].tobytes())
+        self.rows += self._buffered_rows
+        self._write_meta()
+        self._buffer, self._buffered_rows = [], 0
+
+    # ---------- 读取 ----------
+
+    def column(self, name: str) -> np.ndarray:
+        """字段的只读内存映射（不含尚未写盘的缓冲）"""
+        if self._mapped_rows != self.rows:
+            self._maps, self._mapped_rows = {}, self.rows
+        if name not in self._maps:
+            self._maps[name] = np.memmap(self._column_path(name), dtype=COLUMNS[name], mode="r", shape=(self.rows,)) \
+                if self.rows else np.empty(0, dtype=COLUMNS[name])
+        return self._maps[name]
+
+    def _group_keys(self, by: str, start: int, stop: int):
+        """返回 (分组编号, 编号 -> 名称)"""
+        if by == "sex":
+            return self.column("sex")[start:stop], lambda key: SEX_LABELS[key]
+        if by == "age_band":
+            keys = np.searchsorted(AGE_BAND_STARTS, self.column("age")[start:stop], side="right") - 1
+            return np.clip(keys, 0, len(AGE_BAND_STARTS) - 1), lambda key: AGE_BAND_LABELS[key]
+        if by in ("month", "quarter"):
+            months = self.column("test_date")[start:stop].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            if by == "quarter":
+                return months // 3, lambda key: f"{1970 + key // 4}Q{key % 4 + 1}"
+            return months, lambda key: f"{1970 + key // 12}-{key % 12 + 1:02d}"
+        if by.endswith("_range") or by.endswith("_result"):
+            return self.column(by)[start:stop], codebook.decode
+        raise ValueError(f"Unknown group by: {by}")
+
+    def group_by(self, indicator: str, by: str, metric: str = "abnormal_rate", start_date=None, end_date=None,
+                 sex: Optional[str] = None, age_range=None, chunk_rows: int = CHUNK_ROWS) -> Dict[str, dict]:
+        """
+        分块扫描，按条件筛选后分组统计一个指标
+
+        Args:
+            indicator: 指标属性名，如 "PTH"、"β_CTX"、"bone_density"
+            by: 分组字段："sex"、"age_band"、"month"、"quarter" 或 "<指标>_range" / "<指标>_result"
+            metric: "abnormal_rate" 异常率，"mean" 平均值
+            start_date / end_date: 检测日期范围（含两端），date 或 "YYYY-MM-DD"
+            age_range: (最小年龄, 最大年龄)，含两端
+
+        Returns:
+            dict: 分组名称 -> {"count": 检测数, metric: 统计值}
+        """
+        if metric not in ("abnormal_rate", "mean"):
+            raise ValueError(f"Unknown metric: {metric}")
+        counts: Dict[int, float] = {}
+        sums: Dict[int, float] = {}
+        label = None
+        for start in range(0, self.rows, chunk_rows):
+            stop = min(start + chunk_rows, self.rows)
+            values = self.column(f"{indicator}_value")[start:stop]
+            mask = ~np.isnan(values)
+            if start_date is not None:
+                mask &= self.column("test_date")[start:stop] >= _days(start_date)
+            if end_date is not None:
+                mask &= self.column("test_date")[start:stop] <= _days(end_date)
+            if sex is not None:
+                mask &= self.column("sex")[start:stop] == SEX_LABELS.index(sex)
+            if age_range is not None:
+                ages = self.column("age")[start:stop]
+                mask &= (ages >= age_range[0]) & (ages <= age_range[1])
+            keys, label = self._group_keys(by, start, stop)
+            keys = np.asarray(keys)[mask]
+            if not len(keys):
+                continue
+            weights = self.column(f"{indicator}_abnormal")[start:stop][mask] if metric == "abnormal_rate" \
+                else values[mask]
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            chunk_counts = np.bincount(inverse, minlength=len(unique_keys))
+            chunk_sums = np.bincount(inverse, weights=weights.astype(np.float64), minlength=len(unique_keys))
+            for key, count, total in zip(unique_keys.tolist(), chunk_counts.tolist(), chunk_sums.tolist()):
+                counts[key] = counts.get(key, 0) + count
+                sums[key] = sums.get(key, 0.0) + total
+        return {label(key): {"count": int(counts[key]), metric: sums[key] / counts[key]} for key in sorted(counts)}
+
+    # ---------- 导出 ----------
+
+    def to_arrow(self):
+        """
+        零拷贝导出为 pyarrow.Table：各列直接引用内存映射的缓冲区
+        （编码列保持整数，可用 codebook.decode 还原为文本）
+        """
+        import pyarrow as pa
+
+        arrays, names = [], []
+        for name, dtype in COLUMNS.items():
+            buffer = pa.py_buffer(self.column(name))
+            arrow_type = pa.date32() if name == "test_date" else pa.from_numpy_dtype(dtype)
+            arrays.append(pa.Array.from_buffers(arrow_type, self.rows, [None, buffer]))
+            names.append(name)
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def to_parquet(self, path: str):
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), path)
+
+
+result_archive = ResultArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+if result_archive is not None:
+    atexit.register(result_archive.flush)
+
+
+def archive_analyses(indicators_analyses: List, test_dates):
+    """
+    归档一次请求中新保存的检测，并在请求结束时写盘，不等缓冲攒满 FLUSH_ROWS
+    未配置 RESULT_ARCHIVE_DIR 时不归档；结果含码表中没有的文本时跳过，不影响分析本身
+    """
+    if result_archive is None or not indicators_analyses:
+        return
+    try:
+        result_archive.append_analyses(indicators_analyses, [test_date or date.today() for test_date in test_dates])
+    except KeyError as e:
+        print(f"Failed to archive analysis: {str(e)}")
+    result_archive.flush()
+
+
+def archive_analysis(indicators_analysis, test_date=None):
+    archive_analyses([indicators_analysis], [test_date])
+
+
+if __name__ == "__main__":
+    import argparse
+    import shutil
+    import tempfile
+    import time
+
+    from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+    from analysis_module.rule_harness import random_points
+
+    parser = argparse.ArgumentParser(description="结果列式归档示例与查询耗时")
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--directory", default="")
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp()
+    archive = ResultArchive(directory)
+    # 先真实计算一批结果，再按随机日期重复追加到目标行数
+    analyses = []
+    for input_data in random_points(20000):
+        indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+        indicators_analysis.analysis()
+        analyses.append(indicators_analysis)
+    base_columns = columns_from_records(encode_batch(analyses), np.zeros(len(analyses), dtype=np.int32))
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    while archive.rows < args.rows:
+        columns = dict(base_columns)
+        columns["test_date"] = rng.integers(_days("2024-01-01"), _days("2025-12-31"), len(analyses)).astype(np.int32)
+        archive.append_columns(columns)
+    archive.flush()
+    print(f"写入 {archive.rows} 行耗时 {time.perf_counter() - start:.2f}s，目录 {directory}")
+
+    start = time.perf_counter()
+    report = archive.group_by("PTH", "age_band", start_date="2025-07-01", end_date="2025-09-30")
+    print(f"2025Q3 各年龄段 PTH 异常率（{time.perf_counter() - start:.2f}s）:")
+    for group, stats in report.items():
+        print(f"  {group}: {stats['abnormal_rate']:.2%}（{stats['count']} 次检测）")
+
+    try:
+        start = time.perf_counter()
+        table = archive.to_arrow()
+        print(f"零拷贝导出 Arrow 表 {table.num_rows} 行耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    except ImportError:
+        print("未安装 pyarrow，跳过 Arrow 导出")
+    if not args.directory:
+        shutil.rmtree(directory)
@@ -0,0 +1,175 @@
+"""
+分析结果的二进制序列化（任务队列存储、HTTP 传输等跨进程边界）
+ai_analysis 的返回值是键名固定的中文嵌套字典，区间数值为元组；以 JSON 传输时每条结果重复数百字节的键名，元组变成列表。
+本模块按版本化的结构编码：
+- 各指标的结果（占键名的绝大部分）按 INDICATOR_LAYOUTS 中预先确定的字段顺序编为列表，不再逐条写出键名；
+  布局随 SCHEMA_VERSION 固定，其余结构（接口外层、综合分析等）原样保留
+- TUPLE_KEYS 中的字段解码时还原为元组，编解码前后的结果完全相同
+- 已安装 msgpack 时用 msgpack，否则用 C 实现的紧凑 JSON；可用 RESULT_CODEC=msgpack / json 指定，同一部署的各进程应使用相同的设置
+
+编码结果以 4 字节头开始：b"BR"、结构版本、编码方式（b"m" / b"j"），解码时按头选择字段布局与编码方式；
+不以该头开始的数据按旧的 JSON 文本解码，升级前写入的任务结果仍可读取
+使用方式: python -m analysis_module.result_codec   （与 json.dumps(ensure_ascii=False, indent=2) 对比编解码耗时与体积）
+"""
+import json
+import os
+
+SCHEMA_VERSION = 1
+MAGIC = b"BR"
+# 头的长度：MAGIC、结构版本、编码方式
+HEADER_SIZE = 4
+BACKEND_MSGPACK = b"m"
+BACKEND_JSON = b"j"
+# HTTP 中使用的媒体类型
+CONTENT_TYPE = "application/vnd.bone-result"
+# 该键下为各指标的 to_dict() 结果，按布局编码
+ANALYSIS_KEY = "指标逐一分析"
+
+# 各版本中单个指标的字段布局（to_dict() 的键顺序），编码为 [布局序号, 各字段取值...]；新布局只能在新版本中追加
+INDICATOR_LAYOUTS = {
+    1: (
+        # to_dict(containing_is_abnormal=True)
+        ("标题", "当前值", "参考区间", "指标结果", "指标解读", "用药建议", "参考文件", "是否异常", "单位", "当前数值",
+         "当前区间范围数值", "正常区间范围数值", "当前区间名称"),
+        # to_dict(containing_is_abnormal=False)
+        ("标题", "当前值", "参考区间", "指标结果", "指标解读", "用药建议", "参考文件"),
+    ),
+}
+# 解码时还原为元组的字段
+TUPLE_KEYS = frozenset({"当前区间范围数值", "正常区间范围数值"})
+
+_LAYOUT_CODES = {layout: code for code, layout in enumerate(INDICATOR_LAYOUTS[SCHEMA_VERSION])}
+# (布局, 需还原为元组的位置)
+_DECODE_LAYOUTS = {version: [(layout, [index for index, key in enumerate(layout) if key in TUPLE_KEYS])
+                             for layout in layouts]
+                   for version, layouts in INDICATOR_LAYOUTS.items()}
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_backend_setting = os.getenv("RESULT_CODEC", "auto")
+if _backend_setting == "msgpack" and msgpack is None:
+    raise ImportError("RESULT_CODEC=msgpack requires the msgpack package")
+BACKEND = BACKEND_MSGPACK if msgpack is not None and _backend_setting != "json" else BACKEND_JSON
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), check_circular=False)
+
+
+def _pack_indicators(analyses: dict) -> dict:
+    packed = {}
+    for name, analysis in analyses.items():
+        code = _LAYOUT_CODES.get(tuple(analysis)) if isinstance(analysis, dict) else None
+        # 布局之外的结构原样保留（以字典形式，解码时可区分）
+        packed[name] = [code, *analysis.values()] if code is not None else _pack(analysis)
+    return packed
+
+
+def _pack(value):
+    """各指标结果按布局转为列表，其余结构原样保留"""
+    if isinstance(value, dict):
+        return {key: _pack_indicators(item) if key == ANALYSIS_KEY and isinstance(item, dict) else _pack(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [_pack(item) for item in value]
+    return value
+
+
+def _unpack_indicators(packed: dict, layouts: list) -> dict:
+    analyses = {}
+    for name, item in packed.items():
+        if isinstance(item, list):
+            layout, tuple_positions = layouts[item[0]]
+            values = item[1:]
+            for index in tuple_positions:
+                values[index] = tuple(values[index])
+            analyses[name] = dict(zip(layout, values))
+        else:
+            analyses[name] = _unpack(item, layouts)
+    return analyses
+
+
+def _unpack(value, layouts: list, key=None):
+    if isinstance(value, dict):
+        return {item_key: _unpack_indicators(item, layouts) if item_key == ANALYSIS_KEY and isinstance(item, dict)
+                else _unpack(item, layouts, item_key) for item_key, item in value.items()}
+    if isinstance(value, list):
+        items = [_unpack(item, layouts) for item in value]
+        return tuple(items) if key in TUPLE_KEYS else items
+    return value
+
+
+def encode(payload, backend: bytes = None) -> bytes:
+    """编码 ai_analysis 的结果或任意由字典、列表、元组及 JSON 基本类型组成的接口返回值"""
+    backend = backend or BACKEND
+    header = MAGIC + bytes([SCHEMA_VERSION]) + backend
+    if backend == BACKEND_MSGPACK:
+        if msgpack is None:
+            raise ImportError("msgpack is not installed")
+        return header + msgpack.packb(_pack(payload), use_bin_type=True)
+    return header + _json_encoder.encode(_pack(payload)).encode("utf-8")
+
+
+def decode(data):
+    """
+    解码 encode() 的结果；不带头的 bytes / str 按 JSON 文本解码（旧数据）
+
+    Raises:
+        ValueError: 头不完整，或结构版本、编码方式未知
+    """
+    if isinstance(data, str) or not data.startswith(MAGIC):
+        return json.loads(data)
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"Truncated result header: {len(data)} bytes")
+    version, backend = data[2], data[3:4]
+    if version not in INDICATOR_LAYOUTS:
+        raise ValueError(f"Unsupported result schema version: {version}")
+    if backend == BACKEND_MSGPACK:
+        if msgpack is None:
+            raise ImportError("msgpack is not installed")
+        packed = msgpack.unpackb(memoryview(data)[HEADER_SIZE:], raw=False)
+    elif backend == BACKEND_JSON:
+        packed = json.loads(data[HEADER_SIZE:])
+    else:
+        raise ValueError(f"Unsupported result encoding: {backend!r}")
+    return _unpack(packed, _DECODE_LAYOUTS[version])
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import pickle
+    import time
+
+    from ai_analysis import ai_analysis
+    from analysis_module.stub_llm import install_stub_llm
+    from analysis_module.warmup import SAMPLE_INPUT_DATA
+
+    install_stub_llm()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = ai_analysis(SAMPLE_INPUT_DATA, mode="slow")
+    assert decode(encode(result)) == result
+    rounds = 2000
+
+    def measure(name, dumps, loads):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            data = dumps(result)
+        encode_seconds = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            loads(data)
+        decode_seconds = (time.perf_counter() - start) / rounds
+        print(f"{name:<40} 编码 {encode_seconds * 1e6:7.1f} μs  解码 {decode_seconds * 1e6:7.1f} μs  {len(data):6d} 字节")
+
+    measure("json.dumps(ensure_ascii=False, indent=2)",
+            lambda value: json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8"), json.loads)
+    measure("json.dumps(ensure_ascii=False)",
+            lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"), json.loads)
+    measure("pickle", pickle.dumps, pickle.loads)
+    measure("result_codec (json)", lambda value: encode(value, BACKEND_JSON), decode)
+    if msgpack is not None:
+        measure("result_codec (msgpack)", lambda value: encode(value, BACKEND_MSGPACK), decode)
+    else:
+        print("未安装 msgpack，跳过 msgpack 编码")
@@ -0,0 +1,264 @@
+"""
+规则引擎等价性与吞吐量测试工具
+从参考区间配置中取出 compute_* 用到的全部阈值，在每个边界及其 ±ε、每个性别、每个年龄段、有/无骨密度T值的组合上
+生成最小测试点集，分别用参考实现（IndicatorsAnalysis）和候选实现计算，逐字段比较 to_dict() 结果并统计吞吐量
+另按 β-CTX、P1NP 的区间边界列出总体骨转换分型的预期表（turnover_table），检查 classify_overall 的分型
+使用方式: python -m analysis_module.rule_harness --candidate 模块名:函数名 --random 100000
+"""
+import importlib
+import itertools
+import random
+import time
+from typing import Callable, Dict, Iterator, List
+
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+from analysis_module.range_profiles import CompiledRangeProfile, get_profile, DEFAULT_PROFILE_NAME
+from analysis_module.summary_classifier import TURNOVER_HIGH, TURNOVER_LOW, TURNOVER_NORMAL, TURNOVER_MIXED
+
+EPSILON = 1e-6
+
+# input_data 字段到配置中全区间名称的映射
+FIELD_RANGE_KEYS = {
+    "β-CTX": "β_CTX_analysis",
+    "P1NP": "P1NP_analysis",
+    "25-Hydroxy Vitamin D": "VD_analysis",
+    "N-MID Osteocalcin": "N_MID_analysis",
+    "Parathyroid Hormone": "PTH_analysis",
+    "Calcitonin": "CT_analysis",
+}
+
+# 各指标的基准值（取正常区间内的值），扫描某一指标时其余指标保持基准值
+BASELINE_VALUES = {
+    "β-CTX": 0.4,
+    "P1NP": 40.0,
+    "25-Hydroxy Vitamin D": 35.0,
+    "N-MID Osteocalcin": 30.0,
+    "Parathyroid Hormone": 30.0,
+    "Calcitonin": 3.0,
+}
+
+Engine = Callable[[dict], dict]
+
+
+def reference_engine(input_data: dict) -> dict:
+    """参考实现：逐条执行 IndicatorsAnalysis"""
+    indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+    indicators_analysis.analysis()
+    return indicators_analysis.to_dict(containing_is_abnormal=True)
+
+
+def _around(values) -> List[float]:
+    points = set()
+    for value in values:
+        points.update((value - EPSILON, value, value + EPSILON))
+    return sorted(points)
+
+
+def _band_ages(bands) -> List[int]:
+    ages = set()
+    for band in bands:
+        if band.age_below is not None:
+            ages.update((band.age_below - 1, band.age_below))
+        if band.age_up_to is not None:
+            ages.update((band.age_up_to, band.age_up_to + 1))
+    return sorted(int(age) for age in ages)
+
+
+def extract_thresholds(profile: CompiledRangeProfile) -> Dict[str, List[float]]:
+    """取出每个指标的全部阈值"""
+    β_CTX = profile.β_CTX
+    return {
+        "β-CTX": [β_CTX["low"], β_CTX["mid_low"], β_CTX["high"], β_CTX["female_threshold"],
+                  *(band.values["threshold"] for band in profile.β_CTX_male_age_bands)],
+        "P1NP": [*profile.P1NP["male"], *profile.P1NP["female"]],
+        "25-Hydroxy Vitamin D": [profile.VD["deficient_below"], profile.VD["sufficient_from"]],
+        "N-MID Osteocalcin": [threshold for band in profile.N_MID_age_bands
+                              for threshold in (band.values["threshold_low"], band.values["threshold_high"],
+                                                band.values["threshold_high"] * 2)],
+        "Parathyroid Hormone": [profile.PTH["low"], profile.PTH["high"]],
+        "Calcitonin": [profile.CT["male_threshold"], profile.CT["female_threshold"]],
+        "Bone Density": [profile.bone_density["normal_from"], profile.bone_density["osteoporosis"]],
+    }
+
+
+def extract_ages(profile: CompiledRangeProfile) -> List[int]:
+    """每个年龄段边界两侧的年龄"""
+    return sorted(set(_band_ages(profile.β_CTX_male_age_bands)) | set(_band_ages(profile.N_MID_age_bands)))
+
+
+def make_input_data(gender, age, values, bone_density, profile_name) -> dict:
+    return {
+        "patient_info": {"gender": gender, "age": age, "height": 0.0, "weight": 0.0},
+        "biochemical_indicators": dict(values),
+        "imaging_data": {"Bone Density": "未输入" if bone_density is None else bone_density},
+        "medical_history": {"history": "", "medications": "", "testing_time": ""},
+        "range_profile": profile_name,
+    }
+
+
+def boundary_points(profile_name: str = DEFAULT_PROFILE_NAME) -> Iterator[dict]:
+    """
+    生成边界测试点：每个 (性别, 年龄, T值) 组合下，逐个指标取其每个阈值及 ±ε，其余指标取基准值
+    """
+    profile = get_profile(profile_name)
+    thresholds = extract_thresholds(profile)
+    ages = extract_ages(profile)
+    bone_densities = [None, *_around(thresholds["Bone Density"])]
+    for gender, age, bone_density in itertools.product(["男", "女"], ages, bone_densities):
+        yield make_input_data(gender, age, BASELINE_VALUES, bone_density, profile_name)
+        for field, field_thresholds in thresholds.items():
+            if field == "Bone Density":
+                continue
+            low, high = profile.all_ranges[FIELD_RANGE_KEYS[field]]
+            for value in _around(field_thresholds):
+                if low <= value <= high:
+                    yield make_input_data(gender, age, {**BASELINE_VALUES, field: value}, bone_density, profile_name)
+
+
+def random_points(count: int, profile_name: str = DEFAULT_PROFILE_NAME, seed: int = 0) -> List[dict]:
+    """在全区间内均匀随机采样"""
+    profile = get_profile(profile_name)
+    rng = random.Random(seed)
+    bone_low, bone_high = profile.all_ranges["Bone_analysis"]
+    points = []
+    for _ in range(count):
+        values = {field: round(rng.uniform(*profile.all_ranges[key]), 3) for field, key in FIELD_RANGE_KEYS.items()}
+        bone_density = round(rng.uniform(bone_low, bone_high), 1) if rng.random() < 0.5 else None
+        points.append(make_input_data(rng.choice(["男", "女"]), rng.randint(18, 100), values, bone_density, profile_name))
+    return points
+
+
+def _marker_direction(value: float, low: float, high: float) -> int:
+    """标志物相对参考区间的方向：-1 低于区间，1 高于区间，0 区间内"""
+    return -1 if value < low else 1 if value >= high else 0
+
+
+def expected_turnover(profile: CompiledRangeProfile, is_male: bool, β_CTX_value: float, P1NP_value: float) -> str:
+    """
+    直接由参考区间得到的预期骨转换分型（不经过 compute_*）
+    β-CTX 低于 mid_low（低、中偏低区间，标为异常）为低转换，不低于 high 为高转换；P1NP 超出本性别的区间同理
+    """
+    directions = {
+        _marker_direction(β_CTX_value, profile.β_CTX["mid_low"], profile.β_CTX["high"]),
+        _marker_direction(P1NP_value, *profile.P1NP["male" if is_male else "female"]),
+    } - {0}
+    if directions == {-1, 1}:
+        return TURNOVER_MIXED
+    if directions == {1}:
+        return TURNOVER_HIGH
+    if directions == {-1}:
+        return TURNOVER_LOW
+    return TURNOVER_NORMAL
+
+
+def turnover_table(profile_name: str = DEFAULT_PROFILE_NAME) -> List[dict]:
+    """
+    β-CTX 与 P1NP 各边界及 ±ε 的组合（每个性别、每个年龄段），逐行比较 classify_overall 的分型与预期分型
+
+    Returns:
+        list: 不一致的行（性别、年龄、β-CTX、P1NP、预期分型、实际分型）
+    """
+    profile = get_profile(profile_name)
+    thresholds = extract_thresholds(profile)
+    β_CTX_low, β_CTX_high = profile.all_ranges[FIELD_RANGE_KEYS["β-CTX"]]
+    P1NP_low, P1NP_high = profile.all_ranges[FIELD_RANGE_KEYS["P1NP"]]
+    β_CTX_values = [value for value in _around(thresholds["β-CTX"]) if β_CTX_low <= value <= β_CTX_high]
+    P1NP_values = [value for value in _around(thresholds["P1NP"]) if P1NP_low <= value <= P1NP_high]
+    mismatches = []
+    for gender, age, β_CTX_value, P1NP_value in itertools.product(["男", "女"], extract_ages(profile),
+                                                                  β_CTX_values, P1NP_values):
+        input_data = make_input_data(gender, age, {**BASELINE_VALUES, "β-CTX": β_CTX_value, "P1NP": P1NP_value},
+                                     None, profile_name)
+        indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+        indicators_analysis.analysis()
+        expected = expected_turnover(profile, gender == "男", β_CTX_value, P1NP_value)
+        actual = indicators_analysis.overall["turnover"]
+        if actual != expected:
+            mismatches.append({"gender": gender, "age": age, "β-CTX": β_CTX_value, "P1NP": P1NP_value,
+                               "expected": expected, "actual": actual})
+    return mismatches
+
+
+def diff_dicts(expected, actual, path: str = "") -> List[str]:
+    """逐字段比较，返回差异描述"""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        differences = []
+        for key in expected.keys() | actual.keys():
+            if key not in actual:
+                differences.append(f"{path}/{key}: missing in candidate")
+            elif key not in expected:
+                differences.append(f"{path}/{key}: unexpected in candidate")
+            else:
+                differences.extend(diff_dicts(expected[key], actual[key], f"{path}/{key}"))
+        return differences
+    if isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)) and len(expected) == len(actual):
+        return [difference for index, (e, a) in enumerate(zip(expected, actual))
+                for difference in diff_dicts(e, a, f"{path}[{index}]")]
+    if expected != actual or type(expected) is not type(actual):
+        return [f"{path}: expected {expected!r}, got {actual!r}"]
+    return []
+
+
+def time_engine(engine: Engine, points: List[dict]) -> (List[dict], float):
+    start = time.perf_counter()
+    outputs = [engine(input_data) for input_data in points]
+    return outputs, time.perf_counter() - start
+
+
+def compare(candidate: Engine, points: List[dict], reference: Engine = reference_engine,
+            max_reported: int = 20) -> dict:
+    """在同一批测试点上运行参考实现与候选实现，返回差异与吞吐量"""
+    expected_outputs, reference_seconds = time_engine(reference, points)
+    actual_outputs, candidate_seconds = time_engine(candidate, points)
+    mismatches = []
+    mismatch_count = 0
+    for input_data, expected, actual in zip(points, expected_outputs, actual_outputs):
+        differences = diff_dicts(expected, actual)
+        if differences:
+            mismatch_count += 1
+            if len(mismatches) < max_reported:
+                mismatches.append({"input_data": input_data, "differences": differences[:5]})
+    return {
+        "points": len(points),
+        "mismatch_count": mismatch_count,
+        "mismatches": mismatches,
+        "reference_per_second": len(points) / reference_seconds if reference_seconds else float("inf"),
+        "candidate_per_second": len(points) / candidate_seconds if candidate_seconds else float("inf"),
+    }
+
+
+def load_engine(spec: str) -> Engine:
+    """按 "模块名:函数名" 加载候选实现"""
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def print_report(title: str, report: dict):
+    print(f"== {title} ==")
+    print(f"测试点: {report['points']}, 不一致: {report['mismatch_count']}")
+    print(f"吞吐量 参考实现: {report['reference_per_second']:.0f} 条/s, 候选实现: {report['candidate_per_second']:.0f} 条/s")
+    for mismatch in report["mismatches"]:
+        print(mismatch["input_data"]["patient_info"], mismatch["input_data"]["biochemical_indicators"],
+              mismatch["input_data"]["imaging_data"])
+        for difference in mismatch["differences"]:
+            print("    ", difference)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="规则引擎边界等价性与吞吐量测试")
+    parser.add_argument("--candidate", default="analysis_module.rule_harness:reference_engine",
+                        help="候选实现，格式为 模块名:函数名，函数接收 input_data 返回 to_dict(containing_is_abnormal=True)")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE_NAME)
+    parser.add_argument("--random", type=int, default=100000, help="随机样本数量")
+    args = parser.parse_args()
+
+    candidate_engine = load_engine(args.candidate)
+    print_report("边界扫描", compare(candidate_engine, list(boundary_points(args.profile))))
+    if args.random > 0:
+        print_report("随机样本", compare(candidate_engine, random_points(args.random, args.profile)))
+    turnover_mismatches = turnover_table(args.profile)
+    print(f"== 骨转换分型边界表 ==\n不一致: {len(turnover_mismatches)}")
+    for mismatch in turnover_mismatches[:20]:
+        print("    ", mismatch)
@@ -0,0 +1,98 @@
+"""
+模拟大模型：替换 ai_agent.client，按配置的延迟分布与错误率返回固定的综合分析，用于压测与容量评估，不产生费用
+延迟分布写法: "fixed:2"、"uniform:1,5"、"lognormal:中位数,sigma"（单位秒）
+可按服务商的方式限流：请求数与 token 数额度按每分钟上限匀速恢复（最多攒满一分钟），额度不足时抛出 StubRateLimitError（429）
+"""
+import json
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+STUB_SUMMARY = {
+    "结论解读": "根据多项指标结果，患者的骨代谢状态总体表现为高动力型，骨吸收活性增强，骨量流失风险较高。" * 2,
+    "用药建议": "1. 补充钙剂（如碳酸钙）每日1000mg和维生素D 800-1200 IU；\n2. 若骨吸收过高，建议使用抗骨吸收药物如双膦酸盐或地舒单抗。",
+    "生活方式建议": "1. 增加户外活动，保证每日15-30分钟的阳光照射；\n2. 饮食中增加富含钙质和维生素D的食物；\n3. 避免久坐、吸烟和过量饮酒。",
+    "参考依据": "1. 《中国骨质疏松诊治指南（2020年版）》；\n2. 《骨转换生化标志物临床应用指南（2021）》。",
+    "复诊建议": "建议3个月后复查骨代谢相关指标（如β-CTX、P1NP、N-MID）以及骨密度T值，评估干预效果。",
+}
+
+
+class StubRateLimitError(Exception):
+    """模拟服务商返回的 429"""
+    status_code = 429
+
+
+def parse_latency(spec: str):
+    """将延迟分布写法转为采样函数"""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class StubCompletions:
+    """
+    实现 client.chat.completions.create 的非流式调用
+    耗时 = 延迟分布采样 + 输出字符数 × seconds_per_char；按 error_rate 抛出异常模拟接口故障
+    rpm_limit / tpm_limit 大于 0 时限流，token 按 prompt token 加输出 token 计
+    """
+
+    def __init__(self, latency: str = "fixed:0", seconds_per_char: float = 0.0, error_rate: float = 0.0,
+                 summary: dict = None, seed: int = None, rpm_limit: int = 0, tpm_limit: int = 0):
+        self.sample_latency = parse_latency(latency)
+        self.seconds_per_char = seconds_per_char
+        self.error_rate = error_rate
+        self.summary = summary or STUB_SUMMARY
+        self.rng = random.Random(seed)
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        # 剩余额度：[请求数, token 数]
+        self._remaining = [float(rpm_limit), float(tpm_limit)]
+        self._refilled_at = time.monotonic()
+        self._limit_lock = threading.Lock()
+        self.rate_limited = 0
+
+    def _admit(self, tokens: int):
+        if not self.rpm_limit and not self.tpm_limit:
+            return
+        with self._limit_lock:
+            now = time.monotonic()
+            elapsed, self._refilled_at = now - self._refilled_at, now
+            for index, limit in enumerate((self.rpm_limit, self.tpm_limit)):
+                self._remaining[index] = min(limit, self._remaining[index] + elapsed * limit / 60)
+            if (self.rpm_limit and self._remaining[0] < 1) or (self.tpm_limit and self._remaining[1] < tokens):
+                self.rate_limited += 1
+                raise StubRateLimitError("Stub LLM rate limit exceeded (429)")
+            self._remaining[0] -= 1
+            self._remaining[1] -= tokens
+
+    def create(self, model, messages, temperature=0, **kwargs):
+        # 按字段并发生成时，最后一条消息指定了单个字段
+        sections = [field for field in self.summary if f"「{field}」" in messages[-1]["content"]] \
+            if len(messages) > 2 else list(self.summary)
+        content = json.dumps({field: self.summary[field] for field in sections}, ensure_ascii=False)
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        self._admit(prompt_chars // 2 + len(content) // 2)
+        time.sleep(self.sample_latency(self.rng) + len(content) * self.seconds_per_char)
+        if self.rng.random() < self.error_rate:
+            raise RuntimeError("Stub LLM injected error")
+        usage = SimpleNamespace(prompt_tokens=prompt_chars // 2, completion_tokens=len(content) // 2,
+                                prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+def install_stub_llm(latency: str = "fixed:0", seconds_per_char: float = 0.0, error_rate: float = 0.0,
+                     summary: dict = None, seed: int = None, rpm_limit: int = 0, tpm_limit: int = 0):
+    """用模拟大模型替换 ai_agent.client（流式调用会关闭）"""
+    from analysis_module import ai_agent
+
+    ai_agent.STREAM = False
+    ai_agent.client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions(
+        latency, seconds_per_char, error_rate, summary, seed, rpm_limit, tpm_limit)))
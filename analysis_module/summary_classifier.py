@@ -0,0 +1,165 @@
+"""
+本地的总体骨转换分型与综合分析模板
+根据各指标的 result 汇总出骨转换类型、维生素D状态、PTH状态、骨密度分级，并按模板生成与大模型相同的五个字段；
+对明确或全部正常的病例可按策略跳过大模型调用
+"""
+import os
+
+# 跳过大模型的策略：
+# "off"        始终调用大模型（默认，与原有行为一致）
+# "all_normal" 所有指标均无异常时使用本地模板
+# "clear_cut"  分型明确、无需进一步鉴别的病例使用本地模板（包括全部正常的病例）
+LOCAL_SUMMARY_POLICY = os.getenv("LOCAL_SUMMARY_POLICY", "off")
+LOCAL_SUMMARY_POLICIES = ("off", "all_normal", "clear_cut")
+
+SUMMARY_FIELDS = ("结论解读", "用药建议", "生活方式建议", "参考依据", "复诊建议")
+
+# 骨转换类型
+TURNOVER_HIGH = "高动力型"
+TURNOVER_LOW = "低动力型"
+TURNOVER_NORMAL = "正常"
+TURNOVER_MIXED = "混合型"
+
+# 骨转换标志物（β-CTX、P1NP）异常时，按当前区间判断方向；区间内未标为异常的不计入
+LOW_TURNOVER_RANGES = ("低", "中偏低")
+HIGH_TURNOVER_RANGES = ("中偏高", "高")
+
+TURNOVER_SENTENCES = {
+    TURNOVER_HIGH: "患者的骨代谢状态总体表现为高动力型：骨吸收活性增强，骨量流失风险较高。",
+    TURNOVER_LOW: "患者的骨代谢状态总体表现为低动力型：骨转换水平降低，成骨细胞活性不足，骨形成能力下降。",
+    TURNOVER_NORMAL: "患者的骨代谢状态总体处于正常范围，骨吸收与骨形成基本平衡。",
+    TURNOVER_MIXED: "骨吸收与骨形成指标提示的方向不一致，需结合临床进一步鉴别。",
+}
+VD_SENTENCES = {
+    "维生素D缺乏": "维生素D严重不足，钙吸收降低，会加重骨量流失；",
+    "维生素D不足": "维生素D水平不足，长期维持会增加骨质疏松风险；",
+    "维生素D充足": "维生素D水平充足；",
+}
+PTH_SENTENCES = {
+    "低": "PTH偏低，骨代谢异常可能与甲状旁腺以外的因素相关；",
+    "正常": "PTH处于正常范围，甲状旁腺功能未见明显异常；",
+    "偏高": "PTH偏高，提示甲状旁腺功能亢进可能，需排查继发性骨质疏松；",
+}
+T_SCORE_SENTENCES = {
+    "骨密度正常": "骨密度T值正常，无明显骨质疏松风险。",
+    "骨量减少": "骨密度T值提示骨量减少，尚未达到骨质疏松诊断标准。",
+    "骨质疏松": "骨密度T值达到骨质疏松诊断标准，骨折风险显著增加。",
+    "未提供": "未提供骨密度T值，建议完善骨密度检查以明确骨质疏松风险。",
+}
+GUIDELINES = "1. 《中国骨质疏松诊治指南（2020年版）》；\n2. 《骨转换生化标志物临床应用指南（2021）》；\n3. 《原发性骨质疏松症诊疗指南（2022）》。"
+
+
+def classify_overall(indicators_analysis) -> dict:
+    """
+    汇总各指标结果（需在各 compute_* 之后调用）
+
+    Returns:
+        dict: 骨转换类型、维生素D状态、PTH状态、骨密度分级、异常指标数以及是否为明确病例
+    """
+    markers = [indicator for indicator in (indicators_analysis.β_CTX, indicators_analysis.P1NP) if indicator.is_abnormal]
+    high_signals = sum(indicator.range in HIGH_TURNOVER_RANGES for indicator in markers)
+    low_signals = sum(indicator.range in LOW_TURNOVER_RANGES for indicator in markers)
+    if high_signals and low_signals:
+        turnover = TURNOVER_MIXED
+    elif high_signals:
+        turnover = TURNOVER_HIGH
+    elif low_signals:
+        turnover = TURNOVER_LOW
+    else:
+        turnover = TURNOVER_NORMAL
+
+    indicators = [indicators_analysis.β_CTX, indicators_analysis.P1NP, indicators_analysis.VD,
+                  indicators_analysis.N_MID, indicators_analysis.PTH, indicators_analysis.CT]
+    if indicators_analysis.has_bone_density:
+        indicators.append(indicators_analysis.bone_density)
+    abnormal_count = sum(indicator.is_abnormal for indicator in indicators)
+
+    # 需要医生进一步鉴别的情况：方向矛盾、继发性因素、降钙素升高
+    needs_review = (
+        turnover == TURNOVER_MIXED
+        or indicators_analysis.β_CTX.result == "高动力型（继发性）"
+        or indicators_analysis.N_MID.result == "继发性骨质疏松"
+        or indicators_analysis.CT.is_abnormal
+        or indicators_analysis.PTH.range == "偏高"
+    )
+    return {
+        "turnover": turnover,
+        "vitamin_d": indicators_analysis.VD.result,
+        "pth": indicators_analysis.PTH.range,
+        "t_score": indicators_analysis.bone_density.result if indicators_analysis.has_bone_density else "未提供",
+        "abnormal_count": abnormal_count,
+        "all_normal": abnormal_count == 0,
+        "clear_cut": not needs_review,
+    }
+
+
+def should_use_local_summary(overall: dict, policy: str = None) -> bool:
+    """按策略判断是否可以跳过大模型"""
+    policy = policy or LOCAL_SUMMARY_POLICY
+    if policy not in LOCAL_SUMMARY_POLICIES:
+        raise ValueError(f"Unknown local summary policy: {policy}")
+    if policy == "all_normal":
+        return overall["all_normal"]
+    if policy == "clear_cut":
+        return overall["all_normal"] or overall["clear_cut"]
+    return False
+
+
+def _numbered(items) -> str:
+    return "\n".join(f"{index}. {item}{'；' if index < len(items) else '。'}" for index, item in enumerate(items, 1))
+
+
+def render_local_summary(overall: dict) -> dict:
+    """按模板生成与 get_completion 输出相同的五个字段"""
+    turnover, vitamin_d, pth, t_score = overall["turnover"], overall["vitamin_d"], overall["pth"], overall["t_score"]
+
+    conclusion = "根据多项指标结果，" + TURNOVER_SENTENCES[turnover] + VD_SENTENCES.get(vitamin_d, "") \
+                 + PTH_SENTENCES.get(pth, "") + T_SCORE_SENTENCES.get(t_score, "")
+
+    medications = []
+    if vitamin_d in ("维生素D缺乏", "维生素D不足") or t_score in ("骨量减少", "骨质疏松") or turnover != TURNOVER_NORMAL:
+        medications.append("补充钙剂（如碳酸钙）每日1000mg和维生素D 800-1200 IU")
+    if turnover == TURNOVER_HIGH:
+        if t_score == "骨质疏松":
+            medications.append("骨吸收增强且已达骨质疏松，建议使用抗骨吸收药物如双膦酸盐或地舒单抗")
+        else:
+            medications.append("骨吸收增强，若骨密度进一步下降，可考虑使用抗骨吸收药物如双膦酸盐或地舒单抗")
+    elif turnover == TURNOVER_LOW:
+        medications.append("骨形成能力下降，可考虑使用特立帕肽以促进成骨")
+    if pth == "偏高":
+        medications.append("建议完善甲状旁腺功能检查，明确病因后再制定抗骨质疏松方案")
+    if not medications:
+        medications.append("目前各项指标未见明显异常，暂无需药物治疗，保持均衡饮食即可")
+
+    lifestyle = ["增加户外活动，保证每日15-30分钟的阳光照射",
+                 "饮食中增加富含钙质和维生素D的食物，如奶制品、鱼类、鸡蛋等",
+                 "避免久坐、吸烟和过量饮酒，保持适度运动，建议进行低冲击力的抗阻运动如快走或瑜伽"]
+    if t_score in ("骨量减少", "骨质疏松"):
+        lifestyle.append("注意居家防护，避免跌倒等骨折风险")
+
+    if overall["all_normal"]:
+        follow_up = "各项骨代谢指标正常，建议12个月后常规复查骨代谢相关指标。"
+    else:
+        follow_up = "建议3个月后复查骨代谢相关指标（如β-CTX、P1NP、N-MID）"
+        follow_up += "以及骨密度T值，评估干预效果。" if t_score != "未提供" else "，并完善骨密度检查。"
+        if pth == "偏高" or turnover == TURNOVER_MIXED:
+            follow_up += "若骨代谢异常持续，应进一步排查继发性骨质疏松的潜在原因并调整治疗方案。"
+
+    return {
+        "结论解读": conclusion,
+        "用药建议": _numbered(medications),
+        "生活方式建议": _numbered(lifestyle),
+        "参考依据": GUIDELINES,
+        "复诊建议": follow_up,
+    }
+
+
+if __name__ == "__main__":
+    import json
+    from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+    from analysis_module.warmup import SAMPLE_INPUT_DATA
+
+    indicators_analysis = IndicatorsAnalysis.from_input_data(SAMPLE_INPUT_DATA)
+    indicators_analysis.analysis()
+    print(indicators_analysis.overall)
+    print(json.dumps(render_local_summary(indicators_analysis.overall), ensure_ascii=False, indent=2))
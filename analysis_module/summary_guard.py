@@ -0,0 +1,206 @@
+"""
+全面分析的时限与熔断
+大模型生成综合分析在后台线程中执行，调用方最多等待 SLOW_MODE_DEADLINE_SECONDS 秒：
+- 超时：先返回指标逐一分析，标记综合分析“生成中”（pending）；后台调用继续执行，完成后写入缓存，相同输入的下一次请求直接返回
+- 熔断器打开（近期失败率或慢调用比例过高）或调用失败：不等待，标记综合分析“暂不可用”（unavailable）
+同一输入已有进行中的调用时不重复调用，等待同一个结果
+
+熔断器按最近 BREAKER_WINDOW 次调用统计；打开 BREAKER_OPEN_SECONDS 秒后放行一次试探调用，成功则关闭，失败则继续打开
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from contextlib import nullcontext
+from typing import Callable, Optional
+
+from analysis_module.rate_limiter import llm_rate_limiter
+
+# 全面分析等待综合分析的最长秒数，0 为不限
+SLOW_MODE_DEADLINE_SECONDS = float(os.getenv("SLOW_MODE_DEADLINE_SECONDS", "45"))
+BREAKER_WINDOW = 20
+# 窗口内调用数不少于该值时才判断是否熔断
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+# 耗时超过该秒数的调用视为慢调用
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "60"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# 超时后才完成的综合分析的缓存条数
+RESULT_CACHE_SIZE = 1024
+
+SUMMARY_READY = "ready"
+SUMMARY_PENDING = "pending"
+SUMMARY_UNAVAILABLE = "unavailable"
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate: float = BREAKER_SLOW_CALL_RATE, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        # 最近的调用：(是否成功, 是否为慢调用)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否允许发起调用；半开状态只放行一次试探调用"""
+        with self._lock:
+            if self.state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = STATE_HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool, seconds: float):
+        slow = seconds > self.slow_call_seconds
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                if ok and not slow:
+                    self.state = STATE_CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append((ok, slow))
+            calls = len(self._outcomes)
+            if self.state == STATE_CLOSED and calls >= self.min_calls:
+                failures = sum(not outcome_ok for outcome_ok, _ in self._outcomes)
+                slow_calls = sum(outcome_slow for _, outcome_slow in self._outcomes)
+                if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+                    self._open()
+
+    def _open(self):
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._outcomes.clear()
+
+
+def summary_key(input_message: dict) -> str:
+    """综合分析只取决于发给大模型的输入"""
+    return hashlib.sha1(json.dumps(input_message, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class SummaryGuard:
+    def __init__(self, breaker: CircuitBreaker = None, workers: int = 16, cache_size: int = RESULT_CACHE_SIZE):
+        self.breaker = breaker or CircuitBreaker()
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary-guard")
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._pending = {}
+        # 有调用方等待超时的生成中的 key：完成后一律缓存，不论发起调用时的时限
+        self._late_keys = set()
+        # 降级次数（按原因）与超时后才完成的调用数
+        self.degraded = {"deadline": 0, "circuit_open": 0, "error": 0}
+        self.late_completions = 0
+
+    def run(self, key: str, generate: Callable[[], object], deadline_seconds: Optional[float] = None) -> tuple:
+        """
+        在时限内取得 generate() 的结果
+
+        Returns:
+            (SUMMARY_READY, 结果) 或 (SUMMARY_PENDING / SUMMARY_UNAVAILABLE, None)
+        """
+        deadline_seconds = SLOW_MODE_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+        # 调用方等待期间，把限流排队的进度转给调用方线程注册的回调
+        listener = llm_rate_limiter.current_listener()
+        waiting = threading.Event()
+        waiting.set()
+
+        def forward(position, wait_seconds):
+            if waiting.is_set():
+                listener(position, wait_seconds)
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return SUMMARY_READY, self._cache[key]
+            future = self._pending.get(key)
+            if future is None:
+                if not self.breaker.allow():
+                    self.degraded["circuit_open"] += 1
+                    return SUMMARY_UNAVAILABLE, None
+                deadline_at = time.monotonic() + deadline_seconds if deadline_seconds > 0 else None
+                future = self._pending[key] = self._executor.submit(
+                    self._generate, key, generate, forward if listener else None, deadline_at)
+        try:
+            return SUMMARY_READY, future.result(timeout=deadline_seconds if deadline_seconds > 0 else None)
+        except TimeoutError:
+            with self._lock:
+                self.degraded["deadline"] += 1
+                if self._pending.get(key) is future:
+                    # 发起调用的可能是不限时的任务队列，超时的调用方已收到 pending，结果需缓存供其重新请求
+                    self._late_keys.add(key)
+                elif future.done() and future.exception() is None:
+                    # 超时后、加锁前刚好完成
+                    self._cache_late(key, future.result())
+            return SUMMARY_PENDING, None
+        except Exception as e:
+            print(f"Summary generation failed: {str(e)}")
+            with self._lock:
+                self.degraded["error"] += 1
+            return SUMMARY_UNAVAILABLE, None
+        finally:
+            waiting.clear()
+
+    def _generate(self, key: str, generate: Callable[[], object], listener, deadline_at: Optional[float]):
+        start = time.monotonic()
+        try:
+            with llm_rate_limiter.listen(listener) if listener else nullcontext():
+                value = generate()
+        except Exception:
+            self.breaker.record(False, time.monotonic() - start)
+            with self._lock:
+                self._pending.pop(key, None)
+                self._late_keys.discard(key)
+            raise
+        self.breaker.record(True, time.monotonic() - start)
+        with self._lock:
+            self._pending.pop(key, None)
+            # 只缓存超时后才完成的结果（调用方已收到 pending，会重新请求）：发起调用时的时限已过，或有后加入的调用方等待超时
+            waiter_timed_out = key in self._late_keys
+            self._late_keys.discard(key)
+            if waiter_timed_out or (deadline_at is not None and time.monotonic() > deadline_at):
+                self._cache_late(key, value)
+        return value
+
+    def _cache_late(self, key: str, value):
+        """需持有 _lock"""
+        self.late_completions += 1
+        self._cache[key] = value
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def prometheus_text(self) -> str:
+        lines = ["# HELP llm_circuit_open Whether the LLM circuit breaker is open (1) or half-open (0.5).",
+                 "# TYPE llm_circuit_open gauge",
+                 f"llm_circuit_open {dict(closed=0, half_open=0.5, open=1)[self.breaker.state]}",
+                 "# HELP slow_mode_degraded_total Slow-mode requests answered without an AI summary.",
+                 "# TYPE slow_mode_degraded_total counter"]
+        lines += [f'slow_mode_degraded_total{{reason="{reason}"}} {count}' for reason, count in self.degraded.items()]
+        lines += ["# HELP slow_mode_late_summaries_total AI summaries finished after the deadline and cached.",
+                  "# TYPE slow_mode_late_summaries_total counter", f"slow_mode_late_summaries_total {self.late_completions}"]
+        return "\n".join(lines) + "\n"
+
+
+summary_guard = SummaryGuard()
@@ -0,0 +1,278 @@
+"""
+既往综合分析的近邻检索
+指标数值相近的病例，大模型生成的综合分析几乎相同。全面分析成功后，按 参考区间配置 × 性别 × 有无骨密度 分区保存
+(归一化的指标向量 + 年龄) 与综合分析；新病例在同一分区内按欧氏距离查找近邻，且要求各指标的结果类型完全一致：
+- approximate: 最近邻距离不超过 SUMMARY_NN_MAX_DISTANCE 时直接返回其综合分析，不调用大模型
+- few_shot:    将最近的 k 个既往病例作为示例放入提示词，替代固定的示例输出
+
+每个分区为一棵静态 KD 树加一个暴力搜索的新增缓冲区，缓冲区超过树大小的 REBUILD_RATIO 时重建，摊销后每次写入 O(log n)；
+记录以 JSONL 追加保存在 SUMMARY_INDEX_PATH，进程启动时重新建树
+使用方式: python -m analysis_module.summary_index   （命中率与查询耗时测试）
+"""
+import heapq
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+SUMMARY_INDEX_PATH = os.getenv("SUMMARY_INDEX_PATH", "summary_index.jsonl")
+# "off" 不使用（默认）；"approximate" 近邻足够近时直接复用；"few_shot" 近邻作为提示词示例
+SUMMARY_NN_MODE = os.getenv("SUMMARY_NN_MODE", "off")
+SUMMARY_NN_MODES = ("off", "approximate", "few_shot")
+SUMMARY_NN_MAX_DISTANCE = float(os.getenv("SUMMARY_NN_MAX_DISTANCE", "0.03"))
+SUMMARY_NN_FEW_SHOT_K = int(os.getenv("SUMMARY_NN_FEW_SHOT_K", "2"))
+
+ATTRIBUTES = ("β_CTX", "P1NP", "VD", "N_MID", "PTH", "CT", "bone_density")
+RANGE_KEYS = ("β_CTX_analysis", "P1NP_analysis", "VD_analysis", "N_MID_analysis", "PTH_analysis", "CT_analysis",
+              "Bone_analysis")
+# 年龄除以该值后与归一化的指标值（0~1）一起计算距离，即相差 10 岁相当于某一指标相差全区间的 10%
+AGE_SCALE = 100.0
+LEAF_SIZE = 32
+REBUILD_MIN = 64
+REBUILD_RATIO = 0.1
+
+
+def case_features(indicators_analysis):
+    """返回 (分区键, 特征向量, 各指标结果类型)，需在 analysis() 之后调用"""
+    attributes = ATTRIBUTES if indicators_analysis.has_bone_density else ATTRIBUTES[:-1]
+    all_ranges = indicators_analysis.profile.all_ranges
+    values = []
+    for attribute, range_key in zip(attributes, RANGE_KEYS):
+        low, high = all_ranges[range_key]
+        values.append((float(getattr(indicators_analysis, attribute).value) - low) / (high - low))
+    values.append(indicators_analysis.age / AGE_SCALE)
+    key = (indicators_analysis.profile_name, indicators_analysis.is_male, indicators_analysis.has_bone_density)
+    results = tuple(getattr(indicators_analysis, attribute).result for attribute in attributes)
+    return key, np.array(values), results
+
+
+class KDTree:
+    """静态 KD 树：按取值跨度最大的维度在中位数处切分，叶子最多 LEAF_SIZE 个点"""
+
+    def __init__(self, points: np.ndarray):
+        self.points = points
+        self.order = np.arange(len(points))
+        # 节点：(切分维度, 切分值, 左子节点, 右子节点, 起始, 结束)，叶子的切分维度为 -1
+        self.nodes: List[tuple] = []
+        if len(points):
+            self._build(0, len(points))
+
+    def _build(self, start: int, end: int) -> int:
+        node_index = len(self.nodes)
+        self.nodes.append(None)
+        if end - start <= LEAF_SIZE:
+            self.nodes[node_index] = (-1, 0.0, -1, -1, start, end)
+            return node_index
+        subset = self.points[self.order[start:end]]
+        dimension = int(np.argmax(subset.max(axis=0) - subset.min(axis=0)))
+        middle = (end - start) // 2
+        partitioned = np.argpartition(subset[:, dimension], middle)
+        self.order[start:end] = self.order[start:end][partitioned]
+        split_value = float(self.points[self.order[start + middle], dimension])
+        left = self._build(start, start + middle)
+        right = self._build(start + middle, end)
+        self.nodes[node_index] = (dimension, split_value, left, right, start, end)
+        return node_index
+
+    def query(self, point: np.ndarray, k: int, max_distance: float = np.inf) -> List[tuple]:
+        """返回距离不超过 max_distance 的最近 k 个点 [(距离, 下标)]，按距离升序"""
+        if not self.nodes:
+            return []
+        # 最大堆（取负距离），保存当前最近的 k 个
+        best: List[tuple] = []
+        bound = max_distance
+        stack = [0]
+        while stack:
+            dimension, split_value, left, right, start, end = self.nodes[stack.pop()]
+            if dimension < 0:
+                indices = self.order[start:end]
+                distances = np.sqrt(((self.points[indices] - point) ** 2).sum(axis=1))
+                for distance, index in zip(distances.tolist(), indices.tolist()):
+                    if distance <= bound:
+                        heapq.heappush(best, (-distance, index))
+                        if len(best) > k:
+                            heapq.heappop(best)
+                        if len(best) == k:
+                            bound = min(max_distance, -best[0][0])
+                continue
+            difference = point[dimension] - split_value
+            near, far = (left, right) if difference < 0 else (right, left)
+            # 先访问同侧子树（后入栈先出），另一侧只在切分面距离不超过当前上界时访问
+            if abs(difference) <= bound:
+                stack.append(far)
+            stack.append(near)
+        return sorted((-distance, index) for distance, index in best)
+
+
+class _Partition:
+    def __init__(self, dimensions: int):
+        self.vectors = np.empty((0, dimensions))
+        self.tree = KDTree(self.vectors)
+        self.buffer: List[np.ndarray] = []
+        self.entries: List[dict] = []
+
+    def add(self, vector: np.ndarray, entry: dict):
+        self.buffer.append(vector)
+        self.entries.append(entry)
+        if len(self.buffer) > max(REBUILD_MIN, len(self.vectors) * REBUILD_RATIO):
+            self.vectors = np.vstack([self.vectors, np.array(self.buffer)])
+            self.tree = KDTree(self.vectors)
+            self.buffer = []
+
+    def query(self, vector: np.ndarray, k: int, max_distance: float) -> List[tuple]:
+        found = self.tree.query(vector, k, max_distance)
+        if self.buffer:
+            distances = np.sqrt(((np.array(self.buffer) - vector) ** 2).sum(axis=1))
+            offset = len(self.vectors)
+            found += [(distance, offset + index) for index, distance in enumerate(distances.tolist())
+                      if distance <= max_distance]
+            found = sorted(found)[:k]
+        return [(distance, self.entries[index]) for distance, index in found]
+
+
+class SummaryIndex:
+    def __init__(self, path: str = SUMMARY_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._partitions: Dict[tuple, _Partition] = {}
+        self.lookups = 0
+        self.hits = 0
+        # 命中时省去的大模型耗时（按该条记录生成时的耗时估计）与查询本身的耗时
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._insert(tuple(entry["key"]), np.array(entry["vector"]), entry)
+
+    def __len__(self):
+        return sum(len(partition.entries) for partition in self._partitions.values())
+
+    def _insert(self, key: tuple, vector: np.ndarray, entry: dict):
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition(len(vector))
+        partition.add(vector, entry)
+
+    def add(self, indicators_analysis, summary: dict, model: str, seconds: float):
+        """保存一次大模型生成的综合分析"""
+        key, vector, results = case_features(indicators_analysis)
+        entry = {"key": list(key), "vector": [round(value, 6) for value in vector.tolist()], "results": list(results),
+                 "gender": "男" if indicators_analysis.is_male else "女", "age": indicators_analysis.age,
+                 "values": [getattr(indicators_analysis, attribute).value for attribute in ATTRIBUTES[:len(results)]],
+                 "summary": summary, "model": model, "seconds": round(seconds, 3), "ts": time.time()}
+        with self._lock:
+            self._insert(key, vector, entry)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def nearest(self, indicators_analysis, k: int = 1, max_distance: float = np.inf) -> List[tuple]:
+        """同一分区内、各指标结果类型一致的最近 k 个既往病例 [(距离, 记录)]"""
+        key, vector, results = case_features(indicators_analysis)
+        results = list(results)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                return []
+            # 多取一些候选，过滤掉结果类型不一致的
+            candidates = partition.query(vector, k * 4, max_distance)
+        return [(distance, entry) for distance, entry in candidates if entry["results"] == results][:k]
+
+    def approximate(self, indicators_analysis, max_distance: float = None) -> Optional[dict]:
+        """最近邻足够近时返回其记录（含 summary 与 model），否则返回 None"""
+        start = time.perf_counter()
+        found = self.nearest(indicators_analysis, 1, SUMMARY_NN_MAX_DISTANCE if max_distance is None else max_distance)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.lookups += 1
+            self.lookup_seconds += elapsed
+            if found:
+                self.hits += 1
+                self.saved_seconds += found[0][1]["seconds"]
+        return found[0][1] if found else None
+
+    def examples(self, indicators_analysis, k: int = SUMMARY_NN_FEW_SHOT_K) -> List[dict]:
+        """最近 k 个既往病例，整理为 get_prompt 的示例格式"""
+        return [{
+            "患者基本信息": {"患者性别": entry["gender"], "患者年龄": entry["age"]},
+            "指标结果": {attribute: f"{value}（{result}）"
+                        for attribute, value, result in zip(ATTRIBUTES, entry["values"], entry["results"])},
+            "综合分析": entry["summary"],
+        } for _, entry in self.nearest(indicators_analysis, k)]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "lookup_seconds": round(self.lookup_seconds, 6),
+        }
+
+    def prometheus_text(self) -> str:
+        stats = self.stats()
+        lines = []
+        for name, metric_type, help_text, value in [
+            ("summary_index_entries", "gauge", "Stored LLM summaries available for reuse.", stats["entries"]),
+            ("summary_index_lookups_total", "counter", "Nearest-neighbour summary lookups.", stats["lookups"]),
+            ("summary_index_hits_total", "counter", "Lookups answered with a stored summary.", stats["hits"]),
+            ("summary_index_saved_seconds_total", "counter", "LLM time avoided by reusing stored summaries.",
+             stats["saved_seconds"]),
+        ]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+summary_index = SummaryIndex() if SUMMARY_NN_MODE != "off" else SummaryIndex(path="")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+    from analysis_module.request_recorder import load_recording
+    from analysis_module.rule_harness import random_points
+    from analysis_module.stub_llm import STUB_SUMMARY
+
+    parser = argparse.ArgumentParser(description="综合分析近邻检索的命中率与耗时")
+    parser.add_argument("--recording", default="", help="ANALYSIS_RECORD_FILE 录制的请求；为空时生成聚集的模拟病例")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--max-distance", type=float, default=SUMMARY_NN_MAX_DISTANCE)
+    parser.add_argument("--llm-seconds", type=float, default=8.0, help="模拟的单次大模型耗时")
+    args = parser.parse_args()
+
+    if args.recording:
+        cases = [record["input_data"] for record in load_recording(args.recording) if record["mode"] == "slow"]
+    else:
+        # 门诊病例集中在少数典型组合附近：以若干随机病例为中心加小幅扰动
+        rng = np.random.default_rng(0)
+        centers = list(random_points(200))
+        cases = []
+        for center_index in rng.integers(0, len(centers), args.count):
+            center = centers[center_index]
+            indicators = {field: round(value * float(rng.normal(1, 0.03)), 2)
+                          for field, value in center["biochemical_indicators"].items()}
+            cases.append({**center, "patient_info": {**center["patient_info"],
+                                                     "age": int(center["patient_info"]["age"] + rng.integers(-3, 4))},
+                          "biochemical_indicators": indicators})
+
+    index = SummaryIndex(path="")
+    start = time.perf_counter()
+    for input_data in cases:
+        indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+        indicators_analysis.analysis()
+        if index.approximate(indicators_analysis, args.max_distance) is None:
+            # 未命中时“调用大模型”并保存结果
+            index.add(indicators_analysis, STUB_SUMMARY, "stub", args.llm_seconds)
+    elapsed = time.perf_counter() - start
+    stats = index.stats()
+    print(f"病例数: {stats['lookups']}  命中: {stats['hits']}  命中率: {stats['hit_rate']:.1%}  索引条目: {stats['entries']}")
+    print(f"单次查询平均 {stats['lookup_seconds'] / max(stats['lookups'], 1) * 1e6:.0f} μs，"
+          f"省去大模型耗时约 {stats['saved_seconds'] / 3600:.1f} 小时（按每次 {args.llm_seconds}s 计），总耗时 {elapsed:.1f}s")
@@ -0,0 +1,138 @@
+"""
+服务启动预热：每个进程只执行一次，提前加载规则表、卡片模板、matplotlib 字体/后端以及大模型 HTTP 连接
+提供就绪信号，并记录首个请求与后续请求的耗时，用于评估冷启动开销
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# 预热用的示例输入
+SAMPLE_INPUT_DATA = {
+    "patient_info": {"gender": "女", "age": 60, "height": 0.0, "weight": 0.0},
+    "biochemical_indicators": {
+        "β-CTX": 0.8,
+        "P1NP": 70.0,
+        "25-Hydroxy Vitamin D": 18.0,
+        "N-MID Osteocalcin": 30.0,
+        "Parathyroid Hormone": 70.0,
+        "Calcitonin": 3.0,
+    },
+    "imaging_data": {"Bone Density": -2.8},
+    "medical_history": {"history": "", "medications": "", "testing_time": ""},
+}
+
+_ready = threading.Event()
+_warmup_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+boot_metrics = {
+    "process_started_at": time.time(),
+    "warmup_seconds": None,
+    "warmup_steps": {},
+    "warmup_errors": {},
+    "first_request_seconds": None,
+    "last_request_seconds": None,
+    "request_count": 0,
+}
+
+
+def warm_rule_tables():
+    """加载规则引擎并完整跑一遍示例数据，使区间表、各计算分支的代码路径提前就绪"""
+    from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+    indicators_analysis = IndicatorsAnalysis.from_input_data(SAMPLE_INPUT_DATA)
+    indicators_analysis.analysis()
+    indicators_analysis.to_dict(containing_is_abnormal=True)
+
+
+def warm_matplotlib():
+    """构建 matplotlib 字体缓存并用 Agg 后端绘制一次，避免首个请求承担字体扫描开销"""
+    import io
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib import font_manager
+    font_manager.findfont(font_manager.FontProperties(family=matplotlib.rcParams["font.sans-serif"]))
+    fig, ax = plt.subplots(figsize=(8, 0.3))
+    ax.plot([0, 1], [0, 0])
+    ax.text(1, 0.08, "ng/ml", fontsize=8)
+    fig.savefig(io.BytesIO(), format="png", bbox_inches="tight")
+    plt.close(fig)
+
+
+def warm_llm_connection():
+    """提前建立到大模型服务的 HTTP 连接（TLS 握手），连接由共享的 client 连接池复用"""
+    from analysis_module.ai_agent import client
+    client.with_options(timeout=5.0, max_retries=0).models.list()
+
+
+DEFAULT_STEPS: Dict[str, Callable[[], None]] = {
+    "rule_tables": warm_rule_tables,
+    "matplotlib": warm_matplotlib,
+    "llm_connection": warm_llm_connection,
+}
+
+
+def warm_up(extra_steps: Optional[Dict[str, Callable[[], None]]] = None, include_llm: bool = True) -> dict:
+    """
+    依次执行预热步骤，每个进程只执行一次；单个步骤失败只记录错误，不影响服务就绪
+
+    Args:
+        extra_steps: 额外的预热步骤，例如界面侧的卡片模板渲染
+        include_llm: 是否预热大模型连接（离线环境可关闭）
+    """
+    with _warmup_lock:
+        if _ready.is_set():
+            return boot_metrics
+        steps = dict(DEFAULT_STEPS)
+        if not include_llm:
+            steps.pop("llm_connection")
+        steps.update(extra_steps or {})
+
+        start = time.perf_counter()
+        for name, step in steps.items():
+            step_start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                boot_metrics["warmup_errors"][name] = str(e)
+            boot_metrics["warmup_steps"][name] = round(time.perf_counter() - step_start, 4)
+        boot_metrics["warmup_seconds"] = round(time.perf_counter() - start, 4)
+        _ready.set()
+        return boot_metrics
+
+
+def warm_up_in_background(**kwargs) -> threading.Thread:
+    """在后台线程预热，服务可以先开始监听，就绪前通过 is_ready() 对外报告未就绪"""
+    thread = threading.Thread(target=warm_up, kwargs=kwargs, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def wait_ready(timeout: Optional[float] = None) -> bool:
+    return _ready.wait(timeout)
+
+
+def record_request(seconds: float):
+    """记录一次请求的耗时，区分进程内的首个请求与后续请求"""
+    with _metrics_lock:
+        if boot_metrics["first_request_seconds"] is None:
+            boot_metrics["first_request_seconds"] = round(seconds, 4)
+        boot_metrics["last_request_seconds"] = round(seconds, 4)
+        boot_metrics["request_count"] += 1
+
+
+def metrics() -> dict:
+    """返回预热及首个/后续请求耗时；first_request_ratio 越接近 1 说明冷启动开销越小"""
+    with _metrics_lock:
+        snapshot = dict(boot_metrics)
+    snapshot["ready"] = is_ready()
+    first, last = snapshot["first_request_seconds"], snapshot["last_request_seconds"]
+    snapshot["first_request_ratio"] = round(first / last, 2) if first and last and snapshot["request_count"] > 1 else None
+    return snapshot
+
+
+if __name__ == "__main__":
+    print(warm_up(include_llm=False))
@@ -0,0 +1,294 @@
+"""
+# 无界面的 HTTP 分析服务，供检验科 LIS 系统直接调用 ai_analysis
+# JSON 输入输出，支持 HTTP/1.1 keep-alive 与 gzip 压缩；请求头 Accept / Content-Type 为 application/vnd.bone-result 时
+# 响应 / 请求体改用 result_codec 的二进制编码
+# 使用方式: python api_server.py --port 8600 --workers 16 --slow-workers 4
+#
+# POST /v1/analysis/fast   请求体为单个 input_data，返回指标极速分析结果
+# POST /v1/analysis/slow   请求体为单个 input_data，返回 AI 全面分析结果
+# POST /v1/analysis/bulk   请求体为 {"mode": "fast" | "slow", "patients": [input_data, ...]}
+# POST /v1/jobs            请求体为 {"input_data": {...}, "priority": "interactive" | "batch"}，提交全面分析任务，返回 job_id
+# GET  /v1/jobs/<job_id>   查询任务状态，加 ?wait=秒数 时阻塞等待任务完成
+# POST /v1/patients/visits 请求体为 {"visits": [{"patient_id": "...", "test_date": "YYYY-MM-DD", "input_data": {...}}, ...]}，批量保存检测记录
+# GET  /v1/patients/<patient_id>/trend  患者历次检测的指标变化、相对首次检测的变化率及治疗反应
+# GET  /healthz            存活检查
+# GET  /v1/router/stats    大模型路由的各路由延迟、token 用量及模型延迟 EWMA
+# GET  /metrics            大模型调用的 token、耗时、费用、限流排队统计及综合分析近邻复用的命中情况（Prometheus 文本格式）
+# GET  /readyz             就绪检查，预热完成前返回 503；附带预热耗时及首个/后续请求耗时
+"""
+import argparse
+import gzip
+import json
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from ai_analysis import ai_analysis
+from analysis_module.job_queue import AnalysisJobQueue, QueueFullError, JobNotFoundError
+from analysis_module import warmup, result_codec
+from analysis_module.model_router import model_router
+from analysis_module.llm_metrics import llm_metrics
+from analysis_module.rate_limiter import llm_rate_limiter
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+from analysis_module.patient_history import PatientHistoryStore
+from analysis_module.result_archive import archive_analyses
+from analysis_module.population_sketch import population_sketch
+from analysis_module.summary_index import summary_index
+from analysis_module.summary_guard import summary_guard
+from analysis_module.abnormality_counters import abnormality_counters, start_snapshot_writer
+
+# 小于该字节数的响应不压缩
+GZIP_MIN_SIZE = 1024
+# 单次批量请求允许的最大患者数
+BULK_MAX_PATIENTS = 1000
+# 查询任务时允许的最长阻塞等待秒数
+JOB_MAX_WAIT_SECONDS = 60
+# 单次批量保存的最大检测记录数
+VISITS_MAX_BATCH = 10000
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 下连接默认保持，客户端可复用同一连接连续发送请求
+    protocol_version = "HTTP/1.1"
+    # 关闭 Nagle 算法，避免响应头与响应体分两次发送时和客户端延迟 ACK 叠加产生约 40ms 的等待
+    disable_nagle_algorithm = True
+    # 极速分析交给 executor，需要调用大模型的全面分析交给独立的 slow_executor，
+    # 慢请求占满时不会阻塞极速分析；均由 AnalysisServer 初始化
+    executor: ThreadPoolExecutor = None
+    slow_executor: ThreadPoolExecutor = None
+    # 全面分析任务队列，由 AnalysisServer 初始化
+    job_queue: AnalysisJobQueue = None
+    # 患者随访记录库，由 AnalysisServer 初始化
+    history_store: PatientHistoryStore = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/healthz":
+            self.send_json(200, {"status": "success", "message": "ok"})
+        elif url.path == "/readyz":
+            if warmup.is_ready():
+                self.send_json(200, {"status": "success", "message": "ready", "metrics": warmup.metrics()})
+            else:
+                self.send_json(503, {"status": "error", "message": "warming up", "metrics": warmup.metrics()})
+        elif url.path == "/v1/router/stats":
+            self.send_json(200, {"status": "success", "message": "ok", "stats": model_router.stats()})
+        elif url.path == "/metrics":
+            self.send_text(200, llm_metrics.prometheus_text() + llm_rate_limiter.prometheus_text()
+                           + summary_index.prometheus_text() + summary_guard.prometheus_text(),
+                           "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path.startswith("/v1/jobs/"):
+            self.handle_job_poll(url.path[len("/v1/jobs/"):], parse_qs(url.query))
+        elif url.path.startswith("/v1/patients/") and url.path.endswith("/trend"):
+            patient_id = unquote(url.path[len("/v1/patients/"):-len("/trend")])
+            self.send_json(200, {"status": "success", "message": "ok", "trend": self.history_store.trend(patient_id)})
+        else:
+            self.send_json(404, {"status": "error", "message": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        try:
+            body = self.read_json()
+        except ValueError as e:
+            self.send_json(400, {"status": "error", "message": f"Invalid request body: {str(e)}"})
+            return
+
+        if self.path == "/v1/analysis/fast":
+            self.send_json(200, self.run_timed("fast", body))
+        elif self.path == "/v1/analysis/slow":
+            self.send_json(200, self.run_timed("slow", body))
+        elif self.path == "/v1/analysis/bulk":
+            self.handle_bulk(body)
+        elif self.path == "/v1/jobs":
+            self.handle_job_submit(body)
+        elif self.path == "/v1/patients/visits":
+            self.handle_visits(body)
+        else:
+            self.send_json(404, {"status": "error", "message": f"Unknown path: {self.path}"})
+
+    def executor_for(self, mode):
+        return self.slow_executor if mode == "slow" else self.executor
+
+    def run_timed(self, mode, input_data):
+        """在对应模式的线程池中执行分析，并记录请求耗时用于对比首个请求与后续请求"""
+        start = time.perf_counter()
+        result = self.executor_for(mode).submit(ai_analysis, input_data, mode).result()
+        warmup.record_request(time.perf_counter() - start)
+        return result
+
+    def handle_bulk(self, body):
+        mode = body.get("mode", "fast") if isinstance(body, dict) else None
+        patients = body.get("patients") if isinstance(body, dict) else None
+        if mode not in ("fast", "slow") or not isinstance(patients, list):
+            self.send_json(400, {"status": "error",
+                                 "message": 'Bulk body must be {"mode": "fast" | "slow", "patients": [...]}'})
+            return
+        if len(patients) > BULK_MAX_PATIENTS:
+            self.send_json(413, {"status": "error",
+                                 "message": f"Too many patients in one request (max {BULK_MAX_PATIENTS})"})
+            return
+
+        # 所有患者并发提交，结果按请求顺序返回
+        executor = self.executor_for(mode)
+        futures = [executor.submit(ai_analysis, input_data, mode) for input_data in patients]
+        results = [future.result() for future in futures]
+        self.send_json(200, {"status": "success", "message": "Data processed successfully.", "results": results})
+
+    def handle_visits(self, body):
+        visits = body.get("visits") if isinstance(body, dict) else None
+        if not isinstance(visits, list) or not all(
+                isinstance(visit, dict) and visit.get("patient_id") and isinstance(visit.get("input_data"), dict)
+                for visit in visits):
+            self.send_json(400, {"status": "error", "message": 'Visits body must be {"visits": [{"patient_id": "...", '
+                                                              '"test_date": "YYYY-MM-DD", "input_data": {...}}, ...]}'})
+            return
+        if len(visits) > VISITS_MAX_BATCH:
+            self.send_json(413, {"status": "error", "message": f"Too many visits in one request (max {VISITS_MAX_BATCH})"})
+            return
+        try:
+            inserted = self.history_store.add_visits(
+                (visit["patient_id"], visit["input_data"], visit.get("test_date")) for visit in visits)
+        except (TypeError, ValueError) as e:
+            self.send_json(400, {"status": "error", "message": str(e)})
+            return
+        # 只有新保存的检测计入人群百分位草图并归档，覆盖同日已有记录的不重复计入
+        new_visits = [visit for visit, new in zip(visits, inserted) if new]
+        population_sketch.add_batch(visit["input_data"] for visit in new_visits)
+        indicators_analyses = []
+        for visit in new_visits:
+            indicators_analysis = IndicatorsAnalysis.from_input_data(visit["input_data"])
+            indicators_analysis.analysis()
+            indicators_analyses.append(indicators_analysis)
+        archive_analyses(indicators_analyses, [visit.get("test_date") for visit in new_visits])
+        self.send_json(200, {"status": "success", "message": f"Saved {len(inserted)} visits ({sum(inserted)} new)."})
+
+    def handle_job_submit(self, body):
+        if not isinstance(body, dict) or not isinstance(body.get("input_data"), dict):
+            self.send_json(400, {"status": "error",
+                                 "message": 'Job body must be {"input_data": {...}, "priority": "interactive" | "batch"}'})
+            return
+        try:
+            job_id = self.job_queue.submit(body["input_data"], priority=body.get("priority", "interactive"))
+        except ValueError as e:
+            self.send_json(400, {"status": "error", "message": str(e)})
+            return
+        except QueueFullError as e:
+            self.send_json(429, {"status": "error", "message": str(e)}, {"Retry-After": "5"})
+            return
+        self.send_json(202, {"status": "success", "message": "Job accepted.", "job_id": job_id})
+
+    def handle_job_poll(self, job_id, query):
+        try:
+            if "wait" in query:
+                wait_seconds = min(float(query["wait"][0]), JOB_MAX_WAIT_SECONDS)
+                job = self.job_queue.wait(job_id, timeout=wait_seconds)
+            else:
+                job = self.job_queue.poll(job_id)
+        except JobNotFoundError:
+            self.send_json(404, {"status": "error", "message": f"Unknown job: {job_id}"})
+            return
+        except ValueError as e:
+            self.send_json(400, {"status": "error", "message": str(e)})
+            return
+        self.send_json(200, {"status": "success", "message": "ok", "job": job})
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        if self.headers.get("Content-Encoding", "") == "gzip":
+            try:
+                raw = gzip.decompress(raw)
+            except (OSError, EOFError, zlib.error) as e:
+                raise ValueError(f"Invalid gzip body: {str(e)}")
+        if self.headers.get("Content-Type", "").startswith(result_codec.CONTENT_TYPE):
+            return result_codec.decode(raw)
+        return json.loads(raw.decode("utf-8"))
+
+    def send_json(self, status_code, payload, extra_headers=None):
+        if result_codec.CONTENT_TYPE in self.headers.get("Accept", ""):
+            self.send_body(status_code, result_codec.encode(payload), result_codec.CONTENT_TYPE, extra_headers)
+        else:
+            self.send_text(status_code, json.dumps(payload, ensure_ascii=False), "application/json; charset=utf-8",
+                           extra_headers)
+
+    def send_text(self, status_code, text, content_type, extra_headers=None):
+        self.send_body(status_code, text.encode("utf-8"), content_type, extra_headers)
+
+    def send_body(self, status_code, body, content_type, extra_headers=None):
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        if len(body) >= GZIP_MIN_SIZE and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 压测时逐条访问日志的开销过大，默认关闭
+        pass
+
+
+class AnalysisServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, workers: int = 16, job_queue: AnalysisJobQueue = None,
+                 history_store: PatientHistoryStore = None, slow_workers: int = 4):
+        handler = type("BoundAnalysisRequestHandler", (AnalysisRequestHandler,),
+                       {"executor": ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis"),
+                        "slow_executor": ThreadPoolExecutor(max_workers=slow_workers, thread_name_prefix="analysis-slow"),
+                        "job_queue": job_queue,
+                        "history_store": history_store})
+        super().__init__(server_address, handler)
+
+    def server_close(self):
+        super().server_close()
+        self.RequestHandlerClass.executor.shutdown(wait=False)
+        self.RequestHandlerClass.slow_executor.shutdown(wait=False)
+        if self.RequestHandlerClass.job_queue is not None:
+            self.RequestHandlerClass.job_queue.stop(timeout=5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="骨代谢AI分析 HTTP 服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=16, help="执行极速分析的线程数")
+    parser.add_argument("--slow-workers", type=int, default=4, help="执行全面分析（调用大模型）的线程数")
+    parser.add_argument("--job-db", default="analysis_jobs.db", help="全面分析任务队列的 SQLite 文件")
+    parser.add_argument("--job-workers", type=int, default=4, help="执行全面分析任务的线程数")
+    parser.add_argument("--job-max-pending", type=int, default=64, help="排队及执行中任务数上限")
+    parser.add_argument("--job-overflow", choices=["reject", "defer"], default="reject", help="任务队列满时的处理方式")
+    parser.add_argument("--history-db", default="patient_history.db", help="患者随访记录的 SQLite 文件")
+    parser.add_argument("--stub-llm", default="", help="压测用：以该延迟分布模拟大模型，例如 lognormal:8,0.4")
+    parser.add_argument("--stub-llm-error-rate", type=float, default=0.0, help="压测用：模拟大模型的错误率")
+    parser.add_argument("--stub-llm-rpm", type=int, default=0, help="压测用：模拟大模型的每分钟请求数上限")
+    parser.add_argument("--stub-llm-tpm", type=int, default=0, help="压测用：模拟大模型的每分钟 token 上限")
+    args = parser.parse_args()
+
+    if args.stub_llm:
+        from analysis_module.stub_llm import install_stub_llm
+        install_stub_llm(latency=args.stub_llm, error_rate=args.stub_llm_error_rate,
+                         rpm_limit=args.stub_llm_rpm, tpm_limit=args.stub_llm_tpm)
+        print(f"Using stub LLM with latency {args.stub_llm}")
+    # 先开始监听，预热在后台进行，完成前 /readyz 返回 503
+    warmup.warm_up_in_background()
+    job_queue = AnalysisJobQueue(args.job_db, workers=args.job_workers, max_pending=args.job_max_pending,
+                                 overflow=args.job_overflow).start()
+    # 路由器按任务队列深度判断强模型是否过载
+    model_router.set_queue_depth_provider(job_queue.depth)
+    server = AnalysisServer((args.host, args.port), workers=args.workers, job_queue=job_queue,
+                            history_store=PatientHistoryStore(args.history_db), slow_workers=args.slow_workers)
+    # 异常计数定期写入快照目录下本进程的快照，供检验质控看板读取
+    start_snapshot_writer(f"api_server_{args.port}")
+    print(f"Serving bone metabolism analysis API on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if abnormality_counters.snapshot_path:
+            abnormality_counters.write_snapshot()
@@ -1,8 +1,24 @@
+import base64
+import io
+import math
 import os.path
+import threading
+import time
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx, add_script_run_ctx
 import json
 from ai_analysis import ai_analysis
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+from analysis_module.range_profiles import profile_cache, get_profile, DEFAULT_PROFILE_NAME
+from analysis_module.batch_validation import validate_batch, REASON_NOT_POSITIVE
+from analysis_module.warmup import warm_up, record_request, SAMPLE_INPUT_DATA
+from analysis_module.llm_metrics import start_metrics_file_writer
+from analysis_module.patient_history import PatientHistoryStore, INDICATOR_COLUMNS
+from analysis_module.population_sketch import population_sketch
+from analysis_module.result_archive import archive_analysis
+from analysis_module.abnormality_counters import start_snapshot_writer
+from analysis_module.rate_limiter import llm_rate_limiter
 import matplotlib.pyplot as plt
 from matplotlib import rcParams
 from matplotlib import font_manager as fm
@@ -30,18 +46,6 @@ PTH_analysis = ""
 CT_analysis = ""
 
 
-# 定义指标的全区间
-all_ranges = {
-    "β_CTX_analysis": (0.0, 4.0),
-    "P1NP_analysis": (10.0, 90.0),
-    "VD_analysis": (0.0, 100.0),
-    "N_MID_analysis": (0.0, 200.0),
-    "PTH_analysis": (0.0, 100.0),
-    "CT_analysis": (0.0, 40.0),
-    "Bone_analysis": (-5.0, 5.0),
-}
-
-
 # 绘制单个指标图示
 def plot_indicator_with_ticks(min_value, max_value, standard_range, current_range, current_value, unit, range_name):
     # 绘制图表
@@ -134,6 +138,360 @@ def plot_indicator_with_ticks(min_value, max_value, standard_range, current_rang
     return fig
 
 
+# 每个会话最多缓存的报告数量
+REPORT_CACHE_SIZE = 20
+
+# 免责声明
+indicator_disclaimer_style = """
+<div style="font-size: 12px; color: #999; margin-top: 0px;">
+    以下内容参考《骨代谢六项指标解读》文件编写，并结合具体需求予以调整。如有任何不妥或错误之处，敬请指正！
+</div>
+"""
+summary_disclaimer_style = """
+<div style="font-size: 12px; color: #999; margin-top: 0px;">
+    以下内容完全由 {model} 生成，仅供参考，不构成医学建议。
+</div>
+"""
+local_summary_disclaimer_style = """
+<div style="font-size: 12px; color: #999; margin-top: 0px;">
+    以下内容由本地规则根据各项指标结果自动生成，仅供参考，不构成医学建议。
+</div>
+"""
+nearest_summary_disclaimer_style = """
+<div style="font-size: 12px; color: #999; margin-top: 0px;">
+    以下内容取自指标高度相似的既往病例，由 {model} 生成，仅供参考，不构成医学建议。
+</div>
+"""
+# 综合分析未能在时限内生成（仍在生成中 / 大模型暂不可用）时的提示
+summary_pending_style = """
+<div style="background-color: #fff8e1; color: #8d6e00; padding: 12px 15px; margin: 10px 0; border-radius: 5px; font-size: 14px;">
+    {message}
+</div>
+"""
+SUMMARY_PENDING_MESSAGES = {
+    "pending": "AI综合分析仍在生成中，以上为各指标的分析结果。请稍后再次点击“🧠 AI全面分析”查看综合分析。",
+    "unavailable": "AI综合分析暂时不可用，以上为各指标的分析结果。请稍后再次点击“🧠 AI全面分析”重试。",
+}
+
+# 报告各部分的标题、提示及图表样式
+success_style = """
+<div style="background-color: #e8f5e9; color: #1b5e20; padding: 12px 15px; margin: 10px 0; border-radius: 5px; font-size: 14px;">
+    分析完成！以下为详细结果：
+</div>
+"""
+section_title_style = """
+<h4 style="margin: 20px 0 5px 0;">{title}</h4>
+"""
+more_charts_style = """
+<div style="font-size: 14px; font-family: monospace;">更多图表... 持续更新中</div>
+"""
+trend_hint_style = """
+<div style="font-size: 12px; color: #999; margin-top: 0px;">共 {visit_count} 次检测（{first_date} 至 {last_date}）{treatment_response}</div>
+"""
+inline_chart_style = """
+<div style="margin-bottom: 10px;"><img src="data:image/png;base64,{chart_base64}" style="width: 100%;" /></div>
+"""
+
+# 定义卡片样式
+full_card_style = """
+<div style="background-color: {background_color}; padding: 15px; margin: 10px 0; border-radius: 5px; box-shadow: 0px 2px 5px rgba(0, 0, 0, 0.1);">
+    <h5 style="color: #333; margin-bottom: 10px;">{title}{abnormal_tag}</h5>
+    <div style="display: flex; justify-content: space-between; font-size: 12px; color: #555; margin-bottom: 10px;">
+        <span><strong>当前值：</strong>{current_value}</span>
+        <span><strong>指标区间：</strong>{range}</span>
+        <span><strong>指标结果：</strong>{result}</span>
+    </div>
+    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 12px; color: #555;">
+        {population}<span><strong>指标解读：</strong>{interpretation}</span>
+        <span><strong>用药建议：</strong>{recommendation}</span>
+        <span><strong>参考文件(仅作示意)：</strong>{reference}</span>
+    </div>
+</div>
+"""
+without_recommendation_card_style = """
+<div style="background-color: {background_color}; padding: 15px; margin: 10px 0; border-radius: 5px; box-shadow: 0px 2px 5px rgba(0, 0, 0, 0.1);">
+    <h5 style="color: #333; margin-bottom: 10px; ">{title}{abnormal_tag}</h5>
+    <div style="display: flex; justify-content: space-between; font-size: 12px; color: #555; margin-bottom: 10px;">
+        <span><strong>当前值：</strong>{current_value}</span>
+        <span><strong>指标区间：</strong>{range}</span>
+        <span><strong>指标结果：</strong>{result}</span>
+    </div>
+    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 12px; color: #555;">
+        {population}<span><strong>指标解读：</strong>{interpretation}</span>
+        <span><strong>参考文件(仅作示意)：</strong>{reference}</span>
+    </div>
+</div>
+"""
+population_style = """<span><strong>人群对比：</strong>在同性别、同年龄段人群中位于第 {percentile:.0f} 百分位（样本数 {samples}）</span>
+        """
+abnormal_tag_style = """<span style="background-color: #ff0000; color: #fff; padding: 2px 8px; border-radius: 3px; font-size: 12px; margin-left: 20px;">
+                  异常
+                  </span>"""
+
+# 定义综合分析卡片样式
+summary_card_style = """
+<div style="background-color: #f0f8ff; padding: 20px; margin: 15px 0; border-radius: 10px; box-shadow: 0px 4px 8px rgba(0, 0, 0, 0.2);">
+    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 13px; color: #555;">
+        <span><strong>结论解读：</strong>{overall_interpretation}</span>
+        <span><strong>用药建议：</strong>{medication_recommendation}</span>
+        <span><strong>生活方式建议：</strong>{lifestyle_recommendation}</span>
+        <span><strong>复诊建议：</strong>{follow_up_suggestion}</span>
+        <span><strong>参考依据：</strong>{reference}</span>
+    </div>
+</div>
+"""
+
+
+def analysis_key(input_data):
+    """
+    由影响分析结果的输入字段组成缓存键（病史等暂未接入分析的字段不参与）
+    """
+    patient_info = input_data["patient_info"]
+    return (
+        patient_info["gender"],
+        patient_info["age"],
+        patient_info["height"],
+        patient_info["weight"],
+        *input_data["biochemical_indicators"].values(),
+        input_data["imaging_data"]["Bone Density"],
+        input_data.get("range_profile"),
+    )
+
+
+# 校验错误对应的界面提示
+form_field_labels = {
+    "β-CTX": "β-胶原特殊序列（ng/ml）",
+    "P1NP": "总I型胶原氨基端延长肽（μg/ml）",
+    "25-Hydroxy Vitamin D": "25-羟基维生素D（ng/ml）",
+    "N-MID Osteocalcin": "N-MID骨钙素（ng/ml）",
+    "Parathyroid Hormone": "甲状旁腺素（ng/ml）",
+    "Calcitonin": "降钙素（pg/ml）",
+    "Bone Density": "骨密度T值",
+}
+
+
+def form_error_messages(input_data):
+    """用批量校验器校验表单这一行数据，并转为界面提示"""
+    columns = {
+        "gender": [input_data["patient_info"]["gender"]],
+        "age": [input_data["patient_info"]["age"]],
+        **{field: [value] for field, value in input_data["biochemical_indicators"].items()},
+        "Bone Density": [input_data["imaging_data"]["Bone Density"]],
+    }
+    error_messages = []
+    for error in validate_batch(columns, input_data.get("range_profile")).errors:
+        field, reason = str(error["field"]), str(error["reason"])
+        if field == "gender":
+            error_messages.append("请在患者性别字段中选择一项。")
+        elif field == "age":
+            error_messages.append("请输入正确的患者年龄。")
+        elif reason == REASON_NOT_POSITIVE:
+            error_messages.append(f"{form_field_labels[field]}必须输入大于0的值。")
+        else:
+            error_messages.append(f"{form_field_labels[field]}的输入超出合理范围。")
+    return error_messages
+
+
+def render_indicator_card(analysis, population=None):
+    """渲染单个指标卡片的 HTML；population 为 (人群百分位, 样本数)，没有时不显示人群对比"""
+    # 判断是否异常并设置背景颜色
+    background_color = "#f9f9f9"  # 默认背景色
+    abnormal_tag = ""  # 默认没有异常提示
+    if analysis["是否异常"]:
+        background_color = "#ffe6e6"  # 浅红色背景
+        abnormal_tag = abnormal_tag_style
+
+    population_html = population_style.format(percentile=population[0], samples=population[1]) if population else ""
+
+    # 如果 interpretation 为空，则不渲染该字段
+    if analysis["用药建议"]:
+        return full_card_style.format(
+            background_color=background_color,
+            title=analysis["标题"],
+            abnormal_tag=abnormal_tag,
+            current_value=analysis["当前值"],
+            range=analysis["参考区间"],
+            result=analysis["指标结果"],
+            population=population_html,
+            interpretation=analysis["指标解读"],
+            recommendation=analysis["用药建议"],
+            reference=analysis["参考文件"],
+        )
+    return without_recommendation_card_style.format(
+        background_color=background_color,
+        title=analysis["标题"],
+        abnormal_tag=abnormal_tag,
+        current_value=analysis["当前值"],
+        range=analysis["参考区间"],
+        result=analysis["指标结果"],
+        population=population_html,
+        interpretation=analysis["指标解读"],
+        reference=analysis["参考文件"],
+    )
+
+
+def render_indicator_chart(indicator, analysis, range_profile=None):
+    """绘制单个指标图示并转为 PNG 字节，便于缓存；图示的全区间取自所选参考区间配置"""
+    all_ranges = get_profile(range_profile).all_ranges
+    fig = plot_indicator_with_ticks(min_value=all_ranges[indicator][0], max_value=all_ranges[indicator][1],
+                                    standard_range=analysis["正常区间范围数值"],
+                                    current_range=analysis["当前区间范围数值"],
+                                    current_value=analysis["当前数值"], unit=analysis["单位"],
+                                    range_name=analysis["当前区间名称"])
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def render_inline_chart(chart_png):
+    """将图表 PNG 以 data URI 的形式内嵌到报告 HTML 中"""
+    return inline_chart_style.format(chart_base64=base64.b64encode(chart_png).decode("ascii"))
+
+
+# 趋势图中各指标的标题
+trend_chart_titles = {
+    "β_CTX": "β-CTX (ng/ml)",
+    "P1NP": "P1NP (μg/ml)",
+    "VD": "25-OH VD (ng/ml)",
+    "N_MID": "N-MID (ng/ml)",
+    "PTH": "PTH (ng/ml)",
+    "CT": "CT (pg/ml)",
+    "bone_density": "T-score",
+}
+
+
+def render_trend_chart(trend, columns):
+    """按检测日期绘制各指标的变化折线（每个指标一个子图），转为 PNG 字节"""
+    dates = trend["test_date"]
+    fig, axes = plt.subplots((len(columns) + 1) // 2, 2 if len(columns) > 1 else 1,
+                             figsize=(8, 2.2 * ((len(columns) + 1) // 2)), squeeze=False)
+    for ax, column in zip(axes.flat, columns):
+        values = [float("nan") if value is None else value for value in trend["indicators"][column]["values"]]
+        ax.plot(range(len(dates)), values, marker="o", color="#1f77b4")
+        if column == "bone_density":
+            # 骨量减少与骨质疏松的诊断界值
+            ax.axhline(-1.0, color="orange", linestyle="--", linewidth=0.8)
+            ax.axhline(-2.5, color="red", linestyle="--", linewidth=0.8)
+        ax.set_title(trend_chart_titles[column], fontsize=9)
+        ax.set_xticks(range(len(dates)))
+        ax.set_xticklabels(dates, rotation=30, fontsize=7)
+        ax.tick_params(axis="y", labelsize=7)
+    for ax in list(axes.flat)[len(columns):]:
+        ax.axis("off")
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def render_trend_blocks(trend):
+    """当前指标变化趋势、骨密度变化对比；检测少于两次时不显示"""
+    visit_count = len(trend["test_date"]) if trend else 0
+    if visit_count < 2:
+        return []
+    responses = [f"，{response['therapy']}后 {response['indicator'].replace('_', '-')} 较治疗前变化 "
+                 f"{response['percent_change']:+.1f}%（{'有效' if response['responded'] else '未达有效标准'}）"
+                 for response in trend["treatment_response"]]
+    blocks = [section_title_style.format(title="当前指标变化趋势"),
+              trend_hint_style.format(visit_count=visit_count, first_date=trend["test_date"][0],
+                                      last_date=trend["test_date"][-1],
+                                      treatment_response=responses[-1] if responses else ""),
+              render_inline_chart(render_trend_chart(trend, [column for column in INDICATOR_COLUMNS
+                                                             if column != "bone_density"]))]
+    bone_density_values = [value for value in trend["indicators"]["bone_density"]["values"] if value is not None]
+    if len(bone_density_values) >= 2:
+        blocks.append(section_title_style.format(title="骨密度变化对比"))
+        blocks.append(render_inline_chart(render_trend_chart(trend, ["bone_density"])))
+    return blocks
+
+
+def build_report_html(all_results, mode, trend=None, percentiles=None, range_profile=None):
+    """
+    将一次分析结果（极速/全面两种模式共用）拼装为一份完整的 HTML 报告，
+    图表以内嵌图片的形式放入文档，整份报告只需一次渲染调用发送到浏览器
+    trend 为患者的历史检测趋势（PatientHistoryStore.trend），有两次及以上检测时附带趋势图
+    percentiles 为各指标的人群百分位（PopulationSketch.percentiles），在指标卡片中显示
+    range_profile 为参考区间配置名称，决定指标图示的全区间
+    """
+    analysis_results = all_results.get("指标逐一分析", {})
+    blocks = [success_style, section_title_style.format(title="指标逐一分析"), indicator_disclaimer_style]
+    for indicator, analysis in analysis_results.items():
+        blocks.append(render_indicator_card(analysis, (percentiles or {}).get(indicator)))
+        blocks.append(render_inline_chart(render_indicator_chart(indicator, analysis, range_profile)))
+
+    if mode == "slow":
+        # 综合分析及建议
+        overall_results = all_results.get("综合分析及建议") or {}
+        blocks.append(section_title_style.format(title="综合分析及建议"))
+        summary_status = all_results.get("综合分析状态")
+        if summary_status in SUMMARY_PENDING_MESSAGES:
+            blocks.append(summary_pending_style.format(message=SUMMARY_PENDING_MESSAGES[summary_status]))
+        elif all_results.get("综合分析来源") == "local":
+            blocks.append(local_summary_disclaimer_style)
+        elif all_results.get("综合分析来源") == "nearest":
+            blocks.append(nearest_summary_disclaimer_style.format(model=all_results.get("综合分析模型") or "GPT-4.0"))
+        else:
+            blocks.append(summary_disclaimer_style.format(model=all_results.get("综合分析模型") or "GPT-4.0"))
+        if summary_status not in SUMMARY_PENDING_MESSAGES:
+            blocks.append(summary_card_style.format(
+                overall_interpretation=overall_results.get("结论解读", ""),
+                medication_recommendation=overall_results.get("用药建议", ""),
+                lifestyle_recommendation=overall_results.get("生活方式建议", ""),
+                follow_up_suggestion=overall_results.get("复诊建议", ""),
+                reference=overall_results.get("参考依据", ""),
+            ))
+
+    # 可视化展示
+    blocks.append(section_title_style.format(title="数据图表"))
+    blocks.extend(render_trend_blocks(trend))
+    blocks.append(more_charts_style)
+
+    # 各块之间以空行分隔，保证每个块都作为独立的 HTML 块被 markdown 解析
+    return "\n\n".join(block.strip() for block in blocks)
+
+
+def build_report_entry(all_results, mode, trend=None, percentiles=None, range_profile=None):
+    """
+    将一次分析结果渲染为可直接重绘的报告（图表已内嵌在 HTML 中）
+    """
+    return {
+        "mode": mode,
+        "result": all_results,
+        "html": build_report_html(all_results, mode, trend, percentiles, range_profile),
+    }
+
+
+def show_report(entry):
+    """从缓存的报告重绘结果页，不做任何计算，整份报告一次发送"""
+    st.markdown(entry["html"], unsafe_allow_html=True)
+
+
+def warm_card_templates():
+    """用示例数据完整渲染一次报告，预热卡片模板与图表绘制"""
+    indicators_analysis = IndicatorsAnalysis.from_input_data(SAMPLE_INPUT_DATA)
+    indicators_analysis.analysis()
+    build_report_html({"指标逐一分析": indicators_analysis.to_dict(containing_is_abnormal=True),
+                       "综合分析及建议": {}}, "slow")
+
+
+@st.cache_resource
+def history_store():
+    """患者随访记录库，所有会话共享一个连接"""
+    return PatientHistoryStore(os.getenv("PATIENT_HISTORY_DB", "patient_history.db"))
+
+
+@st.cache_resource(show_spinner="服务预热中，请稍候...")
+def boot():
+    """每个服务进程只预热一次，所有会话共享"""
+    # 配置了 LLM_METRICS_FILE 时定期写出大模型调用统计
+    start_metrics_file_writer()
+    # 异常计数定期写入快照目录下本进程（按端口区分）的快照，供检验质控看板页面读取
+    start_snapshot_writer(f"streamlit_{st.get_option('server.port')}")
+    return warm_up(extra_steps={"card_templates": warm_card_templates})
+
+
 if __name__ == "__main__":
     # 设置页面布局
     st.set_page_config(
@@ -141,6 +499,7 @@ if __name__ == "__main__":
         layout="centered",
         initial_sidebar_state="collapsed",
     )
+    boot()
 
     # 页面标题
     st.title("Bone Metabolism AI | 骨代谢AI模型")
@@ -158,6 +517,14 @@ if __name__ == "__main__":
 
     st.markdown("---")  # 上方分割线
 
+    # 参考区间配置（多家医院/实验室时在侧边栏选择）
+    range_profile = st.sidebar.selectbox("参考区间配置", profile_cache.available_profiles(),
+                                         index=profile_cache.available_profiles().index(DEFAULT_PROFILE_NAME))
+    # 输入框的取值范围随所选配置变化
+    all_ranges = get_profile(range_profile).all_ranges
+    # 送检科室，仅用于检验质控看板的分科室统计
+    department = st.sidebar.text_input("送检科室").strip()
+
     # 患者信息输入区
     st.markdown("### 患者信息")
     col1, col2 = st.columns(2)
@@ -172,6 +539,8 @@ if __name__ == "__main__":
         history = st.text_area(":grey[既往病史（例如：脆性骨折、内分泌疾病、肾功能不全等，可选项）]")
         medications = st.text_area(":grey[用药史（例如：双膦酸盐、地舒单抗、特立帕肽等，可选项）]")
         testing_time = st.text_input(":grey[检测时间节点（例如：首次检测、随访复测，可选项）]")
+        patient_id = st.text_input(":grey[患者编号（可选项，填写后保存本次检测并显示历次检测的变化趋势）]").strip()
+        test_date = st.date_input(":grey[检测日期]")
 
     # 生化指标输入区
     st.markdown("### 生化指标")
@@ -264,400 +633,98 @@ if __name__ == "__main__":
         if st.button("🧠 AI全面分析"):
             button2_clicked = True
 
-    # AI 分析按钮
+    # 组织输入数据
+    input_data = {
+        "patient_info": {
+            "gender": gender,
+            "age": age,
+            "height": height,
+            "weight": weight,
+            "department": department,
+        },
+        "biochemical_indicators": {
+            "β-CTX": β_CTX,
+            "P1NP": P1NP,
+            "25-Hydroxy Vitamin D": VD,
+            "N-MID Osteocalcin": N_MID,
+            "Parathyroid Hormone": PTH,
+            "Calcitonin": CT,
+        },
+        "imaging_data": {
+            "Bone Density": bone_density if use_bone_density else "未输入",
+        },
+        "medical_history": {
+            "history": history,
+            "medications": medications,
+            "testing_time": testing_time,
+        },
+        "range_profile": range_profile,
+    }
+    input_key = analysis_key(input_data)
+    if patient_id:
+        # 趋势与治疗反应还取决于患者编号、检测日期、用药史和检测时间节点
+        input_key += (patient_id, test_date.isoformat(), medications, testing_time)
+
+    # 分析结果保存在 session_state 中，Streamlit 每次重跑脚本时直接从内存重绘
+    report_cache = st.session_state.setdefault("report_cache", {})
+
+    if button1_clicked or button2_clicked:
+        mode = "slow" if button2_clicked else "fast"
+        st.session_state["report_mode"] = mode
 
-    if button1_clicked:
         # 验证必填项
-        error_messages = []
-        if gender == "请选择":
-            error_messages.append("请在患者性别字段中选择一项。")
-        if age <= 0:
-            error_messages.append("请输入正确的患者年龄。")
-        if β_CTX <= 0:
-            error_messages.append("β-胶原特殊序列（ng/ml）必须输入大于0的值。")
-        if P1NP <= 0:
-            error_messages.append("总I型胶原氨基端延长肽（μg/ml）必须输入大于0的值。")
-        if VD <= 0:
-            error_messages.append("25-羟基维生素D（ng/ml）必须输入大于0的值。")
-        if N_MID <= 0:
-            error_messages.append("N-MID骨钙素（ng/ml）必须输入大于0的值。")
-        if PTH <= 0:
-            error_messages.append("甲状旁腺素（ng/ml）必须输入大于0的值。")
-        if CT <= 0:
-            error_messages.append("降钙素（pg/ml）必须输入大于0的值。")
+        error_messages = form_error_messages(input_data)
 
         # 如果有错误，显示提示并返回
         if error_messages:
             for msg in error_messages:
                 st.error(msg)
-        else:
-            # 组织输入数据
-            input_data = {
-                "patient_info": {
-                    "gender": gender,
-                    "age": age,
-                    "height": height,
-                    "weight": weight,
-                },
-                "biochemical_indicators": {
-                    "β-CTX": β_CTX,
-                    "P1NP": P1NP,
-                    "25-Hydroxy Vitamin D": VD,
-                    "N-MID Osteocalcin": N_MID,
-                    "Parathyroid Hormone": PTH,
-                    "Calcitonin": CT,
-                },
-                "imaging_data": {
-                    "Bone Density": bone_density if use_bone_density else "未输入",
-                },
-                "medical_history": {
-                    "history": history,
-                    "medications": medications,
-                    "testing_time": testing_time,
-                },
-            }
-
+        elif (input_key, mode) not in report_cache or \
+                report_cache[(input_key, mode)]["result"].get("综合分析状态") in SUMMARY_PENDING_MESSAGES:
+            # 综合分析尚未生成的报告再次点击时重新请求（超时后完成的综合分析已缓存，可直接取得）
             print(input_data)
 
             # 调用AI分析函数
-            result = ai_analysis(input_data, mode="fast")
+            request_start = time.perf_counter()
+            # 大模型调用额度不足时排队，显示排队位置与预计等待时间
+            queue_placeholder = st.empty()
 
-            # 根据返回结果显示信息
-            if result["status"] == "success":
-                st.success("分析完成！以下为详细结果：")
-                all_results = result.get("result", {})
-                analysis_results = all_results.get("指标逐一分析", {})
-
-                # 分块显示单一指标分析
-                st.markdown("#### 指标逐一分析")
-
-                # 添加免责声明
-                disclaimer_style = """
-                <div style="font-size: 12px; color: #999; margin-top: 0px;">
-                    以下内容参考《骨代谢六项指标解读》文件编写，并结合具体需求予以调整。如有任何不妥或错误之处，敬请指正！
-                </div>
-                """
-                st.markdown(disclaimer_style, unsafe_allow_html=True)
-
-                # 定义卡片样式
-                full_card_style = """
-                <div style="background-color: {background_color}; padding: 15px; margin: 10px 0; border-radius: 5px; box-shadow: 0px 2px 5px rgba(0, 0, 0, 0.1);">
-                    <h5 style="color: #333; margin-bottom: 10px;">{title}{abnormal_tag}</h5>
-                    <div style="display: flex; justify-content: space-between; font-size: 12px; color: #555; margin-bottom: 10px;">
-                        <span><strong>当前值：</strong>{current_value}</span>
-                        <span><strong>指标区间：</strong>{range}</span>
-                        <span><strong>指标结果：</strong>{result}</span>
-                    </div>
-                    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 12px; color: #555;">
-                        <span><strong>指标解读：</strong>{interpretation}</span>
-                        <span><strong>用药建议：</strong>{recommendation}</span>
-                        <span><strong>参考文件(仅作示意)：</strong>{reference}</span>
-                    </div>
-                </div>
-                """
-                without_recommendation_card_style = """
-                <div style="background-color: {background_color}; padding: 15px; margin: 10px 0; border-radius: 5px; box-shadow: 0px 2px 5px rgba(0, 0, 0, 0.1);">
-                    <h5 style="color: #333; margin-bottom: 10px; ">{title}{abnormal_tag}</h5>
-                    <div style="display: flex; justify-content: space-between; font-size: 12px; color: #555; margin-bottom: 10px;">
-                        <span><strong>当前值：</strong>{current_value}</span>
-                        <span><strong>指标区间：</strong>{range}</span>
-                        <span><strong>指标结果：</strong>{result}</span>
-                    </div>
-                    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 12px; color: #555;">
-                        <span><strong>指标解读：</strong>{interpretation}</span>
-                        <span><strong>参考文件(仅作示意)：</strong>{reference}</span>
-                    </div>
-                </div>
-                """
-
-                for indicator, analysis in analysis_results.items():
-                    # 判断是否异常并设置背景颜色
-                    background_color = "#f9f9f9"  # 默认背景色
-                    abnormal_tag = ""  # 默认没有异常提示
-                    if analysis["是否异常"]:
-                        background_color = "#ffe6e6"  # 浅红色背景
-                        abnormal_tag = """<span style="background-color: #ff0000; color: #fff; padding: 2px 8px; border-radius: 3px; font-size: 12px; margin-left: 20px;">
-                                          异常
-                                          </span>"""
-
-                    # 如果 interpretation 为空，则不渲染该字段
-                    if analysis["用药建议"]:
-                        st.markdown(
-                            full_card_style.format(
-                                background_color=background_color,
-                                title=analysis["标题"],
-                                abnormal_tag=abnormal_tag,
-                                current_value=analysis["当前值"],
-                                range=analysis["参考区间"],
-                                result=analysis["指标结果"],
-                                interpretation=analysis["指标解读"],
-                                recommendation=analysis["用药建议"],
-                                reference=analysis["参考文件"],
-                            ),
-                            unsafe_allow_html=True,
-                        )
-                    else:
-                        st.markdown(
-                            without_recommendation_card_style.format(
-                                background_color=background_color,
-                                title=analysis["标题"],
-                                abnormal_tag=abnormal_tag,
-                                current_value=analysis["当前值"],
-                                range=analysis["参考区间"],
-                                result=analysis["指标结果"],
-                                interpretation=analysis["指标解读"],
-                                reference=analysis["参考文件"],
-                            ),
-                            unsafe_allow_html=True,
-                        )
-
-                    fig = plot_indicator_with_ticks(min_value=all_ranges[indicator][0], max_value=all_ranges[indicator][1],
-                                                    standard_range=analysis["正常区间范围数值"],
-                                                    current_range=analysis["当前区间范围数值"],
-                                                    current_value=analysis["当前数值"], unit=analysis["单位"],
-                                                    range_name=analysis["当前区间名称"])
-                    # 显示图表
-                    st.pyplot(fig)
-
-                # 可视化展示
-                st.markdown("#### 数据图表")
-                st.text("更多图表... 持续更新中")
-                # st.markdown("以下为患者各项指标的变化趋势和对比分析：")
-                #
-                # col1, col2 = st.columns(2)
-                # with col1:
-                #     st.markdown("#### 当前指标变化趋势")
-                #     # 绘制趋势折线图（示例）
-                #     st.line_chart(analysis_results['trend_data'])
-                # with col2:
-                #     st.markdown("#### 全国数据对比")
-                #     # 显示柱状图或分布图（示例）
-                #     st.bar_chart(analysis_results['comparison_data'])
-
-                # st.markdown("#### 骨密度变化对比")
-                # 骨密度变化图（示例）
-                # st.line_chart(analysis_results['bone_density_trend'])
-            else:
-                st.error(result["message"])
+            script_run_ctx = get_script_run_ctx()
 
-    if button2_clicked:
-        # 验证必填项
-        error_messages = []
-        if gender == "请选择":
-            error_messages.append("请在患者性别字段中选择一项。")
-        if age <= 0:
-            error_messages.append("请输入正确的患者年龄。")
-        if β_CTX <= 0:
-            error_messages.append("β-胶原特殊序列（ng/ml）必须输入大于0的值。")
-        if P1NP <= 0:
-            error_messages.append("总I型胶原氨基端延长肽（μg/ml）必须输入大于0的值。")
-        if VD <= 0:
-            error_messages.append("25-羟基维生素D（ng/ml）必须输入大于0的值。")
-        if N_MID <= 0:
-            error_messages.append("N-MID骨钙素（ng/ml）必须输入大于0的值。")
-        if PTH <= 0:
-            error_messages.append("甲状旁腺素（ng/ml）必须输入大于0的值。")
-        if CT <= 0:
-            error_messages.append("降钙素（pg/ml）必须输入大于0的值。")
-
-        # 如果有错误，显示提示并返回
-        if error_messages:
-            for msg in error_messages:
-                st.error(msg)
-        else:
-            # 组织输入数据
-            input_data = {
-                "patient_info": {
-                    "gender": gender,
-                    "age": age,
-                    "height": height,
-                    "weight": weight,
-                },
-                "biochemical_indicators": {
-                    "β-CTX": β_CTX,
-                    "P1NP": P1NP,
-                    "25-Hydroxy Vitamin D": VD,
-                    "N-MID Osteocalcin": N_MID,
-                    "Parathyroid Hormone": PTH,
-                    "Calcitonin": CT,
-                },
-                "imaging_data": {
-                    "Bone Density": bone_density if use_bone_density else "未输入",
-                },
-                "medical_history": {
-                    "history": history,
-                    "medications": medications,
-                    "testing_time": testing_time,
-                },
-            }
+            def show_llm_queue(position, wait_seconds):
+                # 回调可能在代为调用大模型的后台线程中执行，需关联到当前会话才能更新页面
+                add_script_run_ctx(threading.current_thread(), script_run_ctx)
+                queue_placeholder.info(f"当前使用人数较多，AI分析排队中：第 {position} 位，预计等待约 {math.ceil(wait_seconds)} 秒")
 
-            print(input_data)
-
-            # 调用AI分析函数
-            result = ai_analysis(input_data, mode="slow")
+            with llm_rate_limiter.listen(show_llm_queue):
+                result = ai_analysis(input_data, mode=mode)
+            queue_placeholder.empty()
 
             # 根据返回结果显示信息
             if result["status"] == "success":
-                st.success("分析完成！以下为详细结果：")
-                all_results = result.get("result", {})
-                analysis_results = all_results.get("指标逐一分析", {})
-
-                # 分块显示单一指标分析
-                st.markdown("#### 指标逐一分析")
-
-                # 添加免责声明
-                disclaimer_style = """
-                <div style="font-size: 12px; color: #999; margin-top: 0px;">
-                    以下内容参考《骨代谢六项指标解读》文件编写，并结合具体需求予以调整。如有任何不妥或错误之处，敬请指正！
-                </div>
-                """
-                st.markdown(disclaimer_style, unsafe_allow_html=True)
-
-                # 定义卡片样式
-                full_card_style = """
-                <div style="background-color: {background_color}; padding: 15px; margin: 10px 0; border-radius: 5px; box-shadow: 0px 2px 5px rgba(0, 0, 0, 0.1);">
-                    <h5 style="color: #333; margin-bottom: 10px;">{title}{abnormal_tag}</h5>
-                    <div style="display: flex; justify-content: space-between; font-size: 12px; color: #555; margin-bottom: 10px;">
-                        <span><strong>当前值：</strong>{current_value}</span>
-                        <span><strong>指标区间：</strong>{range}</span>
-                        <span><strong>指标结果：</strong>{result}</span>
-                    </div>
-                    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 12px; color: #555;">
-                        <span><strong>指标解读：</strong>{interpretation}</span>
-                        <span><strong>用药建议：</strong>{recommendation}</span>
-                        <span><strong>参考文件(仅作示意)：</strong>{reference}</span>
-                    </div>
-                </div>
-                """
-                without_recommendation_card_style = """
-                <div style="background-color: {background_color}; padding: 15px; margin: 10px 0; border-radius: 5px; box-shadow: 0px 2px 5px rgba(0, 0, 0, 0.1);">
-                    <h5 style="color: #333; margin-bottom: 10px; ">{title}{abnormal_tag}</h5>
-                    <div style="display: flex; justify-content: space-between; font-size: 12px; color: #555; margin-bottom: 10px;">
-                        <span><strong>当前值：</strong>{current_value}</span>
-                        <span><strong>指标区间：</strong>{range}</span>
-                        <span><strong>指标结果：</strong>{result}</span>
-                    </div>
-                    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 12px; color: #555;">
-                        <span><strong>指标解读：</strong>{interpretation}</span>
-                        <span><strong>参考文件(仅作示意)：</strong>{reference}</span>
-                    </div>
-                </div>
-                """
-
-                for indicator, analysis in analysis_results.items():
-                    # 判断是否异常并设置背景颜色
-                    background_color = "#f9f9f9"  # 默认背景色
-                    abnormal_tag = ""  # 默认没有异常提示
-                    if analysis["是否异常"]:
-                        background_color = "#ffe6e6"  # 浅红色背景
-                        abnormal_tag = """<span style="background-color: #ff0000; color: #fff; padding: 2px 8px; border-radius: 3px; font-size: 12px; margin-left: 20px;">
-                                          异常
-                                          </span>"""
-
-                    # 如果 interpretation 为空，则不渲染该字段
-                    if analysis["用药建议"]:
-                        st.markdown(
-                            full_card_style.format(
-                                background_color=background_color,
-                                title=analysis["标题"],
-                                abnormal_tag=abnormal_tag,
-                                current_value=analysis["当前值"],
-                                range=analysis["参考区间"],
-                                result=analysis["指标结果"],
-                                interpretation=analysis["指标解读"],
-                                recommendation=analysis["用药建议"],
-                                reference=analysis["参考文件"],
-                            ),
-                            unsafe_allow_html=True,
-                        )
-                    else:
-                        st.markdown(
-                            without_recommendation_card_style.format(
-                                background_color=background_color,
-                                title=analysis["标题"],
-                                abnormal_tag=abnormal_tag,
-                                current_value=analysis["当前值"],
-                                range=analysis["参考区间"],
-                                result=analysis["指标结果"],
-                                interpretation=analysis["指标解读"],
-                                reference=analysis["参考文件"],
-                            ),
-                            unsafe_allow_html=True,
-                        )
-
-                    fig = plot_indicator_with_ticks(min_value=all_ranges[indicator][0], max_value=all_ranges[indicator][1],
-                                                    standard_range=analysis["正常区间范围数值"],
-                                                    current_range=analysis["当前区间范围数值"],
-                                                    current_value=analysis["当前数值"], unit=analysis["单位"],
-                                                    range_name=analysis["当前区间名称"])
-                    # 显示图表
-                    st.pyplot(fig)
-
-                # 综合分析及建议
-                st.markdown("#### 综合分析及建议")
-                # st.markdown(f"- **结论解读：** {analysis_results['summary']['conclusion']}")
-                # st.markdown(f"- **用药建议：** {analysis_results['summary']['medication']}")
-                # st.markdown(f"- **生活方式建议：** {analysis_results['summary']['lifestyle']}")
-                # st.markdown(f"- **复测建议：** {analysis_results['summary']['retest']}")
-                # st.markdown(f"- **风险提示：** {analysis_results['summary']['risk_warning']}")
-
-                # 添加免责声明
-                disclaimer_style = """
-                <div style="font-size: 12px; color: #999; margin-top: 0px;">
-                    以下内容完全由 GPT-4.0 生成，仅供参考，不构成医学建议。
-                </div>
-                """
-                st.markdown(disclaimer_style, unsafe_allow_html=True)
-
-                # 定义综合分析卡片样式
-                summary_card_style = """
-                <div style="background-color: #f0f8ff; padding: 20px; margin: 15px 0; border-radius: 10px; box-shadow: 0px 4px 8px rgba(0, 0, 0, 0.2);">
-                    <div style="display: flex; flex-direction: column; gap: 5px; font-size: 13px; color: #555;">
-                        <span><strong>结论解读：</strong>{overall_interpretation}</span>
-                        <span><strong>用药建议：</strong>{medication_recommendation}</span>
-                        <span><strong>生活方式建议：</strong>{lifestyle_recommendation}</span>
-                        <span><strong>复诊建议：</strong>{follow_up_suggestion}</span>
-                        <span><strong>参考依据：</strong>{reference}</span>
-                    </div>
-                </div>
-                """
-
-                overall_results = all_results.get("综合分析及建议", "")
-                overall_interpretation = overall_results.get("结论解读", "")
-                medication_recommendation = overall_results.get("用药建议", "")
-                lifestyle_recommendation = overall_results.get("生活方式建议", "")
-                reference = overall_results.get("参考依据", "")
-                follow_up_suggestion = overall_results.get("复诊建议", "")
-
-                # 渲染综合分析卡片
-                st.markdown(
-                    summary_card_style.format(
-                        overall_interpretation=overall_interpretation,
-                        medication_recommendation=medication_recommendation,
-                        lifestyle_recommendation=lifestyle_recommendation,
-                        follow_up_suggestion=follow_up_suggestion,
-                        reference=reference,
-                    ),
-                    unsafe_allow_html=True,
-                )
-
-                # 可视化展示
-                st.markdown("#### 数据图表")
-                st.text("更多图表... 持续更新中")
-                # st.markdown("以下为患者各项指标的变化趋势和对比分析：")
-                #
-                # col1, col2 = st.columns(2)
-                # with col1:
-                #     st.markdown("#### 当前指标变化趋势")
-                #     # 绘制趋势折线图（示例）
-                #     st.line_chart(analysis_results['trend_data'])
-                # with col2:
-                #     st.markdown("#### 全国数据对比")
-                #     # 显示柱状图或分布图（示例）
-                #     st.bar_chart(analysis_results['comparison_data'])
-
-                # st.markdown("#### 骨密度变化对比")
-                # 骨密度变化图（示例）
-                # st.line_chart(analysis_results['bone_density_trend'])
+                trend = None
+                # 人群百分位在计入本次检测之前计算，不含患者自身
+                percentiles = population_sketch.percentiles(input_data)
+                if patient_id:
+                    if history_store().add_visit(patient_id, input_data, test_date):
+                        # 每次保存的检测只归档一次（同日重复分析覆盖随访记录，不再归档）；未配置 RESULT_ARCHIVE_DIR 时不归档
+                        indicators_analysis = IndicatorsAnalysis.from_input_data(input_data)
+                        indicators_analysis.analysis()
+                        archive_analysis(indicators_analysis, test_date)
+                        # 同样只有新保存的检测计入人群百分位草图
+                        population_sketch.add_input_data(input_data)
+                    trend = history_store().trend(patient_id)
+                report_cache[(input_key, mode)] = build_report_entry(result["result"], mode, trend, percentiles,
+                                                                     range_profile)
+                record_request(time.perf_counter() - request_start)
+                # 只保留最近的若干份报告，避免会话内存无限增长
+                while len(report_cache) > REPORT_CACHE_SIZE:
+                    report_cache.pop(next(iter(report_cache)))
             else:
-                st.error(result["message"])
\ No newline at end of file
+                st.error(result["message"])
+
+    # 当前输入已有分析结果时（包括按钮点击后的任意重跑），直接从缓存重绘，不重新计算或调用大模型
+    report_mode = st.session_state.get("report_mode", "fast")
+    report_entry = report_cache.get((input_key, report_mode))
+    if report_entry is not None:
+        show_report(report_entry)
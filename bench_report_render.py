@@ -0,0 +1,82 @@
+"""
+# 对比结果页的两种渲染方式：逐卡片 st.markdown + st.pyplot 与单份内嵌图表的 HTML 报告
+# 统计发送到浏览器的渲染调用（websocket delta）次数、负载大小及服务端生成耗时
+# 使用方式: python bench_report_render.py
+"""
+import io
+import time
+
+import matplotlib.pyplot as plt
+
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+from app import (all_ranges, plot_indicator_with_ticks, render_indicator_card, indicator_disclaimer_style,
+                 summary_disclaimer_style, summary_card_style, build_report_html)
+
+
+def sample_results(mode):
+    """构造一份示例分析结果（全面模式附带固定的综合分析，不调用大模型）"""
+    indicators_analysis = IndicatorsAnalysis(age=60)
+    indicators_analysis.judge_is_male("女")
+    indicators_analysis.β_CTX.value = 0.8
+    indicators_analysis.P1NP.value = 70.0
+    indicators_analysis.VD.value = 18.0
+    indicators_analysis.N_MID.value = 30.0
+    indicators_analysis.PTH.value = 70.0
+    indicators_analysis.CT.value = 3.0
+    indicators_analysis.has_bone_density = True
+    indicators_analysis.bone_density.value = -2.8
+    indicators_analysis.init()
+    indicators_analysis.analysis()
+    all_results = {"指标逐一分析": indicators_analysis.to_dict(containing_is_abnormal=True)}
+    if mode == "slow":
+        all_results["综合分析及建议"] = {field: "示例内容" * 40 for field in
+                                     ["结论解读", "用药建议", "生活方式建议", "参考依据", "复诊建议"]}
+    return all_results
+
+
+def render_per_card(all_results, mode):
+    """原实现：每张卡片一次 st.markdown，每张图表一次 st.pyplot；返回 (delta 次数, 负载字节数)"""
+    payloads = ["分析完成！以下为详细结果：", "#### 指标逐一分析", indicator_disclaimer_style]
+    for indicator, analysis in all_results["指标逐一分析"].items():
+        payloads.append(render_indicator_card(analysis))
+        fig = plot_indicator_with_ticks(min_value=all_ranges[indicator][0], max_value=all_ranges[indicator][1],
+                                        standard_range=analysis["正常区间范围数值"],
+                                        current_range=analysis["当前区间范围数值"],
+                                        current_value=analysis["当前数值"], unit=analysis["单位"],
+                                        range_name=analysis["当前区间名称"])
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")  # 与 st.pyplot 的默认参数一致
+        plt.close(fig)
+        payloads.append(buffer.getvalue())
+    if mode == "slow":
+        overall_results = all_results["综合分析及建议"]
+        payloads += ["#### 综合分析及建议", summary_disclaimer_style.format(model="GPT-4.0"), summary_card_style.format(
+            overall_interpretation=overall_results["结论解读"],
+            medication_recommendation=overall_results["用药建议"],
+            lifestyle_recommendation=overall_results["生活方式建议"],
+            follow_up_suggestion=overall_results["复诊建议"],
+            reference=overall_results["参考依据"],
+        )]
+    payloads += ["#### 数据图表", "更多图表... 持续更新中"]
+    size = sum(len(p) if isinstance(p, bytes) else len(p.encode("utf-8")) for p in payloads)
+    return len(payloads), size
+
+
+def render_single_document(all_results, mode):
+    """新实现：整份报告一次 st.markdown；返回 (delta 次数, 负载字节数)"""
+    return 1, len(build_report_html(all_results, mode).encode("utf-8"))
+
+
+def bench(render, all_results, mode, repeat=10):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        deltas, size = render(all_results, mode)
+    return deltas, size, (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    for mode in ["fast", "slow"]:
+        all_results = sample_results(mode)
+        for name, render in [("逐卡片渲染", render_per_card), ("单文档渲染", render_single_document)]:
+            deltas, size, elapsed_ms = bench(render, all_results, mode)
+            print(f"[{mode}] {name}: delta 次数 {deltas}, 负载 {size / 1024:.1f} KB, 生成耗时 {elapsed_ms:.1f} ms")
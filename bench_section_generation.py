@@ -0,0 +1,66 @@
+"""
+# 对比综合分析的两种生成方式：一次生成五个字段（single）与每个字段一个并发请求（parallel）
+# 统计端到端耗时、prompt/completion token 以及命中缓存的 prompt token
+# 使用方式: python bench_section_generation.py --model gpt-4o-mini --rounds 5
+#          python bench_section_generation.py --stub   （不调用大模型，按输出长度模拟生成耗时）
+"""
+import argparse
+import statistics
+import time
+
+from analysis_module import ai_agent
+from analysis_module.indicators_anlaysis import IndicatorsAnalysis
+from analysis_module.stub_llm import install_stub_llm
+from analysis_module.summary_classifier import render_local_summary
+from analysis_module.warmup import SAMPLE_INPUT_DATA
+
+
+def build_input_message():
+    indicators_analysis = IndicatorsAnalysis.from_input_data(SAMPLE_INPUT_DATA)
+    indicators_analysis.analysis()
+    patient_info = SAMPLE_INPUT_DATA["patient_info"]
+    input_message = {"患者基本信息": {"患者性别": patient_info["gender"], "患者年龄": patient_info["age"]},
+                     "骨代谢检验数据": indicators_analysis.to_dict(containing_is_abnormal=False)}
+    return input_message, render_local_summary(indicators_analysis.overall)
+
+
+def run(mode, input_message, model, rounds):
+    latencies, usages = [], []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        if mode == "parallel":
+            _, usage = ai_agent.get_completion_parallel(input_message, model=model, return_usage=True,
+                                                        failure_policy="raise")
+        else:
+            _, usage = ai_agent.get_completion(input_message, model=model, return_usage=True)
+        latencies.append(time.perf_counter() - start)
+        usages.append(usage)
+    return {
+        "mode": mode,
+        "p50_seconds": statistics.median(latencies),
+        "max_seconds": max(latencies),
+        "prompt_tokens": statistics.mean(usage["prompt_tokens"] for usage in usages),
+        "cached_tokens": statistics.mean(usage["cached_tokens"] for usage in usages),
+        "completion_tokens": statistics.mean(usage["completion_tokens"] for usage in usages),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="综合分析 single / parallel 生成方式对比")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--stub", action="store_true", help="使用模拟大模型")
+    parser.add_argument("--stub-first-token", type=float, default=0.5, help="模拟首 token 延迟（秒）")
+    parser.add_argument("--stub-per-char", type=float, default=0.005, help="模拟每个输出字符的耗时（秒）")
+    args = parser.parse_args()
+
+    input_message, local_summary = build_input_message()
+    if args.stub:
+        install_stub_llm(latency=f"fixed:{args.stub_first_token}", seconds_per_char=args.stub_per_char,
+                         summary=local_summary)
+
+    print(f"{'mode':<10}{'p50 s':>8}{'max s':>8}{'prompt':>10}{'cached':>10}{'completion':>12}")
+    for mode in ("single", "parallel"):
+        report = run(mode, input_message, args.model, args.rounds)
+        print(f"{report['mode']:<10}{report['p50_seconds']:>8.2f}{report['max_seconds']:>8.2f}"
+              f"{report['prompt_tokens']:>10.0f}{report['cached_tokens']:>10.0f}{report['completion_tokens']:>12.0f}")
@@ -0,0 +1,108 @@
+"""
+# api_server.py 的压测脚本，统计持续吞吐量（requests/s）与 p50/p95/p99 延迟
+# 每个并发线程复用一条 keep-alive 连接，并请求 gzip 压缩的响应；--binary 时请求与响应改用 result_codec 的二进制编码
+# 使用方式: python load_test.py --url http://127.0.0.1:8600 --mode fast --concurrency 16 --duration 30
+"""
+import argparse
+import gzip
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+from analysis_module import result_codec
+
+sample_input_data = {
+    "patient_info": {"gender": "男", "age": 35, "height": 0.0, "weight": 0.0},
+    "biochemical_indicators": {
+        "β-CTX": 1.0,
+        "P1NP": 33.0,
+        "25-Hydroxy Vitamin D": 20.0,
+        "N-MID Osteocalcin": 15.0,
+        "Parathyroid Hormone": 27.0,
+        "Calcitonin": 1.0,
+    },
+    "imaging_data": {"Bone Density": -1.0},
+    "medical_history": {"history": "", "medications": "", "testing_time": ""},
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def worker(host, port, path, body, deadline, latencies, errors, lock, binary=False):
+    connection = http.client.HTTPConnection(host, port, timeout=120)
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip", "Connection": "keep-alive"}
+    if binary:
+        headers.update({"Content-Type": result_codec.CONTENT_TYPE, "Accept": result_codec.CONTENT_TYPE})
+    local_latencies = []
+    local_errors = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body, headers=headers)
+            response = connection.getresponse()
+            raw = response.read()
+            if response.getheader("Content-Encoding") == "gzip":
+                raw = gzip.decompress(raw)
+            if response.status != 200 or result_codec.decode(raw).get("status") != "success":
+                local_errors += 1
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=120)
+            continue
+        local_latencies.append(time.perf_counter() - start)
+    connection.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def run(url, mode, concurrency, duration, bulk_size, binary=False):
+    parsed = urlparse(url)
+    if bulk_size > 0:
+        path = "/v1/analysis/bulk"
+        payload = {"mode": mode, "patients": [sample_input_data] * bulk_size}
+    else:
+        path = f"/v1/analysis/{mode}"
+        payload = sample_input_data
+    body = result_codec.encode(payload) if binary else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=worker,
+                                args=(parsed.hostname, parsed.port or 80, path, body, deadline, latencies, errors, lock,
+                                      binary))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    completed = len(latencies)
+    print(f"接口: {path}  并发: {concurrency}  持续时间: {elapsed:.1f}s" + (f"  每批患者数: {bulk_size}" if bulk_size else ""))
+    print(f"完成请求: {completed}  失败: {sum(errors)}  吞吐量: {completed / elapsed:.1f} req/s"
+          + (f" ({completed * bulk_size / elapsed:.1f} patients/s)" if bulk_size else ""))
+    print(f"延迟 p50: {percentile(latencies, 50) * 1000:.1f} ms  p95: {percentile(latencies, 95) * 1000:.1f} ms  "
+          f"p99: {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="骨代谢AI分析 HTTP 服务压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8600")
+    parser.add_argument("--mode", choices=["fast", "slow"], default="fast")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="压测持续秒数")
+    parser.add_argument("--bulk-size", type=int, default=0, help="大于0时改为压测批量接口，每个请求包含的患者数")
+    parser.add_argument("--binary", action="store_true", help="请求与响应使用 result_codec 的二进制编码")
+    args = parser.parse_args()
+    run(args.url, args.mode, args.concurrency, args.duration, args.bulk_size, args.binary)
@@ -0,0 +1,100 @@
+"""
+# 检验质控看板：按日期、科室查看各指标异常率、结果类型及总体分型分布
+# 只读取各进程由 abnormality_counters 定期写出的快照文件并求和，不扫描历史检测记录
+"""
+import os
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+import streamlit as st
+
+from analysis_module.abnormality_counters import SNAPSHOT_DIR, INDICATORS, OVERALL_FIELDS, KIND_CASES, KIND_TESTED, \
+    KIND_ABNORMAL, KIND_RESULT, KIND_OVERALL, SNAPSHOT_INTERVAL_SECONDS, load_snapshot, snapshot_paths
+
+SNAPSHOT_COLUMNS = ["date", "department", "kind", "name", "value", "count"]
+
+
+@st.cache_data(ttl=SNAPSHOT_INTERVAL_SECONDS, show_spinner=False)
+def snapshot_frame(snapshots: tuple):
+    """
+    各进程的快照合并为一个 DataFrame，相同计数键的次数相加
+    snapshots 为 ((路径, 修改时间), ...)，修改时间参与缓存键，任一快照更新后重新读取
+
+    Returns:
+        (DataFrame, 最近一次快照时间)
+    """
+    frames, generated_at = [], 0.0
+    for path, _ in snapshots:
+        try:
+            snapshot = load_snapshot(path)
+        except (OSError, ValueError):
+            # 快照可能在列出后被删除
+            continue
+        frames.append(pd.DataFrame(snapshot["rows"], columns=SNAPSHOT_COLUMNS))
+        generated_at = max(generated_at, snapshot["generated_at"])
+    frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=SNAPSHOT_COLUMNS)
+    frame = frame.groupby(SNAPSHOT_COLUMNS[:-1], as_index=False)["count"].sum()
+    return frame, generated_at
+
+
+st.set_page_config(page_title="检验质控看板", layout="wide")
+st.title("检验质控看板")
+
+paths = snapshot_paths()
+if not paths:
+    st.info(f"尚无统计快照（{SNAPSHOT_DIR}），完成分析后约 {SNAPSHOT_INTERVAL_SECONDS} 秒内生成。")
+    st.stop()
+
+frame, generated_at = snapshot_frame(tuple((path, os.path.getmtime(path)) for path in paths if os.path.exists(path)))
+st.caption(f"快照更新时间：{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(generated_at))}（合并 {len(paths)} 个进程），"
+           f"每 {SNAPSHOT_INTERVAL_SECONDS} 秒刷新")
+
+col1, col2 = st.columns(2)
+with col1:
+    date_range = st.date_input("日期范围", (date.today() - timedelta(days=29), date.today()))
+with col2:
+    departments = st.multiselect("科室", sorted(frame["department"].unique()), placeholder="全部科室")
+if len(date_range) != 2:
+    st.stop()
+
+selected = frame[(frame["date"] >= date_range[0].isoformat()) & (frame["date"] <= date_range[1].isoformat())]
+if departments:
+    selected = selected[selected["department"].isin(departments)]
+cases = selected[selected["kind"] == KIND_CASES]
+st.metric("检测例数", int(cases["count"].sum()))
+if cases.empty:
+    st.stop()
+
+# 各指标异常率：异常次数 / 检测次数，按科室分列
+st.markdown("### 各指标异常率")
+tested = selected[selected["kind"] == KIND_TESTED].groupby(["name", "department"])["count"].sum()
+abnormal = selected[selected["kind"] == KIND_ABNORMAL].groupby(["name", "department"])["count"].sum()
+rates = (abnormal.reindex(tested.index, fill_value=0) / tested).unstack("department")
+rates["合计"] = abnormal.groupby("name").sum().reindex(rates.index, fill_value=0) / tested.groupby("name").sum()
+rates = rates.reindex([name for name in INDICATORS if name in rates.index]).rename(index=INDICATORS)
+st.dataframe(rates.style.format("{:.1%}", na_rep="-"), width="stretch")
+
+# 单个指标的每日异常率
+indicator = st.selectbox("每日异常率", list(INDICATORS), format_func=INDICATORS.get)
+daily_tested = selected[(selected["kind"] == KIND_TESTED) & (selected["name"] == indicator)].groupby("date")["count"].sum()
+daily_abnormal = selected[(selected["kind"] == KIND_ABNORMAL) & (selected["name"] == indicator)] \
+    .groupby("date")["count"].sum().reindex(daily_tested.index, fill_value=0)
+st.line_chart((daily_abnormal / daily_tested).rename("异常率"))
+
+col1, col2 = st.columns(2)
+with col1:
+    # 各指标的结果类型分布（如 高动力型、维生素D缺乏）
+    st.markdown("### 指标结果类型")
+    results = selected[selected["kind"] == KIND_RESULT].groupby(["name", "value"])["count"].sum().reset_index()
+    results["name"] = results["name"].map(INDICATORS)
+    st.dataframe(results.rename(columns={"name": "指标", "value": "结果", "count": "例数"}),
+                 hide_index=True, width="stretch")
+with col2:
+    # 总体分型分布（骨转换类型、维生素D状态、PTH状态、骨密度分级）
+    st.markdown("### 总体分型")
+    overall = selected[selected["kind"] == KIND_OVERALL].groupby(["name", "value"])["count"].sum().reset_index()
+    overall["name"] = overall["name"].map(OVERALL_FIELDS)
+    overall["比例"] = overall["count"] / int(cases["count"].sum())
+    st.dataframe(overall.rename(columns={"name": "分型", "value": "结果", "count": "例数"})
+                 .style.format({"比例": "{:.1%}"}), hide_index=True, width="stretch")
@@ -0,0 +1,178 @@
+"""
+# 批量工作列表：上传一批患者的 CSV，一次评分后以分页、可排序的表格查看各行的异常指标
+# 表格只含按列保存的评分结果；选中某一行时才重新计算该行并绘制指标卡片与图示
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from analysis_module.abnormality_counters import INDICATORS, OVERALL_FIELDS
+from analysis_module.batch_export import write_parquet, iter_scored_chunks
+from analysis_module.batch_scoring import INPUT_FIELDS, ID_FIELD, score_batch, analyze_row
+from analysis_module.batch_validation import REASON_MISSING, REASON_NOT_NUMERIC, REASON_NOT_POSITIVE, \
+    REASON_OUT_OF_RANGE, REASON_INVALID_GENDER
+from analysis_module.range_profiles import profile_cache, DEFAULT_PROFILE_NAME
+from app import form_field_labels, indicator_disclaimer_style, render_indicator_card, render_indicator_chart, \
+    render_inline_chart
+
+PAGE_SIZES = (25, 50, 100)
+ROW_COLUMN = "行号"
+ABNORMAL_COUNT_COLUMN = "异常项数"
+# 校验错误原因的显示文字
+REASON_LABELS = {
+    REASON_MISSING: "缺失",
+    REASON_NOT_NUMERIC: "不是数值",
+    REASON_NOT_POSITIVE: "需大于0",
+    REASON_OUT_OF_RANGE: "超出合理范围",
+    REASON_INVALID_GENDER: "性别应为“男”或“女”",
+}
+FIELD_LABELS = {"gender": "性别", "age": "年龄", **form_field_labels}
+# 模板中的示例行
+TEMPLATE_ROWS = [["P000001", "女", 65, 0.8, 70, 18, 30, 70, 3, -2.8],
+                 ["P000002", "男", 52, 0.35, 45, 32, 18, 40, 5, ""]]
+
+
+def abnormal_column(attribute):
+    return f"{attribute}_abnormal"
+
+
+@st.cache_data(show_spinner="评分中...", max_entries=4)
+def score_upload(data: bytes, range_profile: str):
+    """
+    读取上传的 CSV 并批量评分，按文件内容与参考区间配置缓存
+
+    Returns:
+        (结果表, 校验错误表, 各列取值, ScoredBatch)；结果表每行一个有效患者，行号为 CSV 中的数据行号（从 1 开始）
+    """
+    upload = pd.read_csv(io.BytesIO(data), dtype={ID_FIELD: str, "gender": str}, encoding="utf-8-sig",
+                         skipinitialspace=True)
+    columns = {name.strip(): upload[name].to_numpy() for name in upload.columns}
+    # 评分时计入异常计数；同一文件再次打开命中缓存，不重复计数
+    scored = score_batch(columns, range_profile)
+
+    table = {ROW_COLUMN: scored.rows + 1, "患者编号": scored.patient_ids,
+             "性别": np.where(scored.is_male, "男", "女"), "年龄": scored.ages,
+             ABNORMAL_COUNT_COLUMN: scored.abnormal_count}
+    for attribute, name in INDICATORS.items():
+        table[name] = scored.values[attribute]
+        table[f"{name}结果"] = scored.results[attribute]
+    for overall_field, name in OVERALL_FIELDS.items():
+        table[name] = scored.overall[overall_field]
+    # 是否异常的列只用于标色与筛选，不显示
+    for attribute in INDICATORS:
+        table[abnormal_column(attribute)] = scored.abnormal[attribute]
+
+    errors = scored.validation.errors
+    error_table = pd.DataFrame({
+        ROW_COLUMN: errors["row"] + 1,
+        "字段": [FIELD_LABELS.get(str(field), str(field)) for field in errors["field"]],
+        "原因": [REASON_LABELS.get(str(reason), str(reason)) for reason in errors["reason"]],
+    })
+    return pd.DataFrame(table), error_table, columns, scored
+
+
+def results_parquet(scored, columns, range_profile: str, include_texts: bool) -> bytes:
+    """
+    整批评分结果导出为 Parquet（列说明见 analysis_module.batch_export），点击下载时才生成
+    直接使用已评分的列；展开文本未随评分保存，含展开文本时才按块重新评分
+    """
+    buffer = io.BytesIO()
+    write_parquet(iter_scored_chunks(columns, range_profile, texts=True) if include_texts else scored, buffer)
+    return buffer.getvalue()
+
+
+@st.cache_data(max_entries=64)
+def row_detail_html(data: bytes, range_profile: str, row: int):
+    """单行的指标卡片与图示（与单人报告的“指标逐一分析”相同）"""
+    _, _, columns, _ = score_upload(data, range_profile)
+    indicators_analysis = analyze_row(columns, row, range_profile)
+    blocks = [indicator_disclaimer_style]
+    for indicator, analysis in indicators_analysis.to_dict(containing_is_abnormal=True).items():
+        blocks.append(render_indicator_card(analysis))
+        blocks.append(render_inline_chart(render_indicator_chart(indicator, analysis)))
+    return "\n\n".join(block.strip() for block in blocks)
+
+
+def highlight_abnormal(page: pd.DataFrame):
+    """异常指标的检测值与结果标为浅红色（与指标卡片一致）"""
+    styles = pd.DataFrame("", index=page.index, columns=page.columns)
+    for attribute, name in INDICATORS.items():
+        mask = page[abnormal_column(attribute)].to_numpy()
+        styles.loc[mask, [name, f"{name}结果"]] = "background-color: #ffe6e6"
+    return styles
+
+
+st.set_page_config(page_title="批量工作列表", layout="wide")
+st.title("批量工作列表")
+st.caption("上传一批患者的检测结果（CSV，UTF-8 编码），逐行评分后按异常指标查看；在表格中选中一行查看该患者的指标卡片与图示。")
+
+range_profile = st.sidebar.selectbox("参考区间配置", profile_cache.available_profiles(),
+                                     index=profile_cache.available_profiles().index(DEFAULT_PROFILE_NAME))
+template = pd.DataFrame(TEMPLATE_ROWS, columns=INPUT_FIELDS).to_csv(index=False).encode("utf-8-sig")
+st.download_button("下载 CSV 模板", template, file_name="worklist_template.csv", mime="text/csv")
+uploaded = st.file_uploader("上传 CSV", type="csv")
+if uploaded is None:
+    st.stop()
+
+data = uploaded.getvalue()
+try:
+    table, error_table, columns, scored = score_upload(data, range_profile)
+except (ValueError, UnicodeDecodeError) as e:
+    st.error(f"无法读取上传的文件：{str(e)}")
+    st.stop()
+
+col1, col2, col3 = st.columns(3)
+col1.metric("有效行数", len(table))
+col2.metric("含异常指标", int((table[ABNORMAL_COUNT_COLUMN] > 0).sum()))
+col3.metric("未通过校验", error_table[ROW_COLUMN].nunique())
+if len(error_table):
+    with st.expander(f"未通过校验的行（{error_table[ROW_COLUMN].nunique()} 行，未参与评分）"):
+        st.dataframe(error_table, hide_index=True, width="stretch")
+if table.empty:
+    st.stop()
+
+# 筛选与排序作用于整批数据，再分页显示
+col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+with col1:
+    sort_column = st.selectbox("排序", [ROW_COLUMN, ABNORMAL_COUNT_COLUMN, "年龄", *INDICATORS.values()])
+with col2:
+    abnormal_filter = st.multiselect("只看以下指标异常的行", list(INDICATORS), format_func=INDICATORS.get,
+                                     placeholder="全部行")
+with col3:
+    descending = st.toggle("降序", value=sort_column == ABNORMAL_COUNT_COLUMN)
+with col4:
+    page_size = st.selectbox("每页行数", PAGE_SIZES, index=1)
+
+selected = table
+if abnormal_filter:
+    selected = selected[selected[[abnormal_column(attribute) for attribute in abnormal_filter]].any(axis=1)]
+selected = selected.sort_values(sort_column, ascending=not descending, kind="stable", na_position="last")
+page_count = max(1, -(-len(selected) // page_size))
+page_number = st.number_input(f"页码（共 {page_count} 页，{len(selected)} 行）", min_value=1, max_value=page_count,
+                              value=1, step=1)
+page = selected.iloc[(page_number - 1) * page_size:page_number * page_size]
+
+hidden_columns = [abnormal_column(attribute) for attribute in INDICATORS]
+event = st.dataframe(
+    page.style.apply(highlight_abnormal, axis=None).format(precision=2, na_rep="-"),
+    column_order=[column for column in page.columns if column not in hidden_columns],
+    hide_index=True, width="stretch", on_select="rerun", selection_mode="single-row",
+    key=f"worklist-{sort_column}-{descending}-{page_size}-{page_number}-{abnormal_filter}",
+)
+
+if event.selection.rows:
+    row = page.iloc[event.selection.rows[0]]
+    title = f"第 {row[ROW_COLUMN]} 行" + (f"（患者编号 {row['患者编号']}）" if row["患者编号"] else "")
+    with st.expander(title, expanded=True):
+        st.markdown(row_detail_html(data, range_profile, int(row[ROW_COLUMN]) - 1), unsafe_allow_html=True)
+
+# 导出放在最后，表格先显示
+col1, col2 = st.columns([1, 3], vertical_alignment="center")
+with col2:
+    include_texts = st.checkbox("导出时包含指标解读、用药建议等文本")
+with col1:
+    st.download_button("下载评分结果（Parquet）",
+                       lambda: results_parquet(scored, columns, range_profile, include_texts),
+                       file_name="worklist_results.parquet", mime="application/vnd.apache.parquet")
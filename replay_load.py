@@ -0,0 +1,127 @@
+"""
+# 按录制的请求（ANALYSIS_RECORD_FILE 生成的 JSONL）回放负载，评估门诊开诊等高峰时段的容量
+# 按录制时的请求间隔发送，--speed 可整体加速（例如 3 表示 3 倍速率）；默认在进程内调用 ai_analysis 并使用模拟大模型
+# 延迟从计划发送时刻算起，包含客户端排队时间，避免压测端跟不上时低估延迟
+# 使用方式: python replay_load.py recording.jsonl --speed 3 --stub-latency lognormal:8,0.4
+#          python replay_load.py recording.jsonl --url http://127.0.0.1:8600   （服务端用 --stub-llm 启动）
+"""
+import argparse
+import gzip
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from load_test import percentile
+from analysis_module.request_recorder import load_recording
+from analysis_module.stub_llm import install_stub_llm
+
+
+class InProcessTarget:
+    def __init__(self):
+        from ai_analysis import ai_analysis
+        self.ai_analysis = ai_analysis
+
+    def send(self, mode, input_data) -> bool:
+        return self.ai_analysis(input_data, mode).get("status") == "success"
+
+
+class HttpTarget:
+    """每个线程复用一条 keep-alive 连接"""
+
+    def __init__(self, url, timeout=300):
+        parsed = urlparse(url)
+        self.host, self.port, self.timeout = parsed.hostname, parsed.port or 80, timeout
+        self._local = threading.local()
+
+    def send(self, mode, input_data) -> bool:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        body = json.dumps(input_data, ensure_ascii=False).encode("utf-8")
+        try:
+            connection.request("POST", f"/v1/analysis/{mode}", body=body,
+                               headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+            response = connection.getresponse()
+            raw = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            return False
+        if response.getheader("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        return response.status == 200 and json.loads(raw).get("status") == "success"
+
+
+def replay(records, target, speed=1.0, concurrency=64):
+    """
+    按录制时间间隔 / speed 发送请求
+
+    Returns:
+        (结果列表 [(mode, 是否成功, 延迟秒数)], 总耗时)
+    """
+    records = sorted(records, key=lambda record: record["ts"])
+    if not records:
+        return [], 0.0
+    first_ts = records[0]["ts"]
+    results, lock = [], threading.Lock()
+
+    def run_one(record, scheduled_at):
+        try:
+            ok = target.send(record["mode"], record["input_data"])
+        except Exception as e:
+            print(f"Replay request failed: {str(e)}")
+            ok = False
+        latency = time.perf_counter() - scheduled_at
+        with lock:
+            results.append((record["mode"], ok, latency))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            scheduled_at = start + (record["ts"] - first_ts) / speed
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run_one, record, scheduled_at)
+    return results, time.perf_counter() - start
+
+
+def print_report(results, elapsed):
+    print(f"回放请求: {len(results)}  总耗时: {elapsed:.1f}s")
+    for mode in ("fast", "slow"):
+        mode_results = [result for result in results if result[0] == mode]
+        if not mode_results:
+            continue
+        latencies = sorted(latency for _, _, latency in mode_results)
+        errors = sum(not ok for _, ok, _ in mode_results)
+        print(f"[{mode}] 请求: {len(mode_results)}  吞吐量: {len(mode_results) / elapsed:.2f} req/s  "
+              f"错误率: {errors / len(mode_results):.2%}")
+        print(f"[{mode}] 延迟 p50: {percentile(latencies, 50) * 1000:.1f} ms  "
+              f"p95: {percentile(latencies, 95) * 1000:.1f} ms  p99: {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="录制请求回放压测")
+    parser.add_argument("recording", help="ANALYSIS_RECORD_FILE 录制的 JSONL 文件")
+    parser.add_argument("--url", default="", help="api_server 地址；为空时在进程内调用 ai_analysis")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速率倍数")
+    parser.add_argument("--concurrency", type=int, default=64, help="最大并发请求数")
+    parser.add_argument("--limit", type=int, default=0, help="只回放前 N 条")
+    parser.add_argument("--stub-latency", default="lognormal:8,0.4", help="进程内回放时模拟大模型的延迟分布")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0, help="进程内回放时模拟大模型的错误率")
+    parser.add_argument("--real-llm", action="store_true", help="进程内回放时调用真实大模型（会产生费用）")
+    args = parser.parse_args()
+
+    records = list(load_recording(args.recording))
+    if args.limit:
+        records = records[:args.limit]
+    if args.url:
+        target = HttpTarget(args.url)
+    else:
+        if not args.real_llm:
+            install_stub_llm(latency=args.stub_latency, error_rate=args.stub_error_rate)
+        target = InProcessTarget()
+    print_report(*replay(records, target, args.speed, args.concurrency))